@@ -40,6 +40,30 @@ def create_app(config_name='default'):
     app.register_blueprint(configuracion.bp)
     app.register_blueprint(usuarios.bp)
     
+    # Caché de disponibilidad de agenda (invalidada por eventos de sesión)
+    from app.utils.disponibilidad import init_cache_disponibilidad
+    init_cache_disponibilidad(app)
+    
+    # Búsqueda de pacientes por trigramas
+    from app.utils.busqueda_pacientes import init_busqueda_pacientes
+    init_busqueda_pacientes(app)
+    
+    # Caché de tableros de los dashboards (TTL corto + invalidación por eventos)
+    from app.utils.estadisticas import init_cache_dashboard
+    init_cache_dashboard(app)
+
+    # Matriz de precios de procedimientos (invalidada por eventos de sesión)
+    from app.utils.precios import init_cache_precios
+    init_cache_precios(app)
+
+    # Búsqueda de texto completo en consultas (documento mantenido en cada flush)
+    from app.utils.busqueda_clinica import init_busqueda_clinica
+    init_busqueda_clinica(app)
+
+    # Resumen de insumos a reponer (invalidado por eventos de sesión)
+    from app.utils.reposicion import init_cache_reposicion
+    init_cache_reposicion(app)
+    
     # Context processor para menú dinámico
     @app.context_processor
     def inject_menu():
@@ -2,10 +2,11 @@
 from app.models.usuario import Usuario, Paciente, Especialidad, Medico, MedicoEspecialidad, HorarioAtencion
 from app.models.consultorio import (
     Cita, Consulta, Receta, OrdenEstudio, Insumo, InsumoEspecialidad,
-    ConsultaInsumo, MovimientoInsumo, Procedimiento, ConsultaProcedimiento,
-    Odontograma, Tratamiento, TratamientoSesion, TratamientoSesionProcedimiento
+    ConsultaInsumo, MovimientoInsumo, SaldoInsumo, PronosticoInsumo, Procedimiento, ConsultaProcedimiento,
+    Odontograma, OdontogramaActual, EventoDiente,
+    Tratamiento, TratamientoSesion, TratamientoSesionProcedimiento
 )
-from app.models.consultorio import ProcedimientoPrecio
+from app.models.consultorio import ProcedimientoPrecio, ProcedimientoInsumo
 from app.models.facturacion import (
     Caja, Venta, VentaDetalle, FormaPago, Pago
 )
@@ -16,8 +17,9 @@ from app.models.auditoria import AuditLog
 __all__ = [
     'Usuario', 'Paciente', 'Especialidad', 'Medico', 'MedicoEspecialidad', 'HorarioAtencion',
     'Cita', 'Consulta', 'Receta', 'OrdenEstudio', 'Insumo', 'InsumoEspecialidad',
-    'ConsultaInsumo', 'MovimientoInsumo', 'Procedimiento', 'ConsultaProcedimiento', 'Odontograma',
-    'ProcedimientoPrecio', 'Tratamiento', 'TratamientoSesion', 'TratamientoSesionProcedimiento',
+    'ConsultaInsumo', 'MovimientoInsumo', 'SaldoInsumo', 'PronosticoInsumo', 'Procedimiento', 'ConsultaProcedimiento', 'Odontograma',
+    'OdontogramaActual', 'EventoDiente', 'ProcedimientoPrecio', 'ProcedimientoInsumo',
+    'Tratamiento', 'TratamientoSesion', 'TratamientoSesionProcedimiento',
     'Caja', 'Venta', 'VentaDetalle', 'FormaPago', 'Pago',
     'Vacacion', 'Permiso', 'Asistencia', 'ConfiguracionConsultorio',
     'AuditLog'
@@ -1,10 +1,22 @@
 from app import db
 from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.ext.hybrid import hybrid_property
 from app.models.usuario import Paciente, Medico, Especialidad
 
 class Cita(db.Model):
     """Modelo para citas médicas"""
     __tablename__ = 'citas'
+    __table_args__ = (
+        # Un médico no puede tener dos citas activas en el mismo horario
+        db.Index(
+            'ux_citas_medico_horario_activo', 'medico_id', 'fecha', 'hora',
+            unique=True,
+            postgresql_where=db.text("estado IN ('pendiente', 'confirmada')"),
+            sqlite_where=db.text("estado IN ('pendiente', 'confirmada')")
+        ),
+        db.UniqueConstraint('token_solicitud', name='uq_citas_token_solicitud'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), nullable=False)
@@ -19,6 +31,8 @@ class Cita(db.Model):
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     fecha_confirmacion = db.Column(db.DateTime)
     usuario_registro_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
+    # Token de idempotencia del formulario que creó la cita (evita duplicados por reenvío)
+    token_solicitud = db.Column(db.String(64))
     
     # Relaciones (paciente y medico vienen por backref desde usuario.py)
     consulta = db.relationship('Consulta', backref='cita', uselist=False, lazy=True)
@@ -30,6 +44,13 @@ class Cita(db.Model):
 class Consulta(db.Model):
     """Modelo para consultas médicas"""
     __tablename__ = 'consultas'
+    __table_args__ = (
+        # Paginación por cursor del listado de consultas (general y por médico)
+        db.Index('ix_consultas_fecha_id', 'fecha', 'id'),
+        db.Index('ix_consultas_medico_fecha_id', 'medico_id', 'fecha', 'id'),
+        # Historial del paciente (app.utils.historial)
+        db.Index('ix_consultas_paciente_fecha_id', 'paciente_id', 'fecha', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cita_id = db.Column(db.Integer, db.ForeignKey('citas.id'), unique=True)
@@ -50,6 +71,10 @@ class Consulta(db.Model):
     
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Documento de búsqueda de texto completo (tsvector en PostgreSQL), mantenido
+    # por app.utils.busqueda_clinica; diferido para no leerlo en cada carga
+    busqueda = db.deferred(db.Column(db.Text().with_variant(TSVECTOR(), 'postgresql')))
+    
     # Relaciones
     recetas = db.relationship('Receta', backref='consulta', lazy=True)
     insumos_usados = db.relationship('ConsultaInsumo', backref='consulta', lazy=True)
@@ -62,14 +87,18 @@ class Consulta(db.Model):
         return f'<Consulta {self.id} - {self.fecha}>'
 
 class Odontograma(db.Model):
-    """Snapshot de odontograma asociado a una consulta."""
+    """Snapshot de odontograma asociado a una consulta (formato compacto, ver app.utils.odontograma)."""
     __tablename__ = 'odontogramas'
+    __table_args__ = (
+        db.Index('ix_odontogramas_paciente_fecha', 'paciente_id', 'fecha'),
+        db.Index('ix_odontogramas_consulta_id', 'consulta_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     consulta_id = db.Column(db.Integer, db.ForeignKey('consultas.id'), nullable=False)
     paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), nullable=False)
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
-    datos = db.Column(db.JSON, nullable=False)
+    datos = db.Column(db.JSON().with_variant(JSONB(), 'postgresql'), nullable=False)
 
     consulta = db.relationship('Consulta', backref='odontogramas', lazy=True)
     paciente = db.relationship('Paciente', foreign_keys=[paciente_id])
@@ -77,9 +106,49 @@ class Odontograma(db.Model):
     def __repr__(self):
         return f'<Odontograma C:{self.consulta_id}>'
 
+class OdontogramaActual(db.Model):
+    """Estado actual de la boca de un paciente: copia de su último odontograma."""
+    __tablename__ = 'odontogramas_actuales'
+
+    paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), primary_key=True)
+    odontograma_id = db.Column(db.Integer, db.ForeignKey('odontogramas.id'), nullable=False)
+    fecha = db.Column(db.DateTime, nullable=False)
+    datos = db.Column(db.JSON().with_variant(JSONB(), 'postgresql'), nullable=False)
+
+    odontograma = db.relationship('Odontograma', foreign_keys=[odontograma_id])
+
+    def __repr__(self):
+        return f'<OdontogramaActual P:{self.paciente_id}>'
+
+class EventoDiente(db.Model):
+    """Evento de la historia de un diente (procedimiento o cambio de estado), derivado de los odontogramas."""
+    __tablename__ = 'eventos_diente'
+    __table_args__ = (
+        db.Index('ix_eventos_diente_paciente_diente_fecha', 'paciente_id', 'diente', 'fecha'),
+        db.Index('ix_eventos_diente_odontograma_id', 'odontograma_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), nullable=False)
+    diente = db.Column(db.SmallInteger, nullable=False)
+    superficie = db.Column(db.String(20))  # None: el diente completo (formato antiguo o cambio de estado)
+    tipo = db.Column(db.String(20), nullable=False)  # procedimiento, estado
+    estado = db.Column(db.String(20))
+    descripcion = db.Column(db.Text)
+    procedimiento_id = db.Column(db.Integer, db.ForeignKey('procedimientos.id'))
+    consulta_id = db.Column(db.Integer, db.ForeignKey('consultas.id'), nullable=False)
+    odontograma_id = db.Column(db.Integer, db.ForeignKey('odontogramas.id'), nullable=False)
+    fecha = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<EventoDiente P:{self.paciente_id} D:{self.diente} {self.tipo}>'
+
 class Receta(db.Model):
     """Modelo para recetas médicas (medicamentos externos)"""
     __tablename__ = 'recetas'
+    __table_args__ = (
+        db.Index('ix_recetas_consulta_id', 'consulta_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     consulta_id = db.Column(db.Integer, db.ForeignKey('consultas.id'), nullable=False)
@@ -96,6 +165,9 @@ class Receta(db.Model):
 class OrdenEstudio(db.Model):
     """Modelo para órdenes de estudios y análisis"""
     __tablename__ = 'ordenes_estudio'
+    __table_args__ = (
+        db.Index('ix_ordenes_estudio_consulta_id', 'consulta_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     consulta_id = db.Column(db.Integer, db.ForeignKey('consultas.id'), nullable=False)
@@ -110,6 +182,16 @@ class OrdenEstudio(db.Model):
 class Insumo(db.Model):
     """Modelo para insumos médicos"""
     __tablename__ = 'insumos'
+    __table_args__ = (
+        # Catálogo paginado por cursor (nombre, id)
+        db.Index('ix_insumos_nombre_id', 'nombre', 'id'),
+        # Solo los insumos a reponer (ver app.utils.reposicion)
+        db.Index(
+            'ix_insumos_reposicion', 'nombre', 'id',
+            postgresql_where=db.text('activo = true AND cantidad_actual <= stock_minimo'),
+            sqlite_where=db.text('activo = 1 AND cantidad_actual <= stock_minimo')
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(200), nullable=False)
@@ -141,9 +223,9 @@ class Insumo(db.Model):
     especialidades = db.relationship('InsumoEspecialidad', backref='insumo', lazy=True)
     movimientos = db.relationship('MovimientoInsumo', backref='insumo', lazy=True)
     
-    @property
+    @hybrid_property
     def requiere_reposicion(self):
-        return self.cantidad_actual < self.stock_minimo
+        return self.cantidad_actual <= self.stock_minimo
 
     @property
     def stock(self):
@@ -178,6 +260,9 @@ class InsumoEspecialidad(db.Model):
 class ConsultaInsumo(db.Model):
     """Insumos utilizados en una consulta"""
     __tablename__ = 'consulta_insumos'
+    __table_args__ = (
+        db.Index('ix_consulta_insumos_consulta_id', 'consulta_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     consulta_id = db.Column(db.Integer, db.ForeignKey('consultas.id'), nullable=False)
@@ -196,6 +281,11 @@ class ConsultaInsumo(db.Model):
 class MovimientoInsumo(db.Model):
     """Movimientos de inventario de insumos"""
     __tablename__ = 'movimientos_insumo'
+    __table_args__ = (
+        db.Index('ix_movimientos_insumo_insumo_fecha_id', 'insumo_id', 'fecha', 'id'),
+        db.Index('ix_movimientos_insumo_fecha', 'fecha'),
+        db.Index('ix_movimientos_insumo_consulta_id', 'consulta_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     insumo_id = db.Column(db.Integer, db.ForeignKey('insumos.id'), nullable=False)
@@ -209,6 +299,38 @@ class MovimientoInsumo(db.Model):
     def __repr__(self):
         return f'<MovimientoInsumo {self.tipo} - {self.cantidad}>'
 
+class SaldoInsumo(db.Model):
+    """Saldo de stock de un insumo al cierre de un período (ver app.utils.saldos_stock)"""
+    __tablename__ = 'saldos_insumo'
+    __table_args__ = (
+        db.UniqueConstraint('insumo_id', 'hasta', name='uq_saldos_insumo_insumo_hasta'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    insumo_id = db.Column(db.Integer, db.ForeignKey('insumos.id'), nullable=False)
+    hasta = db.Column(db.DateTime, nullable=False)  # incluye los movimientos con fecha < hasta
+    cantidad = db.Column(db.Integer, nullable=False)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SaldoInsumo I:{self.insumo_id} {self.hasta} = {self.cantidad}>'
+
+class PronosticoInsumo(db.Model):
+    """Pronóstico de consumo de un insumo (ver app.utils.pronostico_stock)"""
+    __tablename__ = 'pronosticos_insumo'
+
+    insumo_id = db.Column(db.Integer, db.ForeignKey('insumos.id'), primary_key=True)
+    consumo_corto = db.Column(db.Numeric(10, 3), nullable=False)  # promedio diario, ventana corta
+    consumo_largo = db.Column(db.Numeric(10, 3), nullable=False)  # promedio diario, ventana larga
+    consumo_diario = db.Column(db.Numeric(10, 3), nullable=False)  # estimado usado para el pronóstico
+    dias_cobertura = db.Column(db.Numeric(10, 1))  # None: sin consumo en las ventanas
+    fecha_agotamiento = db.Column(db.Date)
+    cantidad_sugerida = db.Column(db.Integer, nullable=False, default=0)
+    calculado = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<PronosticoInsumo I:{self.insumo_id} {self.dias_cobertura} días>'
+
 class Procedimiento(db.Model):
     """Modelo para procedimientos médicos"""
     __tablename__ = 'procedimientos'
@@ -222,18 +344,37 @@ class Procedimiento(db.Model):
     activo = db.Column(db.Boolean, default=True)
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Insumos que consume siempre el procedimiento (se descuentan al registrarlo en una consulta)
+    materiales = db.relationship('ProcedimientoInsumo', backref='procedimiento', lazy=True,
+                                 cascade='all, delete-orphan')
+
     def __repr__(self):
         return f'<Procedimiento {self.nombre}>'
 
     def get_precio_para(self, medico_id=None, especialidad_id=None):
         """Resuelve el precio según prioridad: médico > especialidad > defecto"""
-        if medico_id:
-            pp = ProcedimientoPrecio.query.filter_by(procedimiento_id=self.id, medico_id=medico_id).first()
-            if pp: return pp.precio
-        if especialidad_id:
-            pp = ProcedimientoPrecio.query.filter_by(procedimiento_id=self.id, especialidad_id=especialidad_id, medico_id=None).first()
-            if pp: return pp.precio
-        return self.precio
+        if self.id is None:
+            return self.precio
+        from app.utils.precios import resolve
+        return resolve(self.id, medico_id, especialidad_id)
+
+
+class ProcedimientoInsumo(db.Model):
+    """Insumo que consume un procedimiento y en qué cantidad (materiales del procedimiento)"""
+    __tablename__ = 'procedimiento_insumos'
+    __table_args__ = (
+        db.UniqueConstraint('procedimiento_id', 'insumo_id', name='uq_procedimiento_insumos_procedimiento_insumo'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    procedimiento_id = db.Column(db.Integer, db.ForeignKey('procedimientos.id'), nullable=False)
+    insumo_id = db.Column(db.Integer, db.ForeignKey('insumos.id'), nullable=False)
+    cantidad = db.Column(db.Integer, nullable=False, default=1)
+
+    insumo_rel = db.relationship('Insumo')
+
+    def __repr__(self):
+        return f'<ProcedimientoInsumo P:{self.procedimiento_id} I:{self.insumo_id} x{self.cantidad}>'
 
 
 class ProcedimientoPrecio(db.Model):
@@ -264,6 +405,9 @@ class ProcedimientoPrecio(db.Model):
 class ConsultaProcedimiento(db.Model):
     """Procedimientos realizados en una consulta"""
     __tablename__ = 'consulta_procedimientos'
+    __table_args__ = (
+        db.Index('ix_consulta_procedimientos_consulta_id', 'consulta_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     consulta_id = db.Column(db.Integer, db.ForeignKey('consultas.id'), nullable=False)
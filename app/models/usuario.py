@@ -2,6 +2,7 @@ from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from app.utils.texto import normalizar_texto
 
 class Usuario(UserMixin, db.Model):
     """Modelo para usuarios del sistema (médicos, recepcionistas, admin)"""
@@ -32,6 +33,10 @@ class Usuario(UserMixin, db.Model):
 class Paciente(db.Model):
     """Modelo para pacientes"""
     __tablename__ = 'pacientes'
+    __table_args__ = (
+        # Paginación por cursor del listado de pacientes
+        db.Index('ix_pacientes_apellido_id', 'apellido', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
@@ -51,6 +56,9 @@ class Paciente(db.Model):
     tipo_sangre = db.Column(db.String(5))
     fecha_registro = db.Column(db.DateTime, default=datetime.utcnow)
     activo = db.Column(db.Boolean, default=True)
+    # "nombre apellido cedula" normalizado (minúsculas, sin acentos) para la
+    # búsqueda por trigramas; se mantiene automáticamente al guardar.
+    busqueda = db.Column(db.String(300))
     
     # Relaciones
     citas = db.relationship('Cita', backref='paciente', lazy=True)
@@ -76,6 +84,11 @@ class Paciente(db.Model):
     def __repr__(self):
         return f'<Paciente {self.nombre_completo}>'
 
+@db.event.listens_for(Paciente, 'before_insert')
+@db.event.listens_for(Paciente, 'before_update')
+def _actualizar_busqueda_paciente(mapper, connection, paciente):
+    paciente.busqueda = normalizar_texto(paciente.nombre, paciente.apellido, paciente.cedula)
+
 class Especialidad(db.Model):
     """Modelo para especialidades médicas"""
     __tablename__ = 'especialidades'
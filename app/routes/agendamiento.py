@@ -1,14 +1,44 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, stream_template
 from flask_login import login_required, current_user
 from app import db
 from app.models import Cita, Paciente, Medico, Especialidad, MedicoEspecialidad, HorarioAtencion, Vacacion, Permiso
-from app.utils.rrhh_utils import medico_disponible_en_fecha
+from app.utils.rrhh_utils import disponibilidad_medicos, obtener_medicos_disponibles
+from app.utils.disponibilidad import calendario_semanal, grillas_medico, horas_libres, primeros_turnos_libres
+from app.utils import busqueda_pacientes
+from app.utils.paginacion import paginar_keyset, iterar_keyset
 from app.utils.auditoria import audit
+from app.utils.ocupacion import AGRUPACIONES, resumen_ocupacion
+from app.decorators import require_roles
+from app.utils.reservas import (ConflictoHorario, SolicitudDuplicada, MOTIVOS_CONFLICTO, cita_por_token,
+                                 confirmar_reserva, fechas_recurrentes, nuevo_token_solicitud,
+                                 reservar_turnos)
 from datetime import datetime, date, time, timedelta
 from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload
 
 bp = Blueprint('agendamiento', __name__, url_prefix='/agendamiento')
 
+# Rango máximo (en días) aceptado por la API de horarios disponibles
+MAX_DIAS_HORARIOS_DISPONIBLES = 31
+
+# Límites de la búsqueda de primeros turnos libres por especialidad
+MAX_DIAS_PRIMEROS_TURNOS = 90
+MAX_PRIMEROS_TURNOS = 50
+
+# Límites de la creación de citas en serie (tratamientos recurrentes)
+MAX_CITAS_SERIE = 52
+MAX_INTERVALO_SERIE_DIAS = 90
+
+# Rango máximo (en días) del reporte de ocupación
+MAX_DIAS_OCUPACION = 366
+
+# Máximo de pacientes listados al buscar por similitud
+MAX_RESULTADOS_PACIENTES = 200
+
+# Pacientes por página en el listado (paginación por cursor apellido, id)
+PACIENTES_POR_PAGINA = 50
+ORDEN_PACIENTES = [(Paciente.apellido, False), (Paciente.id, False)]
+
 @bp.route('/citas')
 @login_required
 def listar_citas():
@@ -93,7 +123,11 @@ def editar_cita(id):
         cita.hora = hora
         cita.motivo = request.form.get('motivo', '')
         
-        db.session.commit()
+        try:
+            confirmar_reserva(cita)
+        except ConflictoHorario:
+            flash('El horario seleccionado acaba de ser ocupado por otra cita', 'danger')
+            return redirect(url_for('agendamiento.editar_cita', id=id))
         
         # Auditar edición
         audit('editar', 'citas', cita.id, descripcion=f'Cita modificada - {cita.fecha} {cita.hora}')
@@ -127,9 +161,9 @@ def reagendar_cita(id):
 
     # Validar disponibilidad del médico, excluyendo la cita actual
     hora_fin = (datetime.combine(fecha, hora) + timedelta(minutes=30)).time()
-    disponible, motivo_no_disponible = medico_disponible_en_fecha(
-        cita.medico_id, fecha, hora, hora_fin
-    )
+    disponible, motivo_no_disponible = disponibilidad_medicos(
+        [cita.medico_id], fecha, hora, hora_fin
+    )[cita.medico_id]
     if not disponible:
         return jsonify({'error': f'No se puede reagendar: {motivo_no_disponible}'}), 400
 
@@ -145,7 +179,10 @@ def reagendar_cita(id):
 
     cita.fecha = fecha
     cita.hora = hora
-    db.session.commit()
+    try:
+        confirmar_reserva(cita)
+    except ConflictoHorario:
+        return jsonify({'error': 'El nuevo horario acaba de ser ocupado por otra cita.'}), 409
     audit('editar', 'citas', cita.id, descripcion=f'Cita reagendada a {cita.fecha} {cita.hora}')
 
     return jsonify({'success': True, 'message': 'Cita reagendada correctamente.'})
@@ -223,6 +260,12 @@ def nueva_cita():
         fecha = datetime.strptime(request.form.get('fecha'), '%Y-%m-%d').date()
         hora = datetime.strptime(request.form.get('hora'), '%H:%M').time()
         motivo = request.form.get('motivo', '')
+        token = request.form.get('token_solicitud') or None
+        
+        # Reenvío del mismo formulario: la cita ya fue creada
+        if cita_por_token(token):
+            flash('La cita ya había sido agendada', 'info')
+            return redirect(url_for('agendamiento.listar_citas'))
         
         # Validar que la fecha no sea pasada
         if fecha < date.today():
@@ -232,9 +275,9 @@ def nueva_cita():
         # Verificar disponibilidad del médico (vacaciones/permisos)
         # Calcular hora_fin (asumiendo citas de 30 minutos)
         hora_fin = (datetime.combine(fecha, hora) + timedelta(minutes=30)).time()
-        disponible, motivo_no_disponible = medico_disponible_en_fecha(
-            medico_id, fecha, hora, hora_fin
-        )
+        disponible, motivo_no_disponible = disponibilidad_medicos(
+            [medico_id], fecha, hora, hora_fin
+        )[medico_id]
         
         if not disponible:
             flash(f'No se puede agendar: {motivo_no_disponible}', 'danger')
@@ -260,11 +303,19 @@ def nueva_cita():
             hora=hora,
             motivo=motivo,
             estado='pendiente',
-            usuario_registro_id=current_user.id
+            usuario_registro_id=current_user.id,
+            token_solicitud=token
         )
         
         db.session.add(cita)
-        db.session.commit()
+        try:
+            confirmar_reserva(cita, token)
+        except SolicitudDuplicada:
+            flash('La cita ya había sido agendada', 'info')
+            return redirect(url_for('agendamiento.listar_citas'))
+        except ConflictoHorario:
+            flash('El horario seleccionado acaba de ser ocupado por otra cita. Elija otro horario.', 'danger')
+            return redirect(url_for('agendamiento.nueva_cita'))
         
         flash('Cita agendada exitosamente', 'success')
         return redirect(url_for('agendamiento.listar_citas'))
@@ -275,215 +326,24 @@ def nueva_cita():
     
     return render_template('agendamiento/nueva_cita.html',
                          pacientes=pacientes,
-                         especialidades=especialidades)
+                         especialidades=especialidades,
+                         token_solicitud=nuevo_token_solicitud())
 
 @bp.route('/api/disponibilidad-semanal/<int:medico_id>')
 @login_required
 def disponibilidad_semanal(medico_id):
     """API para obtener disponibilidad semanal del médico"""
     try:
-        from datetime import timedelta
-        
         # Validar que el médico exista
         medico = Medico.query.get(medico_id)
         if not medico:
             return jsonify({'error': f'Médico con ID {medico_id} no encontrado'}), 404
         
-        # Obtener fecha inicial (lunes de la semana solicitada)
+        # Fecha de referencia (se normaliza al lunes de esa semana)
         fecha_str = request.args.get('fecha', date.today().isoformat())
         fecha_base = datetime.strptime(fecha_str, '%Y-%m-%d').date()
         
-        # Calcular el lunes de esa semana
-        dias_desde_lunes = fecha_base.weekday()
-        lunes = fecha_base - timedelta(days=dias_desde_lunes)
-        
-        # Generar 7 días desde el lunes
-        dias_semana = [lunes + timedelta(days=i) for i in range(7)]
-        
-        # Obtener horarios del médico
-        horarios = HorarioAtencion.query.filter_by(
-            medico_id=medico_id,
-            activo=True
-        ).all()
-        print(f"[DEBUG] Horarios activos para médico {medico_id} ({medico.nombre}):")
-        for h in horarios:
-            print(f"  Día: {h.dia_semana} | {h.hora_inicio} - {h.hora_fin} | Duración: {h.duracion_consulta}")
-
-        # Crear diccionario de horarios por día (usando número de día 0-6)
-        horarios_por_dia = {}
-        for h in horarios:
-            if h.dia_semana not in horarios_por_dia:
-                horarios_por_dia[h.dia_semana] = []
-            # Verificar que no haya duplicados (mismos hora_inicio y hora_fin)
-            horario_key = (h.hora_inicio, h.hora_fin)
-            existe = any(
-                (r['hora_inicio'], r['hora_fin']) == horario_key 
-                for r in horarios_por_dia[h.dia_semana]
-            )
-            if not existe:
-                horarios_por_dia[h.dia_semana].append({
-                    'hora_inicio': h.hora_inicio,
-                    'hora_fin': h.hora_fin
-                })
-        print(f"[DEBUG] Días de la semana generados: {[d.strftime('%Y-%m-%d (%A)') for d in dias_semana]}")
-        
-        # Obtener vacaciones del médico
-        vacaciones = Vacacion.query.filter(
-            Vacacion.usuario_id == medico.usuario_id,
-            Vacacion.estado == 'aprobada',
-            Vacacion.fecha_inicio <= dias_semana[-1],
-            Vacacion.fecha_fin >= dias_semana[0]
-        ).all()
-        
-        # Obtener permisos del médico
-        permisos = Permiso.query.filter(
-            Permiso.usuario_id == medico.usuario_id,
-            Permiso.estado == 'aprobado',
-            Permiso.fecha.in_(dias_semana)
-        ).all()
-        
-        # Obtener citas confirmadas
-        citas = Cita.query.filter(
-            Cita.medico_id == medico_id,
-            Cita.fecha.in_(dias_semana),
-            Cita.estado.in_(['pendiente', 'confirmada'])
-        ).all()
-        
-        # Construir estructura de datos
-        dias_espanol = ['LUN', 'MAR', 'MIÉ', 'JUE', 'VIE', 'SÁB', 'DOM']
-        calendario = []
-        hoy = date.today()
-        
-        for fecha in dias_semana:
-            dia_numero = fecha.weekday()  # 0=Lunes, 6=Domingo
-            dia_label = f"{dias_espanol[dia_numero]} {fecha.day}"
-            es_pasado = fecha < hoy
-            
-            # Verificar si el médico trabaja este día
-            if dia_numero not in horarios_por_dia:
-                calendario.append({
-                    'fecha': fecha.isoformat(),
-                    'dia_semana': dia_label,
-                    'trabaja': False,
-                    'es_pasado': es_pasado,
-                    'slots': []
-                })
-                continue
-            
-            # Verificar vacaciones
-            en_vacaciones = any(
-                v.fecha_inicio <= fecha <= v.fecha_fin
-                for v in vacaciones
-            )
-            
-            if en_vacaciones:
-                calendario.append({
-                    'fecha': fecha.isoformat(),
-                    'dia_semana': dia_label,
-                    'trabaja': True,
-                    'en_vacaciones': True,
-                    'es_pasado': es_pasado,
-                    'slots': []
-                })
-                continue
-            
-            # Generar slots de 30 minutos para todos los horarios del día
-            slots = []
-            for horario in horarios_por_dia[dia_numero]:
-                hora_inicio = horario['hora_inicio']
-                hora_fin = horario['hora_fin']
-                # Buscar el objeto HorarioAtencion para obtener la duración real
-                horario_obj = HorarioAtencion.query.filter_by(
-                    medico_id=medico_id,
-                    dia_semana=dia_numero,
-                    hora_inicio=hora_inicio,
-                    hora_fin=hora_fin,
-                    activo=True
-                ).first()
-                duracion = horario_obj.duracion_consulta if horario_obj else 30
-                # Validar que hora_inicio y hora_fin no sean None
-                if hora_inicio is None or hora_fin is None:
-                    continue
-                hora_actual = datetime.combine(fecha, hora_inicio)
-                hora_fin_dt = datetime.combine(fecha, hora_fin)
-                while hora_actual < hora_fin_dt:
-                    hora_str = hora_actual.strftime('%H:%M')
-                    # Verificar si el slot es pasado
-                    ahora = datetime.now()
-                    slot_pasado = (fecha < hoy) or (fecha == hoy and hora_actual.time() < ahora.time())
-                    # Verificar si hay permiso en este horario
-                    tiene_permiso = False
-                    for p in permisos:
-                        if p.fecha != fecha:
-                            continue
-                        # Si el permiso no tiene hora específica, ocupa todo el día
-                        if p.hora_inicio is None or p.hora_fin is None:
-                            tiene_permiso = True
-                            break
-                        # Si tiene horas específicas, verificar si intersectan
-                        if p.hora_inicio <= hora_actual.time() < p.hora_fin:
-                            tiene_permiso = True
-                            break
-                    # Verificar si hay cita
-                    tiene_cita = any(
-                        c.fecha == fecha and c.hora == hora_actual.time()
-                        for c in citas
-                    )
-                    # Determinar estado del slot
-                    if slot_pasado:
-                        estado = 'pasado'
-                    elif tiene_permiso:
-                        estado = 'permiso'
-                    elif tiene_cita:
-                        estado = 'ocupado'
-                    else:
-                        estado = 'disponible'
-                    slots.append({
-                        'hora': hora_str,
-                        'estado': estado
-                    })
-                    hora_actual += timedelta(minutes=duracion)
-            
-            # Eliminar slots duplicados (por si acaso)
-            slots_unicos = []
-            horas_vistas = set()
-            for slot in slots:
-                if slot['hora'] not in horas_vistas:
-                    slots_unicos.append(slot)
-                    horas_vistas.add(slot['hora'])
-            slots = slots_unicos
-            
-            calendario.append({
-                'fecha': fecha.isoformat(),
-                'dia_semana': dia_label,
-                'trabaja': True,
-                'en_vacaciones': False,
-                'es_pasado': es_pasado,
-                'slots': slots
-            })
-        
-        # Información del mes para mostrar
-        meses = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 
-                 'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
-        mes_inicio = meses[lunes.month - 1]
-        mes_fin = meses[dias_semana[-1].month - 1]
-        
-        # Formato del período
-        if lunes.month == dias_semana[-1].month:
-            periodo = f"{mes_inicio} {lunes.year}"
-        else:
-            periodo = f"{mes_inicio} - {mes_fin} {lunes.year}"
-        
-        return jsonify({
-            'medico': {
-                'id': medico.id,
-                'nombre': f"Dr(a). {medico.usuario.username}" if medico.usuario else "Doctor"
-            },
-            'semana_inicio': lunes.isoformat(),
-            'semana_fin': dias_semana[-1].isoformat(),
-            'periodo': periodo,
-            'calendario': calendario
-        })
+        return jsonify(calendario_semanal(medico, fecha_base))
     except Exception as e:
         import traceback
         error_msg = str(e)
@@ -500,17 +360,8 @@ def buscar_pacientes():
     if len(query) < 2:
         return jsonify([])
     
-    # Buscar por nombre, apellido o cédula
-    pacientes = Paciente.query.filter(
-        and_(
-            Paciente.activo == True,
-            or_(
-                Paciente.nombre.ilike(f'%{query}%'),
-                Paciente.apellido.ilike(f'%{query}%'),
-                Paciente.cedula.ilike(f'%{query}%')
-            )
-        )
-    ).limit(10).all()
+    # Buscar por nombre, apellido o cédula (por similitud, sin importar acentos)
+    pacientes = busqueda_pacientes.buscar_pacientes(query, limite=10)
     
     resultados = [{
         'id': p.id,
@@ -549,21 +400,12 @@ def api_procedimientos_precios():
             Procedimiento.id.in_(procedimientos_con_precio)
         )
     ).order_by(Procedimiento.nombre).all()
-    salida = []
-    for p in procedimientos:
-        precio = None
-        if medico_id:
-            pp = ProcedimientoPrecio.query.filter_by(procedimiento_id=p.id, medico_id=medico_id).first()
-            if pp:
-                precio = float(pp.precio)
-        if precio is None:
-            pp2 = ProcedimientoPrecio.query.filter_by(procedimiento_id=p.id, especialidad_id=especialidad_id).first()
-            if pp2:
-                precio = float(pp2.precio)
-        if precio is None:
-            precio = float(p.precio) if p.precio is not None else 0.0
-
-        salida.append({'id': p.id, 'nombre': p.nombre, 'precio': precio})
+    from app.utils.precios import resolve_many
+    precios = resolve_many((p.id, medico_id, especialidad_id) for p in procedimientos)
+    salida = [
+        {'id': p.id, 'nombre': p.nombre, 'precio': float(precios[(p.id, medico_id, especialidad_id)])}
+        for p in procedimientos
+    ]
 
     return jsonify(salida)
 
@@ -605,37 +447,29 @@ def medicos_por_especialidad(especialidad_id):
         fecha_str = request.args.get('fecha', date.today().isoformat())
         fecha_consulta = datetime.strptime(fecha_str, '%Y-%m-%d').date()
         
-        # Buscar médicos de la especialidad
-        medicos_especialidad = MedicoEspecialidad.query.filter_by(
-            especialidad_id=especialidad_id
+        # Médicos activos de la especialidad (una sola consulta)
+        medicos = Medico.query.join(
+            MedicoEspecialidad, MedicoEspecialidad.medico_id == Medico.id
+        ).filter(
+            MedicoEspecialidad.especialidad_id == especialidad_id,
+            Medico.activo == True
         ).all()
         
-        medicos_disponibles = []
-        medicos_no_disponibles = []
+        # Verificar disponibilidad (vacaciones/permisos) de todos a la vez - sin horario específico
+        disponibles, no_disponibles = obtener_medicos_disponibles(medicos, fecha_consulta)
         
-        for me in medicos_especialidad:
-            medico = me.medico
-            
-            # Verificar que esté activo
-            if not medico.activo:
-                continue
-            
-            # Verificar disponibilidad (vacaciones/permisos) - sin horario específico
-            disponible, motivo = medico_disponible_en_fecha(
-                medico.id, fecha_consulta, None, None
-            )
-            
-            medico_info = {
-                'id': medico.id,
-                'nombre': medico.nombre_completo,
-                'registro': medico.registro_profesional
-            }
-            
-            if disponible:
-                medicos_disponibles.append(medico_info)
-            else:
-                medico_info['motivo_no_disponible'] = motivo
-                medicos_no_disponibles.append(medico_info)
+        medicos_disponibles = [{
+            'id': medico.id,
+            'nombre': medico.nombre_completo,
+            'registro': medico.registro_profesional
+        } for medico in disponibles]
+        
+        medicos_no_disponibles = [{
+            'id': medico.id,
+            'nombre': medico.nombre_completo,
+            'registro': medico.registro_profesional,
+            'motivo_no_disponible': medico.motivo_no_disponible
+        } for medico in no_disponibles]
         
         return jsonify({
             'disponibles': medicos_disponibles,
@@ -647,74 +481,226 @@ def medicos_por_especialidad(especialidad_id):
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/primeros-turnos/<int:especialidad_id>')
+@login_required
+def primeros_turnos(especialidad_id):
+    """API: Primeros turnos libres entre todos los médicos de una especialidad
+
+    Parámetros: desde (YYYY-MM-DD, default hoy), dias (horizonte, default 30),
+    cantidad (default 10).
+    """
+    especialidad = Especialidad.query.get(especialidad_id)
+    if not especialidad:
+        return jsonify({'error': f'Especialidad con ID {especialidad_id} no encontrada'}), 404
+
+    try:
+        fecha_desde = datetime.strptime(request.args.get('desde', date.today().isoformat()), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido.'}), 400
+    fecha_desde = max(fecha_desde, date.today())
+    dias = min(max(request.args.get('dias', 30, type=int), 1), MAX_DIAS_PRIMEROS_TURNOS)
+    cantidad = min(max(request.args.get('cantidad', 10, type=int), 1), MAX_PRIMEROS_TURNOS)
+    fecha_hasta = fecha_desde + timedelta(days=dias - 1)
+
+    turnos = primeros_turnos_libres(especialidad_id, cantidad, fecha_desde, fecha_hasta)
+
+    return jsonify({
+        'especialidad': {'id': especialidad.id, 'nombre': especialidad.nombre},
+        'desde': fecha_desde.isoformat(),
+        'hasta': fecha_hasta.isoformat(),
+        'turnos': [{
+            'fecha': inicio.date().isoformat(),
+            'hora': inicio.strftime('%H:%M'),
+            'medico_id': medico.id,
+            'medico': medico.nombre_completo
+        } for inicio, medico in turnos]
+    })
+
 @bp.route('/api/horarios-disponibles/<int:medico_id>')
 @login_required
 def horarios_disponibles(medico_id):
-    """API: Obtener horarios disponibles de un médico"""
-    fecha_str = request.args.get('fecha')
-    fecha_consulta = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-    dia_semana = fecha_consulta.weekday()  # 0=Lunes, 6=Domingo
-    
-    # Obtener horario del médico para ese día
-    horario = HorarioAtencion.query.filter_by(
-        medico_id=medico_id,
-        dia_semana=dia_semana,
-        activo=True
-    ).first()
-    
-    if not horario:
-        return jsonify([])
-    
-    # Generar slots de tiempo
-    slots = []
-    hora_actual = datetime.combine(fecha_consulta, horario.hora_inicio)
-    hora_fin = datetime.combine(fecha_consulta, horario.hora_fin)
-    duracion = timedelta(minutes=horario.duracion_consulta)
-    
-    while hora_actual < hora_fin:
-        # Verificar si el slot está ocupado
-        cita_existente = Cita.query.filter_by(
-            medico_id=medico_id,
-            fecha=fecha_consulta,
-            hora=hora_actual.time()
-        ).filter(Cita.estado.in_(['pendiente', 'confirmada'])).first()
-        
-        if not cita_existente:
-            slots.append(hora_actual.strftime('%H:%M'))
-        
-        hora_actual += duracion
-    
-    return jsonify(slots)
+    """API: Obtener horarios disponibles de un médico
+
+    Parámetros: fecha (YYYY-MM-DD, requerido), hasta (YYYY-MM-DD, opcional).
+    Sin `hasta` devuelve la lista de horas libres del día; con `hasta`
+    devuelve un objeto {fecha: [horas]} para cada día del rango.
+    """
+    try:
+        fecha_consulta = datetime.strptime(request.args.get('fecha', ''), '%Y-%m-%d').date()
+        hasta_str = request.args.get('hasta')
+        fecha_hasta = datetime.strptime(hasta_str, '%Y-%m-%d').date() if hasta_str else fecha_consulta
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido.'}), 400
+
+    if fecha_hasta < fecha_consulta:
+        return jsonify({'error': 'La fecha hasta no puede ser anterior a la fecha inicial.'}), 400
+    # El rango incluye ambos extremos
+    if (fecha_hasta - fecha_consulta).days + 1 > MAX_DIAS_HORARIOS_DISPONIBLES:
+        return jsonify({'error': f'El rango no puede superar {MAX_DIAS_HORARIOS_DISPONIBLES} días.'}), 400
+
+    # Grillas por día (caché de disponibilidad; los días faltantes se calculan en bloque)
+    fechas = [fecha_consulta + timedelta(days=i) for i in range((fecha_hasta - fecha_consulta).days + 1)]
+    grillas = grillas_medico(medico_id, fechas)
+
+    if not hasta_str:
+        return jsonify(horas_libres(grillas[fecha_consulta]))
+
+    return jsonify({fecha.isoformat(): horas_libres(grillas[fecha]) for fecha in fechas})
+
+@bp.route('/api/ocupacion')
+@login_required
+@require_roles('admin', 'recepcionista')
+def ocupacion():
+    """API: Ocupación real de la agenda (slots reservados / capacidad)
+
+    Parámetros: desde y hasta (YYYY-MM-DD, default hoy), agrupar (dia, semana
+    o mes; default dia), por (medico o especialidad; opcional).
+    """
+    try:
+        fecha_desde = datetime.strptime(request.args.get('desde', date.today().isoformat()), '%Y-%m-%d').date()
+        fecha_hasta = datetime.strptime(request.args.get('hasta', fecha_desde.isoformat()), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido.'}), 400
+    if fecha_hasta < fecha_desde:
+        return jsonify({'error': 'La fecha hasta debe ser posterior a desde.'}), 400
+    if (fecha_hasta - fecha_desde).days >= MAX_DIAS_OCUPACION:
+        return jsonify({'error': f'El rango no puede superar {MAX_DIAS_OCUPACION} días.'}), 400
+
+    agrupar = request.args.get('agrupar', 'dia')
+    por = request.args.get('por') or None
+    if agrupar not in AGRUPACIONES or por not in (None, 'medico', 'especialidad'):
+        return jsonify({'error': 'Parámetros agrupar/por inválidos.'}), 400
+
+    return jsonify({
+        'desde': fecha_desde.isoformat(),
+        'hasta': fecha_hasta.isoformat(),
+        'agrupar': agrupar,
+        'por': por,
+        'filas': resumen_ocupacion(fecha_desde, fecha_hasta, agrupar=agrupar, por=por)
+    })
+
+def _turnos_json(turnos):
+    return [{
+        'fecha': fecha.isoformat(),
+        'hora': hora.strftime('%H:%M'),
+        'motivo': motivo,
+        'detalle': MOTIVOS_CONFLICTO[motivo]
+    } for fecha, hora, motivo in turnos]
+
+@bp.route('/api/citas/serie', methods=['POST'])
+@login_required
+def crear_citas_serie():
+    """API: Crear varias citas de un paciente con un médico en una sola operación
+
+    Recibe JSON con paciente_id, especialidad_id, medico_id, motivo (opcional),
+    token_solicitud (opcional) y los turnos de una de dos formas:
+      - recurrencia: fecha_inicio (YYYY-MM-DD), hora (HH:MM), intervalo_dias
+        (default 14) y cantidad
+      - lista explícita: turnos = [{fecha, hora}, ...]
+    Con omitir_conflictos=true se crean los turnos libres y se informan los
+    demás; si no, cualquier conflicto cancela toda la serie (409).
+    """
+    datos = request.get_json(silent=True) or {}
+    try:
+        paciente_id = int(datos['paciente_id'])
+        especialidad_id = int(datos['especialidad_id'])
+        medico_id = int(datos['medico_id'])
+        if datos.get('turnos'):
+            turnos = [
+                (datetime.strptime(t['fecha'], '%Y-%m-%d').date(), datetime.strptime(t['hora'], '%H:%M').time())
+                for t in datos['turnos']
+            ]
+        else:
+            fecha_inicio = datetime.strptime(datos['fecha_inicio'], '%Y-%m-%d').date()
+            hora = datetime.strptime(datos['hora'], '%H:%M').time()
+            intervalo = int(datos.get('intervalo_dias', 14))
+            cantidad = int(datos['cantidad'])
+            if not 1 <= intervalo <= MAX_INTERVALO_SERIE_DIAS:
+                return jsonify({'error': f'El intervalo debe estar entre 1 y {MAX_INTERVALO_SERIE_DIAS} días.'}), 400
+            if cantidad < 1:
+                return jsonify({'error': 'La cantidad debe ser al menos 1.'}), 400
+            turnos = [(fecha, hora) for fecha in fechas_recurrentes(fecha_inicio, intervalo, min(cantidad, MAX_CITAS_SERIE + 1))]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Datos de la serie incompletos o con formato inválido.'}), 400
+
+    if len(turnos) > MAX_CITAS_SERIE:
+        return jsonify({'error': f'Una serie no puede superar {MAX_CITAS_SERIE} citas.'}), 400
+
+    medico = Medico.query.get(medico_id)
+    if not medico:
+        return jsonify({'error': f'Médico con ID {medico_id} no encontrado'}), 404
+    if not Paciente.query.get(paciente_id):
+        return jsonify({'error': f'Paciente con ID {paciente_id} no encontrado'}), 404
+
+    datos_cita = {
+        'paciente_id': paciente_id,
+        'especialidad_id': especialidad_id,
+        'motivo': datos.get('motivo', ''),
+        'usuario_registro_id': current_user.id
+    }
+    try:
+        creadas, conflictos = reservar_turnos(
+            medico, datos_cita, turnos,
+            token=datos.get('token_solicitud') or None,
+            omitir_conflictos=bool(datos.get('omitir_conflictos'))
+        )
+    except SolicitudDuplicada as e:
+        return jsonify({'duplicada': True, 'cita_id': e.cita.id,
+                        'message': 'La serie ya había sido agendada.'}), 200
+    except ConflictoHorario as e:
+        return jsonify({'error': 'Hay turnos de la serie que no se pueden reservar.',
+                        'conflictos': _turnos_json(e.conflictos)}), 409
+
+    if creadas:
+        audit('crear', 'citas', creadas[0][0],
+              descripcion=f'Serie de {len(creadas)} citas - paciente {paciente_id} con médico {medico_id} '
+                          f'({creadas[0][1]} a {creadas[-1][1]})')
+
+    return jsonify({
+        'success': True,
+        'creadas': [{
+            'id': cita_id,
+            'fecha': fecha.isoformat(),
+            'hora': hora.strftime('%H:%M')
+        } for cita_id, fecha, hora in creadas],
+        'conflictos': _turnos_json(conflictos)
+    }), 201
 
 @bp.route('/pacientes')
 @login_required
 def listar_pacientes():
     """Listar pacientes. Acepta parámetros 'q' o 'buscar' y realiza búsqueda por aproximación
-    en nombre completo (nombre + apellido) y cédula."""
+    en nombre completo (nombre + apellido) y cédula.
+
+    Sin búsqueda, pagina por cursor ('despues' / 'antes'); con 'todo=1' devuelve
+    el listado completo renderizado en streaming."""
     # aceptar ambos parámetros para compatibilidad (q o buscar)
     busqueda = request.args.get('q') or request.args.get('buscar') or ''
 
+    if busqueda:
+        # Resultados ordenados por similitud en nombre completo y cédula
+        pacientes = busqueda_pacientes.buscar_pacientes(busqueda, limite=MAX_RESULTADOS_PACIENTES)
+        return render_template('agendamiento/listar_pacientes.html',
+                             pacientes=pacientes,
+                             busqueda=busqueda,
+                             pagina=None)
+
     query = Paciente.query.filter_by(activo=True)
 
-    if busqueda:
-        pattern = f"%{busqueda}%"
-        # Buscar por nombre, apellido, concatenación nombre + ' ' + apellido, y cédula
-        nombre_completo = func.concat(Paciente.nombre, ' ', Paciente.apellido)
-        query = query.filter(
-            or_(
-                Paciente.nombre.ilike(pattern),
-                Paciente.apellido.ilike(pattern),
-                nombre_completo.ilike(pattern),
-                Paciente.cedula.ilike(pattern)
-            )
-        )
+    if request.args.get('todo'):
+        return stream_template('agendamiento/listar_pacientes.html',
+                             pacientes=iterar_keyset(query, ORDEN_PACIENTES),
+                             busqueda=busqueda,
+                             pagina=None)
 
-    pacientes = query.order_by(Paciente.apellido).all()
+    pagina = paginar_keyset(query, ORDEN_PACIENTES, por_pagina=PACIENTES_POR_PAGINA,
+                            despues=request.args.get('despues'),
+                            antes=request.args.get('antes'))
 
     return render_template('agendamiento/listar_pacientes.html', 
-                         pacientes=pacientes,
-                         busqueda=busqueda)
-
+                         pacientes=pagina.items,
+                         busqueda=busqueda,
+                         pagina=pagina)
 
 @bp.route('/pacientes/<int:id>')
 @login_required
@@ -724,7 +710,7 @@ def ver_paciente(id):
 
     paciente = Paciente.query.get_or_404(id)
 
-    ultimas_consultas = Consulta.query.filter_by(paciente_id=id).order_by(Consulta.fecha.desc()).limit(10).all()
+    ultimas_consultas = Consulta.query.options(joinedload(Consulta.medico)).filter_by(paciente_id=id).order_by(Consulta.fecha.desc()).limit(10).all()
     ultimas_citas = Cita.query.filter_by(paciente_id=id).order_by(Cita.fecha.desc()).limit(10).all()
     # Próxima cita (fecha >= hoy)
     try:
@@ -1,13 +1,27 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, current_app, stream_template
 from flask_login import login_required, current_user
 from app import db
 from app.models import (Consulta, Cita, Paciente, Insumo, Procedimiento, Receta, 
                         ConsultaInsumo, ConsultaProcedimiento, OrdenEstudio,
                         InsumoEspecialidad, MovimientoInsumo,
-                        ProcedimientoPrecio, Odontograma, Medico, Especialidad, MedicoEspecialidad,
+                        ProcedimientoPrecio, ProcedimientoInsumo, Odontograma, Medico, Especialidad, MedicoEspecialidad,
                         TratamientoSesionProcedimiento)
 from app.utils.auditoria import audit
-from datetime import datetime
+from app.utils.paginacion import paginar_keyset, iterar_keyset
+from app.utils.precios import resolve, resolve_many
+from app.utils.odontograma import registrar_odontograma, odontograma_actual, resumen_odontograma, historial_dientes
+from app.utils.historial import pagina_historial, linea_tiempo
+from app.utils.busqueda_clinica import buscar_consultas
+from app.utils.rbac import get_filtered_query
+from app.utils.stock import StockInsuficiente, descontar_stock, reponer_stock, fijar_stock, retirar_stock
+from app.utils.reposicion import resumen_reposicion
+from app.utils.saldos_stock import stock_en, movimientos_con_saldo
+from app.utils.pronostico_stock import pronosticos_de
+from app.utils.materiales import materiales_procedimientos, materiales_sin_stock, guardar_materiales
+from app.utils.cache_pdf import clave_pdf, pdf_cacheado, guardar_pdf
+from app.decorators import require_roles
+from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta
 from decimal import Decimal, InvalidOperation
 import io
 import json
@@ -25,46 +39,35 @@ from reportlab.lib import colors
 
 bp = Blueprint('consultorio', __name__, url_prefix='/consultorio')
 
+# Listado de consultas: paginación por cursor (fecha, id), más recientes primero
+CONSULTAS_POR_PAGINA = 50
+ORDEN_CONSULTAS = [(Consulta.fecha, True), (Consulta.id, True)]
+
+# Historial del paciente: consultas con detalle por página
+HISTORIAL_POR_PAGINA = 10
+
+# Catálogo de insumos: paginación por cursor (nombre, id)
+INSUMOS_POR_PAGINA = 50
+ORDEN_INSUMOS = [(Insumo.nombre, False), (Insumo.id, False)]
+
+# Movimientos de un insumo: paginación por cursor (fecha, id), más recientes primero
+MOVIMIENTOS_POR_PAGINA = 50
+ORDEN_MOVIMIENTOS = [(MovimientoInsumo.fecha, True), (MovimientoInsumo.id, True)]
+
 
 def _resolver_precio_procedimiento(procedimiento_id, medico_id=None, especialidad_id=None):
     """
     Resuelve el precio de un procedimiento según la regla de prioridad:
     1) Precio específico para (procedimiento_id, medico_id)
-    2) Precio para (procedimiento_id, especialidad_id)
+    2) Precio para (procedimiento_id, especialidad_id) sin médico
     3) procedimiento.precio (valor por defecto)
-    
-    Args:
-        procedimiento_id: ID del procedimiento
-        medico_id: ID del médico (opcional)
-        especialidad_id: ID de la especialidad (opcional)
-        
+
+    Para varios procedimientos a la vez usar `resolve_many`.
+
     Returns:
         Decimal: Precio resuelto del procedimiento
     """
-    # Prioridad 1: Precio específico para médico
-    if medico_id:
-        precio_medico = ProcedimientoPrecio.query.filter_by(
-            procedimiento_id=procedimiento_id,
-            medico_id=medico_id
-        ).first()
-        if precio_medico:
-            return precio_medico.precio
-    
-    # Prioridad 2: Precio para especialidad
-    if especialidad_id:
-        precio_especialidad = ProcedimientoPrecio.query.filter_by(
-            procedimiento_id=procedimiento_id,
-            especialidad_id=especialidad_id
-        ).first()
-        if precio_especialidad:
-            return precio_especialidad.precio
-    
-    # Prioridad 3: Precio base del procedimiento
-    procedimiento = Procedimiento.query.get(procedimiento_id)
-    if procedimiento:
-        return procedimiento.precio
-    
-    return Decimal('0')
+    return resolve(procedimiento_id, medico_id, especialidad_id)
 
 
 def _decimal_seguro(valor, default='0'):
@@ -77,12 +80,18 @@ def _decimal_seguro(valor, default='0'):
         return Decimal(default)
 
 
-def _procesar_procedimientos_odontograma(consulta, odontograma_datos):
-    """Convierte los procedimientos asignados a superficies trabajadas en registros ConsultaProcedimiento."""
+def _procedimientos_odontograma(odontograma_datos):
+    """
+    Recorre el odontograma y devuelve los procedimientos a registrar, sin consultar la base.
+
+    Returns:
+        list de (procedimiento_id, observaciones) en el orden de los dientes y
+        superficies, sin repetir (diente, superficie, procedimiento)
+    """
     if not odontograma_datos or not odontograma_datos.get('dientes'):
         return []
 
-    nuevos_procedimientos = []
+    items = []
     agregado_por_diente = set()
 
     for numero_str, datos in odontograma_datos.get('dientes', {}).items():
@@ -104,42 +113,20 @@ def _procesar_procedimientos_odontograma(consulta, odontograma_datos):
             if not sup_data.get('trabajado') or not sup_data.get('procedimiento_id'):
                 continue
 
-            proc_id = sup_data['procedimiento_id']
             try:
-                proc_id = int(proc_id)
+                proc_id = int(sup_data['procedimiento_id'])
             except (TypeError, ValueError):
                 continue
 
             key = (numero, sup_nombre, proc_id)
             if key in agregado_por_diente:
                 continue
-
-            procedimiento = Procedimiento.query.get(proc_id)
-            if not procedimiento:
-                continue
-
-            precio_resuelto = _resolver_precio_procedimiento(
-                procedimiento_id=procedimiento.id,
-                medico_id=consulta.medico_id,
-                especialidad_id=consulta.especialidad_id
-            )
-
-            observaciones = f'{observaciones_base} - Superficie {sup_nombre.capitalize()}'
-
-            consulta_proc = ConsultaProcedimiento(
-                consulta_id=consulta.id,
-                procedimiento_id=procedimiento.id,
-                precio=precio_resuelto,
-                observaciones=observaciones
-            )
-            db.session.add(consulta_proc)
-            nuevos_procedimientos.append(consulta_proc)
             agregado_por_diente.add(key)
+            items.append((proc_id, f'{observaciones_base} - Superficie {sup_nombre.capitalize()}'))
 
         # Compatibilidad con datos antiguos (procedimientos globales)
         if not superficies and datos.get('trabajado'):
-            procedimientos_diente = datos.get('procedimientos') or []
-            for proc in procedimientos_diente:
+            for proc in datos.get('procedimientos') or []:
                 proc_id = proc.get('id') if isinstance(proc, dict) else proc
                 try:
                     proc_id = int(proc_id)
@@ -149,27 +136,43 @@ def _procesar_procedimientos_odontograma(consulta, odontograma_datos):
                 key = (numero, proc_id)
                 if key in agregado_por_diente:
                     continue
+                agregado_por_diente.add(key)
+                items.append((proc_id, observaciones_base))
 
-                procedimiento = Procedimiento.query.get(proc_id)
-                if not procedimiento:
-                    continue
+    return items
 
-                precio_resuelto = _resolver_precio_procedimiento(
-                    procedimiento_id=procedimiento.id,
-                    medico_id=consulta.medico_id,
-                    especialidad_id=consulta.especialidad_id
-                )
 
-                consulta_proc = ConsultaProcedimiento(
-                    consulta_id=consulta.id,
-                    procedimiento_id=procedimiento.id,
-                    precio=precio_resuelto,
-                    observaciones=observaciones_base
-                )
-                db.session.add(consulta_proc)
-                nuevos_procedimientos.append(consulta_proc)
-                agregado_por_diente.add(key)
+def _procesar_procedimientos_odontograma(consulta, odontograma_datos):
+    """
+    Convierte los procedimientos asignados a superficies trabajadas en registros ConsultaProcedimiento.
 
+    Primero se recolectan todos los (diente, superficie, procedimiento) del
+    JSON; luego los procedimientos y sus precios se cargan en lote y las filas
+    se agregan juntas para insertarse por lotes en el próximo flush.
+    """
+    items = _procedimientos_odontograma(odontograma_datos)
+    if not items:
+        return []
+
+    procedimientos = {p.id: p for p in Procedimiento.query.filter(
+        Procedimiento.id.in_({proc_id for proc_id, _ in items})
+    )}
+    precios_resueltos = resolve_many(
+        (proc_id, consulta.medico_id, consulta.especialidad_id) for proc_id in procedimientos
+    )
+
+    # `procedimiento_rel` se asigna para que el detalle de la venta no vuelva a consultarlo
+    nuevos_procedimientos = [
+        ConsultaProcedimiento(
+            consulta_id=consulta.id,
+            procedimiento_id=proc_id,
+            procedimiento_rel=procedimientos[proc_id],
+            precio=precios_resueltos[(proc_id, consulta.medico_id, consulta.especialidad_id)],
+            observaciones=observaciones
+        )
+        for proc_id, observaciones in items if proc_id in procedimientos
+    ]
+    db.session.add_all(nuevos_procedimientos)
     return nuevos_procedimientos
 
 
@@ -355,19 +358,163 @@ def listar_consultas():
         except ValueError:
             pass
     
-    # Ordenar y limitar resultados
-    if paciente_buscar or fecha_desde or fecha_hasta:
-        # Si hay filtros, no limitar resultados
-        consultas = query.order_by(Consulta.fecha.desc()).all()
-    else:
-        # Sin filtros, mostrar solo las últimas 50
-        consultas = query.order_by(Consulta.fecha.desc()).limit(50).all()
+    # Paciente, médico y especialidad se muestran en cada fila
+    query = query.options(
+        joinedload(Consulta.paciente),
+        joinedload(Consulta.medico),
+        joinedload(Consulta.especialidad)
+    )
+    
+    # Listado completo (exportación): se renderiza en streaming por lotes
+    if request.args.get('todo'):
+        return stream_template('consultorio/listar_consultas.html',
+                             consultas=iterar_keyset(query, ORDEN_CONSULTAS),
+                             paciente_buscar=paciente_buscar,
+                             fecha_desde=fecha_desde,
+                             fecha_hasta=fecha_hasta,
+                             pagina=None)
+    
+    # Paginación por cursor (fecha, id), de la más reciente a la más antigua
+    pagina = paginar_keyset(query, ORDEN_CONSULTAS, por_pagina=CONSULTAS_POR_PAGINA,
+                            despues=request.args.get('despues'),
+                            antes=request.args.get('antes'))
     
     return render_template('consultorio/listar_consultas.html', 
-                         consultas=consultas,
+                         consultas=pagina.items,
                          paciente_buscar=paciente_buscar,
                          fecha_desde=fecha_desde,
-                         fecha_hasta=fecha_hasta)
+                         fecha_hasta=fecha_hasta,
+                         pagina=pagina)
+
+@bp.route('/consultas/buscar')
+@login_required
+@require_roles('admin', 'medico')
+def buscar_en_consultas():
+    """Búsqueda de texto completo en diagnóstico, motivo, observaciones, recetas y órdenes"""
+    texto = request.args.get('q', '').strip()
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    
+    # Los médicos solo buscan en sus propias consultas
+    query = get_filtered_query(Consulta).options(
+        joinedload(Consulta.paciente),
+        joinedload(Consulta.medico),
+        joinedload(Consulta.especialidad)
+    )
+    consultas, hay_mas = buscar_consultas(query, texto, pagina=pagina)
+    
+    return render_template('consultorio/buscar_consultas.html',
+                         texto=texto,
+                         consultas=consultas,
+                         pagina=pagina,
+                         hay_mas=hay_mas)
+
+
+def _json_enviado(enviado, campo):
+    """Objeto JSON de un campo del formulario enviado, o None si no es válido."""
+    try:
+        datos = json.loads(enviado.get(campo) or 'null')
+    except ValueError:
+        return None
+    return datos if isinstance(datos, dict) else None
+
+
+def _formulario_nueva_consulta(cita, enviado=None, faltantes=None):
+    """
+    Formulario de nueva consulta.
+
+    Args:
+        cita: Cita que se atiende
+        enviado: datos de un envío rechazado (request.form) para volver a
+            mostrarlos en el formulario
+        faltantes: insumos sin stock suficiente (ver `StockInsuficiente`)
+    """
+    paciente = cita.paciente
+    
+    # Cargar datos de la sesión si la cita es de tratamiento
+    from app.models.consultorio import TratamientoSesion
+    sesion_actual = TratamientoSesion.query.filter_by(cita_id=cita.id).first()
+    
+    proc_ids_sesion = []
+    motivo_sugerido = cita.motivo
+    diagnostico_sugerido = ""
+    
+    if sesion_actual:
+        proc_ids_sesion = [p.procedimiento_id for p in sesion_actual.procedimientos]
+        if sesion_actual.procedimientos:
+            nombres_procs = ", ".join([p.procedimiento.nombre for p in sesion_actual.procedimientos])
+            motivo_sugerido = f"{cita.motivo}. Procedimientos planificados: {nombres_procs}"
+        
+        diagnostico_sugerido = f"Sesión {sesion_actual.numero_sesion} - {sesion_actual.tratamiento.diagnostico_completo}"
+    
+    # Obtener historial del paciente (TODAS las consultas previas de TODOS los doctores)
+    consultas_previas = Consulta.query.filter_by(paciente_id=paciente.id)\
+        .order_by(Consulta.fecha.desc()).limit(5).all()
+    
+    # Obtener TODOS los insumos activos con stock disponible
+    # (no solo los de la especialidad, para mayor flexibilidad), más los
+    # elegidos en un envío rechazado aunque ya no tengan stock
+    ids_enviados = [i for i in (enviado.getlist('insumo_id[]') if enviado else []) if i.isdigit()]
+    insumos_disponibles = Insumo.query.filter_by(activo=True)\
+        .filter(db.or_(Insumo.cantidad_actual > 0, Insumo.id.in_([int(i) for i in ids_enviados])))\
+        .order_by(Insumo.nombre).all()
+    
+    # En Tratamiento se arma un plan con procedimientos de otras especialidades.
+    # En el resto de consultas mantenemos el filtro normal por especialidad.
+    if cita.especialidad.nombre.lower() == 'tratamiento':
+        procedimientos_disponibles = Procedimiento.query.filter_by(
+            activo=True
+        ).order_by(Procedimiento.nombre).all()
+    else:
+        procedimientos_con_precio = db.session.query(
+            ProcedimientoPrecio.procedimiento_id
+        ).filter(
+            ProcedimientoPrecio.especialidad_id == cita.especialidad_id
+        )
+        procedimientos_disponibles = Procedimiento.query.filter(
+            Procedimiento.activo == True,
+            db.or_(
+                Procedimiento.especialidad_id == cita.especialidad_id,
+                Procedimiento.id.in_(procedimientos_con_precio)
+            )
+        ).order_by(Procedimiento.nombre).all()
+
+    # Cargar el estado actual de la boca del paciente para historial clínico continuo
+    ultimo_odontograma_json = odontograma_actual(paciente.id)
+
+    procedimientos_marcados = proc_ids_sesion
+    insumos_enviados = []
+    odontograma_enviado = plan_enviado = None
+    if enviado is not None:
+        motivo_sugerido = enviado.get('motivo', '')
+        diagnostico_sugerido = enviado.get('diagnostico', '')
+        procedimientos_marcados = [
+            int(proc_id) for proc_id in enviado.getlist('procedimientos[]') if proc_id.isdigit()
+        ]
+        insumos_enviados = [
+            (int(insumo_id), cantidad)
+            for insumo_id, cantidad in zip(enviado.getlist('insumo_id[]'), enviado.getlist('insumo_cantidad[]'))
+            if insumo_id.isdigit()
+        ]
+        odontograma_enviado = _json_enviado(enviado, 'odontograma_json')
+        plan_enviado = _json_enviado(enviado, 'plan_tratamiento_json')
+    
+    return render_template('consultorio/nueva_consulta.html',
+                         cita=cita,
+                         consultas_previas=consultas_previas,
+                         insumos_disponibles=insumos_disponibles,
+                         procedimientos_disponibles=procedimientos_disponibles,
+                         ultimo_odontograma_json=ultimo_odontograma_json,
+                         sesion_actual=sesion_actual,
+                         proc_ids_sesion=proc_ids_sesion,
+                         motivo_sugerido=motivo_sugerido,
+                         diagnostico_sugerido=diagnostico_sugerido,
+                         procedimientos_marcados=procedimientos_marcados,
+                         enviado=enviado or {},
+                         insumos_enviados=insumos_enviados,
+                         odontograma_enviado=odontograma_enviado,
+                         plan_enviado=plan_enviado,
+                         faltantes=faltantes or [])
+
 
 @bp.route('/consultas/nueva/<int:cita_id>', methods=['GET', 'POST'])
 @login_required
@@ -482,101 +629,129 @@ def nueva_consulta(cita_id):
             )
             db.session.add(justificativo)
 
-        # Procesar odontograma enviado desde el formulario
+        # Procesar odontograma enviado desde el formulario (se guarda compactado
+        # y pasa a ser el estado actual de la boca del paciente)
+        datos_odontograma = None
         odontograma_json = request.form.get('odontograma_json', '').strip()
         if odontograma_json and odontograma_json not in ('{}', '{ }'):
             try:
                 datos_odontograma = json.loads(odontograma_json)
-                if datos_odontograma and datos_odontograma.get('dientes'):
-                    odontograma = Odontograma(
-                        consulta_id=consulta.id,
-                        paciente_id=consulta.paciente_id,
-                        datos=datos_odontograma
-                    )
-                    db.session.add(odontograma)
-            except (ValueError, TypeError, json.JSONDecodeError):
+                if not isinstance(datos_odontograma, dict):
+                    raise TypeError('odontograma_json debe ser un objeto')
+                if datos_odontograma.get('dientes'):
+                    registrar_odontograma(consulta, datos_odontograma)
+            except (ValueError, TypeError, AttributeError, json.JSONDecodeError):
+                datos_odontograma = None
                 current_app.logger.warning(f"[nueva_consulta] Odontograma inválido para consulta {consulta.id}")
 
-        # Procesar insumos utilizados
-        insumo_ids = request.form.getlist('insumo_id[]')
-        cantidades = request.form.getlist('insumo_cantidad[]')
-        
-        for i in range(len(insumo_ids)):
-            if not insumo_ids[i]:
-                continue
+        # Procesar insumos utilizados: se validan todos los pares (id, cantidad)
+        # y los insumos referenciados se cargan en una sola consulta
+        usos_insumo = []
+        for insumo_id, cantidad in zip(request.form.getlist('insumo_id[]'),
+                                       request.form.getlist('insumo_cantidad[]')):
             try:
-                insumo_id = int(insumo_ids[i])
+                usos_insumo.append((int(insumo_id), int(cantidad)))
             except (ValueError, TypeError):
+                # id o cantidad vacíos/inválidos: saltar
                 continue
-            insumo = Insumo.query.get(insumo_id)
+
+        insumos_por_id = {}
+        if usos_insumo:
+            insumos_por_id = {i.id: i for i in Insumo.query.filter(
+                Insumo.id.in_({insumo_id for insumo_id, _ in usos_insumo})
+            )}
+
+        insumos_consulta = []
+        for insumo_id, cantidad in usos_insumo:
+            insumo = insumos_por_id.get(insumo_id)
             if not insumo:
                 continue
-            # validar cantidad
-            try:
-                cantidad = int(cantidades[i])
-            except (ValueError, TypeError):
-                # si la cantidad está vacía o inválida, saltar
-                continue
-            
+
             # Registrar uso de insumo
-            consulta_insumo = ConsultaInsumo(
+            insumos_consulta.append(ConsultaInsumo(
                 consulta_id=consulta.id,
                 insumo_id=insumo.id,
                 cantidad=cantidad,
                 precio_unitario=insumo.precio_unitario,
                 subtotal=insumo.precio_unitario * cantidad
+            ))
+
+        # Procesar procedimientos generales seleccionados (una consulta para
+        # los procedimientos y los precios resueltos en lote)
+        procedimiento_ids = []
+        for proc_id in request.form.getlist('procedimientos[]'):
+            try:
+                procedimiento_ids.append(int(proc_id))
+            except (ValueError, TypeError):
+                continue
+
+        procedimientos_consulta = []
+        if procedimiento_ids:
+            procedimientos_por_id = {p.id: p for p in Procedimiento.query.filter(
+                Procedimiento.id.in_(set(procedimiento_ids))
+            )}
+            # Resolver precio según regla de prioridad: plan de la sesión > médico > especialidad > base
+            precios_resueltos = resolve_many(
+                (p_id, consulta.medico_id, consulta.especialidad_id) for p_id in procedimientos_por_id
             )
-            db.session.add(consulta_insumo)
-            
-            # Actualizar stock
-            insumo.cantidad_actual -= cantidad
-            
-            # Registrar movimiento
-            movimiento = MovimientoInsumo(
-                insumo_id=insumo.id,
-                tipo='salida',
-                cantidad=-cantidad,
-                motivo='Uso en consulta',
-                consulta_id=consulta.id,
-                usuario_id=current_user.id
-            )
-            db.session.add(movimiento)
-        
-        # Procesar procedimientos generales seleccionados
-        procedimiento_ids = request.form.getlist('procedimientos[]')
-        
-        for proc_id in procedimiento_ids:
-            if proc_id:
-                procedimiento = Procedimiento.query.get(int(proc_id))
-                if procedimiento:
-                    # Resolver precio según regla de prioridad: médico > especialidad > base
-                    precio_resuelto = precios_planificados.get(procedimiento.id)
-                    if precio_resuelto is None:
-                        precio_resuelto = _resolver_precio_procedimiento(
-                            procedimiento_id=procedimiento.id,
-                            medico_id=consulta.medico_id,
-                            especialidad_id=consulta.especialidad_id
-                        )
-                    
-                    consulta_proc = ConsultaProcedimiento(
-                        consulta_id=consulta.id,
-                        procedimiento_id=procedimiento.id,
-                        precio=precio_resuelto
-                    )
-                    db.session.add(consulta_proc)
-        
+            for proc_id in procedimiento_ids:
+                procedimiento = procedimientos_por_id.get(proc_id)
+                if not procedimiento:
+                    continue
+                precio_resuelto = precios_planificados.get(procedimiento.id)
+                if precio_resuelto is None:
+                    precio_resuelto = precios_resueltos[(procedimiento.id, consulta.medico_id, consulta.especialidad_id)]
+                procedimientos_consulta.append(ConsultaProcedimiento(
+                    consulta_id=consulta.id,
+                    procedimiento_id=procedimiento.id,
+                    precio=precio_resuelto
+                ))
+
+        # Las filas hijas se insertan juntas en el próximo flush (INSERT por lotes)
+        db.session.add_all(insumos_consulta)
+        db.session.add_all(procedimientos_consulta)
+
         # Procesar procedimientos desde el odontograma de dientes trabajados
-        odontograma_json = request.form.get('odontograma_json', '').strip()
-        if odontograma_json and odontograma_json not in ('{}', '{ }'):
+        if datos_odontograma:
             try:
-                datos_odontograma = json.loads(odontograma_json)
-                _procesar_procedimientos_odontograma(consulta, datos_odontograma)
-            except (ValueError, TypeError, json.JSONDecodeError):
+                procedimientos_consulta += _procesar_procedimientos_odontograma(consulta, datos_odontograma)
+            except (ValueError, TypeError, AttributeError):
                 current_app.logger.warning(f"[nueva_consulta] Odontograma inválido para consulta {consulta.id}")
+
+        # Descontar stock de los insumos usados (con sus movimientos); si
+        # alguno no alcanza no se guarda la consulta
+        try:
+            descontar_stock(
+                [(uso.insumo_id, uso.cantidad) for uso in insumos_consulta],
+                'Uso en consulta', consulta_id=consulta.id, usuario_id=current_user.id
+            )
+        except StockInsuficiente as e:
+            # Se vuelve a mostrar el formulario con lo cargado para corregir los insumos
+            db.session.rollback()
+            flash('No se guardó la consulta: stock insuficiente.', 'danger')
+            return _formulario_nueva_consulta(cita, enviado=request.form, faltantes=e.faltantes)
+
+        # Los materiales de los procedimientos se descuentan en otra sentencia
+        # sin bloquear la consulta: si no alcanzan el stock queda en negativo
+        # y se avisa de qué procedimiento salió cada material
+        procedimiento_ids = [proc.procedimiento_id for proc in procedimientos_consulta]
+        stock_materiales = descontar_stock(
+            materiales_procedimientos(procedimiento_ids),
+            'Materiales de procedimientos', consulta_id=consulta.id, usuario_id=current_user.id,
+            permitir_negativo=True
+        )
+        sin_stock = materiales_sin_stock(
+            procedimiento_ids, [insumo_id for insumo_id, cantidad in stock_materiales.items() if cantidad < 0]
+        )
+        if sin_stock:
+            flash(f"Materiales sin stock suficiente (el stock quedó en negativo): {'; '.join(sin_stock)}", 'warning')
         
         # Procesar plan de tratamiento (si existe y la especialidad es Tratamiento)
         plan_tratamiento_json = request.form.get('plan_tratamiento_json', '').strip()
         if plan_tratamiento_json and cita.especialidad.nombre.lower() == 'tratamiento':
+            # Savepoint: si una sesión choca con otra cita (índice único de horario)
+            # se descarta solo el plan y la consulta se guarda igual
+            plan_savepoint = db.session.begin_nested()
             try:
                 datos_plan = json.loads(plan_tratamiento_json)
                 if datos_plan and datos_plan.get('sesiones'):
@@ -642,200 +817,48 @@ def nueva_consulta(cita_id):
                                 precio_planificado=precio
                             )
                             db.session.add(proc_plan)
+                plan_savepoint.commit()
             except Exception as e:
+                # Siempre: tras un error de flush el savepoint queda inactivo
+                # pero hay que revertirlo para que la sesión siga usable
+                plan_savepoint.rollback()
                 current_app.logger.exception(f"[nueva_consulta] Error guardando plan de tratamiento: {e}")
                 flash(f'No se guardo el plan de tratamiento: {e}', 'warning')
         
         # Actualizar estado de la cita a atendida
         cita.estado = 'atendida'
-        
-        db.session.commit()
-        
-        # Auditar creación de consulta
-        audit('crear', 'consultas', consulta.id, descripcion=f'Nueva consulta - {consulta.paciente.nombre} ({consulta.especialidad.nombre})')
 
-        # Crear/actualizar venta pendiente para que la cajera la facture
+        # Crear la venta pendiente para que la cajera la facture, con los totales
+        # de las filas recién creadas. Va en un savepoint: si falla, se descarta
+        # solo la venta y la consulta se guarda igual.
+        venta_savepoint = db.session.begin_nested()
         try:
             from app.routes.facturacion import _crear_venta_pendiente_desde_consulta
 
             _crear_venta_pendiente_desde_consulta(
                 consulta,
                 current_user.id,
-                observaciones='Venta generada automaticamente desde consulta'
+                observaciones='Venta generada automaticamente desde consulta',
+                procedimientos=procedimientos_consulta,
+                insumos=insumos_consulta
             )
-            db.session.commit()
-            # ConsultaProcedimiento y ConsultaInsumo ya están importados al inicio del módulo
-            # Solo importar los modelos que no están importados aún
-            from app.models import Caja, Venta, VentaDetalle, ConfiguracionConsultorio
-
-            # Crear una venta pendiente para que la cajera la facture.
-            # Si ya existe una venta vinculada a esta consulta, no crear otra.
-            venta_existente_check = Venta.query.filter_by(consulta_id=consulta.id).first()
-            if not venta_existente_check:
-                # Buscar una caja abierta (cualquiera) — si existe, la asociamos, sino queda sin caja
-                caja = Caja.query.filter_by(estado='abierta').first()
-                paciente = cita.paciente
-
-                # Calcular totales (sin impuestos aún)
-                especialidad = consulta.especialidad if consulta.especialidad else None
-                precio_consulta = 0 if sesion_actual else (float(especialidad.precio_consulta) if especialidad and especialidad.precio_consulta else 0)
-
-                procedimientos = ConsultaProcedimiento.query.filter_by(consulta_id=consulta.id).all()
-                total_procedimientos = sum(float(p.precio) for p in procedimientos)
-
-                insumos = ConsultaInsumo.query.filter_by(consulta_id=consulta.id).all()
-                total_insumos = sum(float(i.subtotal) for i in insumos)
-
-                subtotal = precio_consulta + total_procedimientos + total_insumos
-                # IVA incluido (Paraguay): total es la suma de precios, IVA = total/11
-                total = subtotal
-                iva = total / 11
-                subtotal = total - iva  # Gravadas (base imponible)
-
-                # Generar número provisional único para la venta pendiente
-                import time
-                numero_provisional = f"PEND-{consulta.id}-{int(time.time())}"
-
-                venta = Venta(
-                    numero_factura=numero_provisional,
-                    timbrado=None,
-                    # Usar RUC si existe para facturación, sino usar cédula
-                    ruc_factura=paciente.ruc or paciente.cedula or '',
-                    # Si tiene razón social usarla, sino nombre completo
-                    nombre_factura=paciente.razon_social or paciente.nombre_completo,
-                    direccion_facturacion=paciente.direccion_facturacion or paciente.direccion or '',
-                    caja_id=(caja.id if caja else None),
-                    consulta_id=consulta.id,
-                    paciente_id=consulta.paciente_id,
-                    fecha=datetime.utcnow(),
-                    subtotal=subtotal,
-                    iva=iva,
-                    total=total,
-                    estado='pendiente',
-                    usuario_registro_id=current_user.id,
-                    observaciones='Venta generada automáticamente desde consulta'
-                )
-                db.session.add(venta)
-                db.session.flush()
-
-                if sesion_actual:
-                    sesion_actual.venta_id = venta.id
-
-                # Agregar detalle de consulta
-                detalle = VentaDetalle(
-                    venta_id=venta.id,
-                    concepto=f"Consulta - {especialidad.nombre if especialidad else ''}",
-                    descripcion=f"Médico: {consulta.medico.nombre_completo if consulta.medico else ''}",
-                    cantidad=1,
-                    precio_unitario=precio_consulta,
-                    subtotal=precio_consulta,
-                    tipo_item='consulta'
-                )
-                db.session.add(detalle)
-
-                # Detalles por procedimientos
-                for proc in procedimientos:
-                    detalle = VentaDetalle(
-                        venta_id=venta.id,
-                        concepto=proc.procedimiento_rel.nombre,
-                        descripcion=proc.observaciones,
-                        cantidad=1,
-                        precio_unitario=float(proc.precio),
-                        subtotal=float(proc.precio),
-                        tipo_item='procedimiento',
-                        item_id=proc.procedimiento_id
-                    )
-                    db.session.add(detalle)
-
-                # Detalles por insumos (no descontar stock aquí, ya se descontó en la consulta)
-                for insumo_usado in insumos:
-                    detalle = VentaDetalle(
-                        venta_id=venta.id,
-                        concepto=insumo_usado.insumo_rel.nombre,
-                        descripcion=f"{insumo_usado.insumo_rel.unidad_medida}",
-                        cantidad=insumo_usado.cantidad,
-                        precio_unitario=float(insumo_usado.precio_unitario),
-                        subtotal=float(insumo_usado.subtotal),
-                        tipo_item='insumo',
-                        item_id=insumo_usado.insumo_id
-                    )
-                    db.session.add(detalle)
-
-                db.session.commit()
+            venta_savepoint.commit()
         except Exception as e:
             # No bloquear el flujo si falla la creación de la venta pendiente
+            # (se revierte siempre: tras un error de flush queda inactivo)
+            venta_savepoint.rollback()
             current_app.logger.error(f"[nueva_consulta] Error al crear venta pendiente: {str(e)}")
             current_app.logger.exception(e)
-            db.session.rollback()
+
+        db.session.commit()
+
+        # Auditar creación de consulta
+        audit('crear', 'consultas', consulta.id, descripcion=f'Nueva consulta - {consulta.paciente.nombre} ({consulta.especialidad.nombre})')
 
         flash('Consulta registrada exitosamente', 'success')
         return redirect(url_for('consultorio.ver_consulta', id=consulta.id))
     
-    # GET - cargar datos para el formulario
-    paciente = cita.paciente
-    
-    # Cargar datos de la sesión si la cita es de tratamiento
-    from app.models.consultorio import TratamientoSesion
-    sesion_actual = TratamientoSesion.query.filter_by(cita_id=cita.id).first()
-    
-    proc_ids_sesion = []
-    motivo_sugerido = cita.motivo
-    diagnostico_sugerido = ""
-    
-    if sesion_actual:
-        proc_ids_sesion = [p.procedimiento_id for p in sesion_actual.procedimientos]
-        if sesion_actual.procedimientos:
-            nombres_procs = ", ".join([p.procedimiento.nombre for p in sesion_actual.procedimientos])
-            motivo_sugerido = f"{cita.motivo}. Procedimientos planificados: {nombres_procs}"
-        
-        diagnostico_sugerido = f"Sesión {sesion_actual.numero_sesion} - {sesion_actual.tratamiento.diagnostico_completo}"
-    
-    # Obtener historial del paciente (TODAS las consultas previas de TODOS los doctores)
-    consultas_previas = Consulta.query.filter_by(paciente_id=paciente.id)\
-        .order_by(Consulta.fecha.desc()).limit(5).all()
-    
-    # Obtener TODOS los insumos activos con stock disponible
-    # (no solo los de la especialidad, para mayor flexibilidad)
-    insumos_disponibles = Insumo.query.filter_by(activo=True)\
-        .filter(Insumo.cantidad_actual > 0)\
-        .order_by(Insumo.nombre).all()
-    
-    # En Tratamiento se arma un plan con procedimientos de otras especialidades.
-    # En el resto de consultas mantenemos el filtro normal por especialidad.
-    if cita.especialidad.nombre.lower() == 'tratamiento':
-        procedimientos_disponibles = Procedimiento.query.filter_by(
-            activo=True
-        ).order_by(Procedimiento.nombre).all()
-    else:
-        procedimientos_con_precio = db.session.query(
-            ProcedimientoPrecio.procedimiento_id
-        ).filter(
-            ProcedimientoPrecio.especialidad_id == cita.especialidad_id
-        )
-        procedimientos_disponibles = Procedimiento.query.filter(
-            Procedimiento.activo == True,
-            db.or_(
-                Procedimiento.especialidad_id == cita.especialidad_id,
-                Procedimiento.id.in_(procedimientos_con_precio)
-            )
-        ).order_by(Procedimiento.nombre).all()
-
-    # Cargar último odontograma del paciente para historial clínico continuo
-    ultimo_odontograma = Odontograma.query.filter_by(
-        paciente_id=paciente.id
-    ).order_by(Odontograma.fecha.desc()).first()
-    ultimo_odontograma_json = ultimo_odontograma.datos if ultimo_odontograma else {}
-    
-    return render_template('consultorio/nueva_consulta.html',
-                         cita=cita,
-                         consultas_previas=consultas_previas,
-                         insumos_disponibles=insumos_disponibles,
-                         procedimientos_disponibles=procedimientos_disponibles,
-                         ultimo_odontograma_json=ultimo_odontograma_json,
-                         sesion_actual=sesion_actual,
-                         proc_ids_sesion=proc_ids_sesion,
-                         motivo_sugerido=motivo_sugerido,
-                         diagnostico_sugerido=diagnostico_sugerido)
+    return _formulario_nueva_consulta(cita)
 
 @bp.route('/consultas/<int:id>')
 @login_required
@@ -843,51 +866,9 @@ def ver_consulta(id):
     """Ver detalle de consulta"""
     consulta = Consulta.query.get_or_404(id)
 
-    odontograma = None
-    odontograma_summary = None
-    if consulta.odontogramas:
-        odontograma = sorted(consulta.odontogramas, key=lambda o: o.fecha)[-1]
-        datos = odontograma.datos or {}
-        estados = {'evaluado': [], 'terminado': [], 'normal': []}
-        superficies_actuales = []
-        superficies_historicas = []
-        procedimiento_ids = set()
-
-        for numero_str, datos_diente in sorted((datos.get('dientes') or {}).items(), key=lambda x: int(x[0])):
-            estado = (datos_diente or {}).get('estado', 'normal')
-            if estado in estados:
-                estados[estado].append(numero_str)
-            superficies_data = (datos_diente or {}).get('superficies') or {}
-            for sup_nombre, sup_data in superficies_data.items():
-                if not sup_data:
-                    continue
-                es_historico = bool(sup_data.get('historico'))
-                proc_id = sup_data.get('procedimiento_id')
-                if proc_id is None:
-                    continue
-                if sup_data.get('trabajado') or es_historico:
-                    procedimiento_ids.add(proc_id)
-                    target = superficies_historicas if es_historico else superficies_actuales
-                    target.append({
-                        'diente': numero_str,
-                        'superficie': sup_nombre.capitalize(),
-                        'procedimiento_id': proc_id,
-                        'procedimiento_nombre': None,
-                        'historico': es_historico
-                    })
-
-        if procedimiento_ids:
-            procedimientos = {p.id: p.nombre for p in Procedimiento.query.filter(Procedimiento.id.in_(list(procedimiento_ids))).all()}
-            for collection in (superficies_actuales, superficies_historicas):
-                for sup in collection:
-                    sup['procedimiento_nombre'] = procedimientos.get(sup['procedimiento_id'], 'Procedimiento desconocido')
-
-        odontograma_summary = {
-            'fecha': odontograma.fecha,
-            'estados': estados,
-            'superficies_actuales': superficies_actuales,
-            'superficies_historicas': superficies_historicas
-        }
+    odontograma = Odontograma.query.filter_by(consulta_id=consulta.id)\
+        .order_by(Odontograma.fecha.desc(), Odontograma.id.desc()).first()
+    odontograma_summary = resumen_odontograma(odontograma) if odontograma else None
 
     # Separar recetas normales de órdenes de análisis
     recetas_normales = [r for r in consulta.recetas if r.medicamento != 'Orden de Análisis']
@@ -937,6 +918,13 @@ def receta_pdf(consulta_id, receta_id):
     # Obtener configuración/membrete
     from app.models import ConfiguracionConsultorio
     config = ConfiguracionConsultorio.get_configuracion()
+    logo_path = _resolve_logo_path(config)
+
+    # Reimpresiones: servir el PDF ya generado si no cambió nada de lo impreso
+    clave = clave_pdf('receta', receta, consulta, config, logo_path)
+    cacheado = pdf_cacheado(clave, f'Receta_{consulta.id}.pdf')
+    if cacheado:
+        return cacheado
 
     # Generar PDF en memoria usando Platypus para un layout más pulido
     buffer = io.BytesIO()
@@ -956,7 +944,6 @@ def receta_pdf(consulta_id, receta_id):
     timestamp = consulta.fecha.strftime('%d/%m/%Y')
 
     # Membrete compacto (igual que arqueo)
-    logo_path = _resolve_logo_path(config)
     logo_elem = None
     if logo_path:
         try:
@@ -1053,6 +1040,7 @@ def receta_pdf(consulta_id, receta_id):
         canvas_obj.restoreState()
 
     doc.build(story, onFirstPage=_on_page, onLaterPages=_on_page)
+    guardar_pdf(clave, buffer.getvalue())
     buffer.seek(0)
     return send_file(buffer, mimetype='application/pdf', as_attachment=True, download_name=f'Receta_{consulta.id}.pdf')
 
@@ -1070,6 +1058,13 @@ def orden_pdf(consulta_id, orden_id):
 
     from app.models import ConfiguracionConsultorio
     config = ConfiguracionConsultorio.get_configuracion()
+    logo_path = _resolve_logo_path(config)
+
+    # Reimpresiones: servir el PDF ya generado si no cambió nada de lo impreso
+    clave = clave_pdf('orden', orden, consulta, config, logo_path)
+    cacheado = pdf_cacheado(clave, f'Orden_{consulta.id}.pdf')
+    if cacheado:
+        return cacheado
 
     # Generar PDF con Platypus para un diseño consistente con la receta
     buffer = io.BytesIO()
@@ -1091,7 +1086,6 @@ def orden_pdf(consulta_id, orden_id):
     story.append(Spacer(1, 6))
 
     # Clinic header (re-use same styling as receta)
-    logo_path = _resolve_logo_path(config)
     logo_elem = None
     max_logo_w = 50 * mm
     max_logo_h = 30 * mm
@@ -1188,6 +1182,7 @@ def orden_pdf(consulta_id, orden_id):
         canvas_obj.restoreState()
 
     doc.build(story, onFirstPage=_on_page, onLaterPages=_on_page)
+    guardar_pdf(clave, buffer.getvalue())
     buffer.seek(0)
     return send_file(buffer, mimetype='application/pdf', as_attachment=True, download_name=f'Orden_{consulta.id}.pdf')
 
@@ -1205,6 +1200,13 @@ def orden_analisis_pdf(consulta_id, orden_id):
 
     from app.models import ConfiguracionConsultorio
     config = ConfiguracionConsultorio.get_configuracion()
+    logo_path = _resolve_logo_path(config)
+
+    # Reimpresiones: servir el PDF ya generado si no cambió nada de lo impreso
+    clave = clave_pdf('orden_analisis', orden, consulta, config, logo_path)
+    cacheado = pdf_cacheado(clave, f'OrdenAnalisis_{consulta.id}.pdf')
+    if cacheado:
+        return cacheado
 
     # Generar PDF con Platypus
     buffer = io.BytesIO()
@@ -1226,7 +1228,6 @@ def orden_analisis_pdf(consulta_id, orden_id):
     story.append(Spacer(1, 6))
 
     # Clinic header
-    logo_path = _resolve_logo_path(config)
     logo_elem = None
     max_logo_w = 50 * mm
     max_logo_h = 30 * mm
@@ -1323,6 +1324,7 @@ def orden_analisis_pdf(consulta_id, orden_id):
         canvas_obj.restoreState()
 
     doc.build(story, onFirstPage=_on_page, onLaterPages=_on_page)
+    guardar_pdf(clave, buffer.getvalue())
     buffer.seek(0)
     return send_file(buffer, mimetype='application/pdf', as_attachment=True, download_name=f'OrdenAnalisis_{consulta.id}.pdf')
 
@@ -1340,6 +1342,13 @@ def justificativo_pdf(consulta_id, justificativo_id):
 
     from app.models import ConfiguracionConsultorio
     config = ConfiguracionConsultorio.get_configuracion()
+    logo_path = _resolve_logo_path(config)
+
+    # Reimpresiones: servir el PDF ya generado si no cambió nada de lo impreso
+    clave = clave_pdf('justificativo', justificativo, consulta, config, logo_path)
+    cacheado = pdf_cacheado(clave, f'Justificativo_{consulta.id}.pdf')
+    if cacheado:
+        return cacheado
 
     # Generar PDF con Platypus
     buffer = io.BytesIO()
@@ -1361,7 +1370,6 @@ def justificativo_pdf(consulta_id, justificativo_id):
     story.append(Spacer(1, 6))
 
     # Clinic header
-    logo_path = _resolve_logo_path(config)
     logo_elem = None
     max_logo_w = 50 * mm
     max_logo_h = 30 * mm
@@ -1458,6 +1466,7 @@ def justificativo_pdf(consulta_id, justificativo_id):
         canvas_obj.restoreState()
 
     doc.build(story, onFirstPage=_on_page, onLaterPages=_on_page)
+    guardar_pdf(clave, buffer.getvalue())
     buffer.seek(0)
     return send_file(buffer, mimetype='application/pdf', as_attachment=True, download_name=f'Justificativo_{consulta.id}.pdf')
 
@@ -1493,12 +1502,33 @@ def orden_preview_pdf():
 def historial_paciente(id):
     """Ver historial médico completo del paciente"""
     paciente = Paciente.query.get_or_404(id)
-    consultas = Consulta.query.filter_by(paciente_id=id)\
-        .order_by(Consulta.fecha.desc()).all()
+    
+    # Línea de tiempo compacta de todas las visitas + detalle paginado por cursor
+    pagina = pagina_historial(id, por_pagina=HISTORIAL_POR_PAGINA,
+                              despues=request.args.get('despues'),
+                              antes=request.args.get('antes'))
     
     return render_template('consultorio/historial_paciente.html',
                          paciente=paciente,
-                         consultas=consultas)
+                         linea_tiempo=linea_tiempo(id),
+                         consultas=pagina.items,
+                         pagina=pagina)
+
+@bp.route('/api/pacientes/<int:paciente_id>/dientes')
+@login_required
+@require_roles('admin', 'medico')
+def api_historial_dientes(paciente_id):
+    """API: Historia por diente de un paciente (procedimientos y cambios de estado)
+
+    Parámetros: diente (int, opcional) para limitar a un diente (ej. 36)
+    """
+    paciente = Paciente.query.get_or_404(paciente_id)
+    diente = request.args.get('diente', type=int)
+    historial = historial_dientes(paciente.id, diente)
+    return jsonify({
+        'paciente_id': paciente.id,
+        'dientes': {str(numero): eventos for numero, eventos in historial.items()}
+    })
 
 @bp.route('/insumos')
 @login_required
@@ -1520,14 +1550,23 @@ def listar_insumos():
             )
         )
 
-    insumos = base_q.order_by(Insumo.nombre).all()
+    # Solo los insumos a reponer (índice parcial ix_insumos_reposicion)
+    solo_reposicion = bool(request.args.get('reposicion'))
+    if solo_reposicion:
+        base_q = base_q.filter(Insumo.activo == True, Insumo.requiere_reposicion)
 
-    # Identificar insumos que requieren reposición
-    alertas = [i for i in insumos if i.requiere_reposicion]
+    # Paginación por cursor (nombre, id) en lugar de cargar todo el inventario
+    pagina = paginar_keyset(base_q, ORDEN_INSUMOS, por_pagina=INSUMOS_POR_PAGINA,
+                            despues=request.args.get('despues'),
+                            antes=request.args.get('antes'))
 
     return render_template('consultorio/listar_insumos.html',
-                         insumos=insumos,
-                         alertas=alertas,
+                         insumos=pagina.items,
+                         pagina=pagina,
+                         pronosticos=pronosticos_de(insumo.id for insumo in pagina.items),
+                         hoy=datetime.utcnow().date(),
+                         reposicion=resumen_reposicion(),
+                         solo_reposicion=solo_reposicion,
                          busqueda=busqueda)
 
 
@@ -1770,6 +1809,41 @@ def editar_procedimiento(id):
         return {'error': f'Error al editar procedimiento: {str(e)}'}, 500
 
 
+@bp.route('/procedimiento/<int:id>/materiales', methods=['GET', 'POST'])
+@login_required
+@require_roles('admin')
+def materiales_procedimiento(id):
+    """Insumos que consume un procedimiento (se descuentan al registrarlo en una consulta)"""
+    proc = Procedimiento.query.get_or_404(id)
+
+    if request.method == 'POST':
+        cantidades = []
+        for insumo_id, cantidad in zip(request.form.getlist('insumo_id[]'),
+                                       request.form.getlist('insumo_cantidad[]')):
+            try:
+                cantidades.append((int(insumo_id), int(cantidad)))
+            except (ValueError, TypeError):
+                continue
+        insumos_validos = {i for (i,) in db.session.query(Insumo.id).filter(
+            Insumo.id.in_({insumo_id for insumo_id, _ in cantidades})
+        )}
+        guardar_materiales(proc, [(i, c) for i, c in cantidades if i in insumos_validos])
+        db.session.commit()
+
+        audit('editar', 'procedimientos', proc.id, descripcion=f'Materiales actualizados: {proc.nombre}')
+        flash('Materiales del procedimiento actualizados', 'success')
+        return redirect(url_for('consultorio.materiales_procedimiento', id=proc.id))
+
+    materiales = ProcedimientoInsumo.query.options(joinedload(ProcedimientoInsumo.insumo_rel)).filter_by(
+        procedimiento_id=proc.id
+    ).all()
+    insumos = Insumo.query.filter_by(activo=True).order_by(Insumo.nombre).all()
+    return render_template('consultorio/materiales_procedimiento.html',
+                         procedimiento=proc,
+                         materiales=materiales,
+                         insumos=insumos)
+
+
 @bp.route('/procedimiento/<int:id>/eliminar', methods=['POST'])
 @login_required
 def eliminar_procedimiento(id):
@@ -1809,14 +1883,69 @@ def eliminar_procedimiento(id):
 @bp.route('/insumos/<int:id>/movimientos')
 @login_required
 def movimientos_insumo(id):
-    """Ver movimientos de un insumo"""
+    """Ver movimientos de un insumo, con el saldo después de cada uno"""
     insumo = Insumo.query.get_or_404(id)
-    movimientos = MovimientoInsumo.query.filter_by(insumo_id=id)\
-        .order_by(MovimientoInsumo.fecha.desc()).limit(50).all()
-    
+    pagina = paginar_keyset(MovimientoInsumo.query.filter_by(insumo_id=id), ORDEN_MOVIMIENTOS,
+                            por_pagina=MOVIMIENTOS_POR_PAGINA,
+                            despues=request.args.get('despues'),
+                            antes=request.args.get('antes'))
+
+    # Stock al cierre de una fecha (consulta puntual para inventarios)
+    fecha = request.args.get('fecha', '').strip()
+    stock_fecha = None
+    if fecha:
+        momento = _momento_stock(fecha)
+        if momento is None:
+            flash('Fecha inválida', 'warning')
+        else:
+            stock_fecha = stock_en(momento, [insumo.id]).get(insumo.id)
+
     return render_template('consultorio/movimientos_insumo.html',
                          insumo=insumo,
-                         movimientos=movimientos)
+                         movimientos=movimientos_con_saldo(insumo, pagina.items),
+                         pagina=pagina,
+                         fecha=fecha,
+                         stock_fecha=stock_fecha)
+
+
+def _momento_stock(fecha=None, momento=None):
+    """Instante UTC pedido: fin del día `fecha` (AAAA-MM-DD) o `momento` ISO; None si es inválido."""
+    try:
+        if momento:
+            return datetime.fromisoformat(momento)
+        return datetime.strptime(fecha, '%Y-%m-%d') + timedelta(days=1)
+    except (TypeError, ValueError):
+        return None
+
+
+@bp.route('/api/insumos/stock')
+@login_required
+@require_roles('admin')
+def api_stock_insumos():
+    """API: Stock de los insumos en un instante (inventario a una fecha)
+
+    Parámetros: fecha (AAAA-MM-DD, stock al cierre de ese día) o momento
+    (fecha y hora ISO, UTC); insumo_id (repetible, opcional)
+    """
+    momento = _momento_stock(request.args.get('fecha'), request.args.get('momento'))
+    if momento is None:
+        return jsonify({'error': 'indique fecha (AAAA-MM-DD) o momento (ISO)'}), 400
+    insumo_ids = request.args.getlist('insumo_id', type=int) or None
+    saldos = stock_en(momento, insumo_ids)
+    insumos = Insumo.query.filter(Insumo.id.in_(list(saldos))).order_by(Insumo.nombre, Insumo.id).all()
+    return jsonify({
+        'momento': momento.isoformat(),
+        'insumos': [
+            {
+                'id': insumo.id,
+                'codigo': insumo.codigo,
+                'nombre': insumo.nombre,
+                'unidad_medida': insumo.unidad_medida,
+                'cantidad': saldos[insumo.id]
+            }
+            for insumo in insumos
+        ]
+    })
 
 
 @bp.route('/insumos/nuevo', methods=['GET', 'POST'])
@@ -1849,12 +1978,17 @@ def nuevo_insumo():
             descripcion=descripcion,
             precio_compra=precio_compra,
             precio_venta=precio_venta,
-            cantidad_actual=cantidad_actual,
+            cantidad_actual=0,
             stock_minimo=stock_minimo,
             unidad_medida=unidad_medida,
             activo=activo
         )
         db.session.add(insumo)
+        db.session.flush()
+        # El stock inicial entra por el libro de movimientos, así los saldos
+        # históricos (app.utils.saldos_stock) parten de cero
+        if cantidad_actual > 0:
+            reponer_stock([(insumo.id, cantidad_actual)], 'Stock inicial', usuario_id=current_user.id)
         db.session.commit()
         audit('crear', 'insumos', insumo.id, descripcion=f'Insumo creado: {insumo.nombre} (Stock: {insumo.cantidad_actual} {insumo.unidad_medida})')
         flash('Insumo creado correctamente', 'success')
@@ -1889,10 +2023,15 @@ def editar_insumo(id):
             insumo.precio_venta = parse_decimal_from_form(request.form.get('precio_venta', str(insumo.precio_venta)) or str(insumo.precio_venta)) or insumo.precio_venta
         except Exception:
             pass
+        # El stock solo se fija si el usuario cambió el valor que se le mostró;
+        # así guardar otros datos no pisa consumos hechos mientras editaba
         try:
-            insumo.cantidad_actual = int(request.form.get('cantidad_actual', insumo.cantidad_actual) or insumo.cantidad_actual)
-        except Exception:
-            pass
+            cantidad_nueva = int(request.form.get('cantidad_actual', '') or 0)
+            cantidad_mostrada = int(request.form.get('cantidad_original', cantidad_nueva) or 0)
+        except (ValueError, TypeError):
+            cantidad_nueva = cantidad_mostrada = None
+        if cantidad_nueva is not None and cantidad_nueva != cantidad_mostrada:
+            fijar_stock(insumo.id, max(0, cantidad_nueva), 'Edición de insumo', usuario_id=current_user.id)
         try:
             insumo.stock_minimo = int(request.form.get('stock_minimo', insumo.stock_minimo) or insumo.stock_minimo)
         except Exception:
@@ -1926,12 +2065,18 @@ def ajustar_stock(id):
         except Exception:
             cantidad = 0
 
-        if accion == 'sumar':
-            insumo.cantidad_actual += cantidad
-        elif accion == 'restar':
-            insumo.cantidad_actual = max(0, insumo.cantidad_actual - cantidad)
-        elif accion == 'set':
-            insumo.cantidad_actual = max(0, cantidad)
+        try:
+            if accion == 'sumar':
+                reponer_stock([(insumo.id, cantidad)], 'Ajuste manual: entrada', tipo='ajuste', usuario_id=current_user.id)
+            elif accion == 'restar':
+                # Restar más de lo disponible deja el stock en 0
+                retirar_stock(insumo.id, cantidad, 'Ajuste manual: salida', usuario_id=current_user.id)
+            elif accion == 'set':
+                fijar_stock(insumo.id, max(0, cantidad), 'Ajuste manual: inventario', usuario_id=current_user.id)
+        except StockInsuficiente as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('consultorio.ajustar_stock', id=id))
 
         db.session.commit()
         flash('Stock ajustado correctamente', 'success')
@@ -5,6 +5,7 @@ from app.models import (Caja, Venta, VentaDetalle, Pago, FormaPago, Consulta,
                         ConsultaInsumo, ConsultaProcedimiento, Especialidad,
                         ConfiguracionConsultorio)
 from app.utils.auditoria import audit
+from app.utils.stock import descontar_stock
 from datetime import datetime, date
 import traceback
 from sqlalchemy import func
@@ -81,8 +82,13 @@ def _total_sesion_tratamiento(sesion):
     )
 
 
-def _crear_venta_pendiente_desde_consulta(consulta, usuario_id, observaciones='Venta generada automaticamente desde consulta'):
-    """Crea una venta pendiente para una consulta si todavia no existe."""
+def _crear_venta_pendiente_desde_consulta(consulta, usuario_id, observaciones='Venta generada automaticamente desde consulta',
+                                         procedimientos=None, insumos=None):
+    """Crea una venta pendiente para una consulta si todavia no existe.
+
+    Quien acaba de crear la consulta puede pasar sus ConsultaProcedimiento y
+    ConsultaInsumo para calcular los totales sin volver a consultarlos.
+    """
     from app.models.consultorio import ConsultaInsumo, ConsultaProcedimiento, MovimientoInsumo, TratamientoSesion
     import time
 
@@ -99,10 +105,12 @@ def _crear_venta_pendiente_desde_consulta(consulta, usuario_id, observaciones='V
     especialidad = consulta.especialidad if consulta.especialidad else Especialidad.query.get(consulta.especialidad_id)
     precio_consulta = 0 if sesion_actual else (float(especialidad.precio_consulta) if especialidad and especialidad.precio_consulta else 0)
 
-    procedimientos = ConsultaProcedimiento.query.filter_by(consulta_id=consulta.id).all()
+    if procedimientos is None:
+        procedimientos = ConsultaProcedimiento.query.filter_by(consulta_id=consulta.id).all()
     total_procedimientos = sum(float(p.precio or 0) for p in procedimientos)
 
-    insumos = ConsultaInsumo.query.filter_by(consulta_id=consulta.id).all()
+    if insumos is None:
+        insumos = ConsultaInsumo.query.filter_by(consulta_id=consulta.id).all()
     total_insumos = sum(float(i.subtotal or 0) for i in insumos)
 
     total = precio_consulta + total_procedimientos + total_insumos
@@ -628,9 +636,8 @@ def nueva_venta_desde_consulta(consulta_id):
 @login_required
 def procesar_factura(consulta_id):
     """Procesar factura de consulta con pagos múltiples"""
-    from app.models.consultorio import ConsultaProcedimiento, ConsultaInsumo, MovimientoInsumo
+    from app.models.consultorio import ConsultaProcedimiento, ConsultaInsumo
     from app.models import ConfiguracionConsultorio
-    from app.models import Insumo
     
     consulta = Consulta.query.get_or_404(consulta_id)
     
@@ -799,22 +806,13 @@ def procesar_factura(consulta_id):
                 item_id=insumo_usado.insumo_id
             )
             db.session.add(detalle)
-            
-            # Actualizar stock
-            insumo = Insumo.query.get(insumo_usado.insumo_id)
-            if insumo:
-                insumo.cantidad_actual -= insumo_usado.cantidad
-                
-                # Registrar movimiento
-                movimiento = MovimientoInsumo(
-                    insumo_id=insumo.id,
-                    tipo='salida',
-                    cantidad=insumo_usado.cantidad,
-                    motivo=f"Venta #{numero_factura} - Consulta",
-                    usuario_id=current_user.id,
-                    fecha=datetime.utcnow()
-                )
-                db.session.add(movimiento)
+        
+        # Actualizar stock de todos los insumos en una sentencia (con sus movimientos);
+        # la venta no se bloquea por falta de stock
+        descontar_stock(
+            [(insumo_usado.insumo_id, insumo_usado.cantidad) for insumo_usado in insumos],
+            f"Venta #{numero_factura} - Consulta", usuario_id=current_user.id, permitir_negativo=True
+        )
         
         # Registrar pagos
         # Backwards-compatible: accept pagos via JSON (pagos_json) or the older fixed fields
@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template
 from flask_login import login_required, current_user
 from app.models import Cita, Consulta, Venta, Paciente
+from app.utils.estadisticas import tablero
+from app.utils.reposicion import filtrar_resumen, resumen_reposicion
 from datetime import date, timedelta
 from decimal import Decimal
 
@@ -23,29 +25,15 @@ def index():
 
 def admin_dashboard():
     """Dashboard para administradores"""
-    hoy = date.today()
-    manana = hoy + timedelta(days=1)
-    
-    # Estadísticas del día
-    citas_hoy = Cita.query.filter_by(fecha=hoy).count()
-    citas_pendientes = Cita.query.filter_by(fecha=hoy, estado='pendiente').count()
-    citas_confirmadas = Cita.query.filter_by(fecha=hoy, estado='confirmada').count()
-    
-    # Citas pendientes de mañana (para confirmar)
-    citas_por_confirmar = Cita.query.filter_by(
-        fecha=manana, 
-        estado='pendiente'
-    ).count()
-    
-    # Citas próximas
-    citas_proximas = Cita.query.filter_by(fecha=hoy).order_by(Cita.hora).limit(10).all()
+    datos = tablero('admin')
     
     return render_template('main/admin_dashboard.html',
-                         citas_hoy=citas_hoy,
-                         citas_pendientes=citas_pendientes,
-                         citas_confirmadas=citas_confirmadas,
-                         citas_por_confirmar=citas_por_confirmar,
-                         citas_proximas=citas_proximas)
+                         citas_hoy=datos['citas_hoy'],
+                         citas_pendientes=datos['citas_pendientes'],
+                         citas_confirmadas=datos['citas_confirmadas'],
+                         citas_por_confirmar=datos['citas_por_confirmar'],
+                         citas_proximas=datos['citas_proximas'],
+                         reposicion=resumen_reposicion())
 
 @bp.route('/medico/dashboard')
 @login_required
@@ -59,101 +47,38 @@ def medico_dashboard():
         from flask import abort
         abort(403)
     
-    hoy = date.today()
-    medico_id = current_user.medico.id
-    
-    # Estadísticas del médico
-    citas_hoy_pendientes = Cita.query.filter_by(
-        medico_id=medico_id, fecha=hoy, estado='pendiente'
-    ).count()
-    
-    citas_hoy_confirmadas = Cita.query.filter_by(
-        medico_id=medico_id, fecha=hoy, estado='confirmada'
-    ).count()
-    
-    pacientes_atendidos_hoy = Cita.query.filter_by(
-        medico_id=medico_id, fecha=hoy, estado='atendida'
-    ).count()
-    
-    # Próxima cita
-    proxima_cita = Cita.query.filter(
-        Cita.medico_id == medico_id,
-        Cita.fecha >= hoy,
-        Cita.estado.in_(['pendiente', 'confirmada'])
-    ).order_by(Cita.fecha, Cita.hora).first()
-    
-    # Citas de hoy
-    citas_hoy = Cita.query.filter_by(
-        medico_id=medico_id, fecha=hoy
-    ).filter(Cita.estado.in_(['pendiente', 'confirmada'])).order_by(Cita.hora).all()
-    
-    # Consultas completadas vs pendientes
-    consultas_completadas = Consulta.query.filter_by(medico_id=medico_id).count()
-    citas_totales = Cita.query.filter_by(medico_id=medico_id).count()
+    datos = tablero('medico', medico_id=current_user.medico.id)
     
     return render_template('main/medico_dashboard.html',
-                         citas_pendientes=citas_hoy_pendientes,
-                         citas_confirmadas=citas_hoy_confirmadas,
-                         pacientes_atendidos=pacientes_atendidos_hoy,
-                         proxima_cita=proxima_cita,
-                         citas_hoy=citas_hoy,
-                         consultas_completadas=consultas_completadas,
-                         citas_totales=citas_totales)
+                         citas_pendientes=datos['citas_pendientes'],
+                         citas_confirmadas=datos['citas_confirmadas'],
+                         pacientes_atendidos=datos['pacientes_atendidos'],
+                         proxima_cita=datos['proxima_cita'],
+                         citas_hoy=datos['citas_hoy'],
+                         consultas_completadas=datos['consultas_completadas'],
+                         citas_totales=datos['citas_totales'],
+                         reposicion=filtrar_resumen(
+                             resumen_reposicion(),
+                             [me.especialidad_id for me in current_user.medico.especialidades]
+                         ))
 
 @bp.route('/recepcionista/dashboard')
 @login_required
 def recepcionista_dashboard():
     """Dashboard para recepcionistas"""
-    from app.models import Medico
-    from sqlalchemy import func
-    
     if current_user.rol != 'recepcionista':
         from flask import abort
         abort(403)
     
-    hoy = date.today()
-    manana = hoy + timedelta(days=1)
-    
-    # Estadísticas del día (todos los médicos)
-    citas_hoy = Cita.query.filter_by(fecha=hoy).count()
-    citas_pendientes = Cita.query.filter_by(fecha=hoy, estado='pendiente').count()
-    citas_confirmadas = Cita.query.filter_by(fecha=hoy, estado='confirmada').count()
-    
-    # Citas por confirmar (mañana)
-    citas_por_confirmar_count = Cita.query.filter_by(
-        fecha=manana,
-        estado='pendiente'
-    ).count()
-    
-    # Citas próximas de hoy
-    citas_proximas = Cita.query.filter_by(fecha=hoy).order_by(Cita.hora).limit(10).all()
-    
-    # Estadísticas de ocupación
-    total_slots_disponibles = 50  # Esto se podría calcular dinámicamente
-    ocupacion = int((citas_hoy / total_slots_disponibles * 100)) if total_slots_disponibles > 0 else 0
-    
-    # Resumen por médico
-    citas_por_medico = []
-    medicos = Medico.query.all()
-    for medico in medicos:
-        citas = Cita.query.filter_by(medico_id=medico.id, fecha=hoy).all()
-        if citas:
-            citas_por_medico.append({
-                'nombre': medico.nombre_completo,
-                'total': len(citas),
-                'pendientes': len([c for c in citas if c.estado == 'pendiente']),
-                'confirmadas': len([c for c in citas if c.estado == 'confirmada']),
-                'atendidas': len([c for c in citas if c.estado == 'atendida'])
-            })
+    datos = tablero('recepcionista')
     
     return render_template('main/recepcionista_dashboard.html',
-                         citas_hoy=citas_hoy,
-                         citas_pendientes=citas_pendientes,
-                         citas_confirmadas=citas_confirmadas,
-                         citas_por_confirmar_count=citas_por_confirmar_count,
-                         citas_proximas=citas_proximas,
-                         ocupacion=ocupacion,
-                         citas_por_medico=citas_por_medico)
+                         citas_hoy=datos['citas_hoy'],
+                         citas_pendientes=datos['citas_pendientes'],
+                         citas_confirmadas=datos['citas_confirmadas'],
+                         citas_por_confirmar_count=datos['citas_por_confirmar'],
+                         citas_proximas=datos['citas_proximas'],
+                         citas_por_medico=datos['citas_por_medico'])
 
 @bp.route('/cajero/dashboard')
 @login_required
@@ -173,15 +98,8 @@ def cajero_dashboard():
         estado='abierta'
     ).first()
     
-    # Estadísticas del día
-    ventas_hoy = Venta.query.filter(
-        Venta.fecha >= hoy,
-        Venta.fecha < hoy + timedelta(days=1)
-    ).all()
-    
-    total_vendido_hoy = sum(float(v.total) for v in ventas_hoy if v.estado == 'pagada')
-    ventas_pendientes = len([v for v in ventas_hoy if v.estado == 'pendiente'])
-    ventas_pagadas = len([v for v in ventas_hoy if v.estado == 'pagada'])
+    # Estadísticas del día (compartidas entre cajeros)
+    datos = tablero('cajero', hoy)
     
     # Si tiene caja abierta, ventas de su caja
     ventas_mi_caja = []
@@ -198,10 +116,10 @@ def cajero_dashboard():
     
     return render_template('main/cajero_dashboard.html',
                          caja_abierta=caja_abierta,
-                         ventas_hoy=len(ventas_hoy),
-                         total_vendido_hoy=total_vendido_hoy,
-                         ventas_pendientes=ventas_pendientes,
-                         ventas_pagadas=ventas_pagadas,
+                         ventas_hoy=datos['ventas_hoy'],
+                         total_vendido_hoy=datos['total_vendido_hoy'],
+                         ventas_pendientes=datos['ventas_pendientes'],
+                         ventas_pagadas=datos['ventas_pagadas'],
                          ventas_mi_caja=ventas_mi_caja,
                          total_mi_caja=total_mi_caja)
 
@@ -0,0 +1,216 @@
+"""
+Búsqueda de texto completo en consultas.
+
+Cada consulta tiene un documento de búsqueda (`Consulta.busqueda`) armado con
+su diagnóstico, motivo, observaciones, los medicamentos de sus recetas y las
+descripciones de sus órdenes de estudio, normalizados con `normalizar_texto`
+(sin acentos ni mayúsculas).
+
+- PostgreSQL: la columna es un `tsvector` con la configuración de texto
+  BUSQUEDA_CLINICA_CONFIG ('spanish', con stemming: "fracturas" encuentra
+  "fractura"), indexada con GIN
+  (`ix_consultas_busqueda_gin`). El diagnóstico pesa más que el motivo y
+  este más que el resto al ordenar por `ts_rank_cd`.
+- Otros motores: la columna guarda el texto normalizado y se busca que
+  contenga todos los términos, sin stemming, de la más reciente a la más
+  antigua. Se interpreta la misma sintaxis que `websearch_to_tsquery`
+  ("frase exacta", -excluir, or).
+
+El documento se recalcula en el mismo flush en que cambian los campos de la
+consulta o sus recetas u órdenes (ver `init_busqueda_clinica`).
+"""
+import re
+from collections import defaultdict
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, bindparam, cast, event, func, literal, literal_column, not_, or_, select, update
+from sqlalchemy.dialects.postgresql import REGCONFIG
+
+from app import db
+from app.models import Consulta, OrdenEstudio, Receta
+from app.utils.texto import normalizar_consulta, normalizar_texto
+
+
+RESULTADOS_POR_PAGINA = 20
+
+# Campos de la consulta que forman parte del documento
+_CAMPOS_CONSULTA = ('motivo', 'diagnostico', 'observaciones')
+
+# Términos de una consulta: "frase" (con - opcional) o palabra
+_TERMINO = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+
+
+def _configuracion():
+    if has_app_context():
+        return current_app.config.get('BUSQUEDA_CLINICA_CONFIG', 'spanish')
+    return 'spanish'
+
+
+def _es_postgres(bind):
+    return bind.dialect.name == 'postgresql'
+
+
+def documentos_consultas(connection, consulta_ids):
+    """
+    Partes normalizadas del documento de búsqueda de cada consulta.
+
+    Returns:
+        dict {consulta_id: (diagnostico, motivo, resto)}
+    """
+    ids = list(consulta_ids)
+    consultas = Consulta.__table__
+    extras = defaultdict(list)
+    for consulta_id, medicamento in connection.execute(
+        select(Receta.consulta_id, Receta.medicamento).where(Receta.consulta_id.in_(ids))
+    ):
+        extras[consulta_id].append(medicamento)
+    for consulta_id, descripcion in connection.execute(
+        select(OrdenEstudio.consulta_id, OrdenEstudio.descripcion).where(OrdenEstudio.consulta_id.in_(ids))
+    ):
+        extras[consulta_id].append(descripcion)
+
+    return {
+        consulta_id: (
+            normalizar_texto(diagnostico),
+            normalizar_texto(motivo),
+            normalizar_texto(observaciones, *extras.get(consulta_id, ()))
+        )
+        for consulta_id, motivo, diagnostico, observaciones in connection.execute(
+            select(consultas.c.id, consultas.c.motivo, consultas.c.diagnostico, consultas.c.observaciones)
+            .where(consultas.c.id.in_(ids))
+        )
+    }
+
+
+def _valor_documento(connection):
+    """Expresión SQL del documento a partir de los parámetros :doc_diag, :doc_motivo y :doc_resto."""
+    if not _es_postgres(connection):
+        partes = [bindparam(nombre, type_=db.String) for nombre in ('doc_diag', 'doc_motivo', 'doc_resto')]
+        return func.trim(partes[0] + ' ' + partes[1] + ' ' + partes[2])
+    config = cast(literal(_configuracion()), REGCONFIG)
+    return (
+        func.setweight(func.to_tsvector(config, bindparam('doc_diag')), literal_column("'A'"))
+        .op('||')(func.setweight(func.to_tsvector(config, bindparam('doc_motivo')), literal_column("'B'")))
+        .op('||')(func.setweight(func.to_tsvector(config, bindparam('doc_resto')), literal_column("'C'")))
+    )
+
+
+def actualizar_documentos(connection, consulta_ids, lote=500):
+    """Recalcula el documento de búsqueda de las consultas dadas (en lotes)."""
+    ids = sorted(set(consulta_ids))
+    consultas = Consulta.__table__
+    sentencia = update(consultas).where(consultas.c.id == bindparam('cid')).values(
+        busqueda=_valor_documento(connection)
+    )
+    for i in range(0, len(ids), lote):
+        documentos = documentos_consultas(connection, ids[i:i + lote])
+        if documentos:
+            connection.execute(sentencia, [
+                {'cid': consulta_id, 'doc_diag': diag, 'doc_motivo': motivo, 'doc_resto': resto}
+                for consulta_id, (diag, motivo, resto) in documentos.items()
+            ])
+
+
+def _filtro_texto(consulta):
+    """
+    Condición sobre el documento normalizado para motores sin tsquery, con la
+    sintaxis de `websearch_to_tsquery`: los términos se combinan con AND,
+    "or" une el término anterior con el siguiente y "-" excluye.
+    """
+    condiciones = []
+    unir = False
+    for signo_frase, frase, palabra in _TERMINO.findall(consulta):
+        if palabra == 'or':
+            unir = bool(condiciones)
+            continue
+        excluir = signo_frase == '-' or (palabra.startswith('-') and len(palabra) > 1)
+        termino = normalizar_texto(frase if not palabra else palabra)
+        if not termino:
+            continue
+        condicion = Consulta.busqueda.contains(termino, autoescape=True)
+        if excluir:
+            condicion = not_(condicion)
+        if unir:
+            condiciones[-1] = or_(condiciones[-1], condicion)
+        else:
+            condiciones.append(condicion)
+        unir = False
+    return and_(*condiciones) if condiciones else None
+
+
+def buscar_consultas(query, texto, pagina=1, por_pagina=RESULTADOS_POR_PAGINA):
+    """
+    Busca consultas por texto libre dentro de `query`.
+
+    Args:
+        query: query base de Consulta (ej. `get_filtered_query(Consulta)`, que
+            limita a las consultas del médico actual)
+        texto: términos a buscar, con la sintaxis de `websearch_to_tsquery`
+            ("frase exacta", -excluir, or)
+        pagina: número de página (desde 1)
+        por_pagina: resultados por página
+
+    Returns:
+        (list de Consulta, hay_mas): los resultados de la página ordenados
+        por relevancia y un bool que indica si hay una página siguiente
+    """
+    # Sin acentos ni mayúsculas, como el documento, pero conservando "comillas" y -
+    consulta = normalizar_consulta(texto)
+    if not normalizar_texto(consulta):
+        return [], False
+    pagina = max(pagina, 1)
+
+    if _es_postgres(db.engine):
+        tsquery = func.websearch_to_tsquery(cast(literal(_configuracion()), REGCONFIG), consulta)
+        query = query.filter(Consulta.busqueda.op('@@')(tsquery)).order_by(
+            func.ts_rank_cd(Consulta.busqueda, tsquery).desc(), Consulta.fecha.desc(), Consulta.id.desc()
+        )
+    else:
+        filtro = _filtro_texto(consulta)
+        if filtro is None:
+            return [], False
+        query = query.filter(filtro).order_by(Consulta.fecha.desc(), Consulta.id.desc())
+
+    filas = query.offset((pagina - 1) * por_pagina).limit(por_pagina + 1).all()
+    return filas[:por_pagina], len(filas) > por_pagina
+
+
+# ---------------------------------------------------------------------------
+# Mantenimiento: en cada flush se recalcula el documento de las consultas
+# nuevas o con cambios en sus campos, recetas u órdenes de estudio.
+# ---------------------------------------------------------------------------
+
+def _consultas_afectadas(session):
+    ids = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Consulta):
+            if obj in session.deleted:
+                continue
+            estado = db.inspect(obj)
+            if obj in session.dirty and not any(
+                estado.attrs[campo].history.has_changes() for campo in _CAMPOS_CONSULTA
+            ):
+                continue
+            ids.add(obj.id)
+        elif isinstance(obj, (Receta, OrdenEstudio)):
+            campo = 'medicamento' if isinstance(obj, Receta) else 'descripcion'
+            estado = db.inspect(obj)
+            if obj in session.dirty and not (
+                estado.attrs[campo].history.has_changes() or estado.attrs.consulta_id.history.has_changes()
+            ):
+                continue
+            historial = estado.attrs.consulta_id.history
+            ids.update(v for v in (*historial.added, *historial.unchanged, *historial.deleted) if v is not None)
+    return ids
+
+
+def _actualizar_en_flush(session, flush_context):
+    ids = _consultas_afectadas(session)
+    if ids:
+        actualizar_documentos(session.connection(), ids)
+
+
+def init_busqueda_clinica(app):
+    """Engancha el mantenimiento del documento de búsqueda de consultas a la sesión."""
+    if not event.contains(db.session, 'after_flush', _actualizar_en_flush):
+        event.listen(db.session, 'after_flush', _actualizar_en_flush)
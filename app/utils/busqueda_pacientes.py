@@ -0,0 +1,234 @@
+"""
+Búsqueda de pacientes por similitud de trigramas, tolerante a acentos y typos.
+
+Se busca sobre `Paciente.busqueda` ("nombre apellido cedula" normalizado con
+`normalizar_texto`), normalizando la consulta de la misma forma.
+
+- PostgreSQL con la extensión pg_trgm: filtra con `busqueda %> q` / LIKE y
+  ordena por distancia `busqueda <->> q`, ambos resueltos por el índice GiST
+  `ix_pacientes_busqueda_trgm`, por lo que el top-N no recorre la tabla.
+- Otros motores (o PostgreSQL sin pg_trgm): índice invertido de trigramas en
+  memoria del proceso, construido una vez y actualizado al confirmar cambios
+  de pacientes; se reconstruye cada PACIENTES_INDICE_TTL segundos para
+  recoger altas hechas por otros workers.
+"""
+import heapq
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import current_app, has_app_context
+from sqlalchemy import or_, text
+
+from app import db
+from app.models import Paciente
+from app.utils.cache import invalidar_al_confirmar
+from app.utils.texto import normalizar_texto
+
+
+# Proporción mínima de trigramas de la consulta presentes en el paciente
+UMBRAL_SIMILITUD = 0.5
+
+
+def trigramas(texto):
+    """Trigramas de cada palabra con el mismo relleno que pg_trgm ('  ab', 'ab ')."""
+    resultado = set()
+    for palabra in texto.split():
+        palabra = f'  {palabra} '
+        resultado.update(palabra[i:i + 3] for i in range(len(palabra) - 2))
+    return resultado
+
+
+class IndiceNgramas:
+    """Índice invertido trigrama -> ids de paciente, en memoria y seguro entre hilos."""
+
+    def __init__(self):
+        self._textos = {}
+        self._postings = defaultdict(set)
+        self._lock = threading.Lock()
+        self.construido_en = None
+
+    def cargar(self, filas):
+        """Reconstruye el índice desde filas (id, texto normalizado, activo)."""
+        textos = {}
+        postings = defaultdict(set)
+        for paciente_id, texto, activo in filas:
+            textos[paciente_id] = (texto, activo)
+            for t in trigramas(texto):
+                postings[t].add(paciente_id)
+        with self._lock:
+            self._textos = textos
+            self._postings = postings
+            self.construido_en = time.monotonic()
+
+    def actualizar(self, paciente_id, texto, activo):
+        with self._lock:
+            self._quitar(paciente_id)
+            self._textos[paciente_id] = (texto, activo)
+            for t in trigramas(texto):
+                self._postings[t].add(paciente_id)
+
+    def eliminar(self, paciente_id):
+        with self._lock:
+            self._quitar(paciente_id)
+
+    def _quitar(self, paciente_id):
+        anterior = self._textos.pop(paciente_id, None)
+        if anterior is not None:
+            for t in trigramas(anterior[0]):
+                self._postings[t].discard(paciente_id)
+
+    def buscar(self, consulta, limite, solo_activos=True):
+        """
+        Devuelve [(id, puntaje)] de los `limite` pacientes más parecidos.
+
+        El puntaje es la proporción de trigramas de la consulta presentes en el
+        paciente (1.0 si la consulta aparece literalmente); a igual puntaje
+        gana el texto más corto.
+        """
+        trig_consulta = trigramas(consulta)
+        if not trig_consulta:
+            return []
+        with self._lock:
+            coincidencias = Counter()
+            for t in trig_consulta:
+                coincidencias.update(self._postings.get(t, ()))
+            candidatos = []
+            for paciente_id, compartidos in coincidencias.items():
+                texto, activo = self._textos[paciente_id]
+                if solo_activos and not activo:
+                    continue
+                puntaje = 1.0 if consulta in texto else compartidos / len(trig_consulta)
+                if puntaje >= UMBRAL_SIMILITUD:
+                    candidatos.append((puntaje, -len(texto), -paciente_id))
+        mejores = heapq.nlargest(limite, candidatos)
+        return [(-paciente_id, puntaje) for puntaje, _, paciente_id in mejores]
+
+
+class EstadoBusqueda:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.usa_trigramas = None
+        self.indice = IndiceNgramas()
+
+
+def _estado():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('busqueda_pacientes')
+
+
+def _detectar_trigramas():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    fila = db.session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+    return fila is not None
+
+
+def _buscar_trigramas(consulta, limite, solo_activos):
+    query = Paciente.query.filter(
+        or_(
+            Paciente.busqueda.contains(consulta, autoescape=True),
+            Paciente.busqueda.op('%>')(consulta)
+        )
+    )
+    if solo_activos:
+        query = query.filter(Paciente.activo == True)
+    return query.order_by(Paciente.busqueda.op('<->>')(consulta), Paciente.id).limit(limite).all()
+
+
+def _buscar_en_memoria(estado, consulta, limite, solo_activos):
+    indice = estado.indice
+    if indice.construido_en is None or time.monotonic() - indice.construido_en > estado.ttl:
+        filas = db.session.query(Paciente.id, Paciente.nombre, Paciente.apellido, Paciente.cedula, Paciente.activo)
+        indice.cargar(
+            (p.id, normalizar_texto(p.nombre, p.apellido, p.cedula), p.activo is not False)
+            for p in filas
+        )
+    ids = [paciente_id for paciente_id, _ in indice.buscar(consulta, limite, solo_activos)]
+    if not ids:
+        return []
+    por_id = {p.id: p for p in Paciente.query.filter(Paciente.id.in_(ids))}
+    return [por_id[i] for i in ids if i in por_id]
+
+
+def buscar_pacientes(texto_busqueda, limite=10, solo_activos=True):
+    """
+    Busca pacientes por nombre, apellido o cédula ordenados por similitud.
+
+    Args:
+        texto_busqueda: texto ingresado por el usuario (acentos y mayúsculas indistintos)
+        limite: cantidad máxima de resultados
+        solo_activos: excluir pacientes inactivos
+
+    Returns:
+        list de Paciente, del más al menos parecido
+    """
+    consulta = normalizar_texto(texto_busqueda)
+    if not consulta:
+        return []
+    estado = _estado()
+    if estado is None:
+        estado = EstadoBusqueda(ttl=0)
+    if estado.usa_trigramas is None:
+        estado.usa_trigramas = _detectar_trigramas()
+    if estado.usa_trigramas:
+        return _buscar_trigramas(consulta, limite, solo_activos)
+    return _buscar_en_memoria(estado, consulta, limite, solo_activos)
+
+
+# ---------------------------------------------------------------------------
+# Mantenimiento del índice en memoria: los cambios de pacientes se anotan en
+# el flush y se aplican al confirmar la transacción.
+# ---------------------------------------------------------------------------
+
+_PENDIENTES = 'busqueda_pacientes_cambios'
+_RECONSTRUIR = 'busqueda_pacientes_reconstruir'
+
+
+def _registrar_cambios(session, flush_context):
+    estado = _estado()
+    if estado is None or estado.indice.construido_en is None:
+        return
+    cambios = session.info.setdefault(_PENDIENTES, [])
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Paciente) and obj.id is not None:
+            cambios.append((obj.id, obj.busqueda or normalizar_texto(obj.nombre, obj.apellido, obj.cedula),
+                            obj.activo is not False))
+    for obj in session.deleted:
+        if isinstance(obj, Paciente):
+            cambios.append((obj.id, None, False))
+
+
+def _aplicar_cambios(session):
+    cambios = session.info.pop(_PENDIENTES, None)
+    reconstruir = session.info.pop(_RECONSTRUIR, None)
+    estado = _estado()
+    if not cambios or estado is None:
+        return
+    if reconstruir:
+        estado.indice.construido_en = None
+        return
+    for paciente_id, texto, activo in cambios:
+        if texto is None:
+            estado.indice.eliminar(paciente_id)
+        else:
+            estado.indice.actualizar(paciente_id, texto, activo)
+
+
+def _descartar_cambios(session):
+    session.info.pop(_PENDIENTES, None)
+    session.info.pop(_RECONSTRUIR, None)
+
+
+def _revertir_savepoint(session):
+    # No se sabe qué cambios anotados quedaron en la base: el índice se reconstruye
+    if session.info.get(_PENDIENTES):
+        session.info[_RECONSTRUIR] = True
+
+
+def init_busqueda_pacientes(app):
+    """Registra el estado de la búsqueda de pacientes y el mantenimiento del índice en memoria."""
+    app.extensions['busqueda_pacientes'] = EstadoBusqueda(ttl=app.config.get('PACIENTES_INDICE_TTL', 300))
+    invalidar_al_confirmar(db.session, _registrar_cambios, _aplicar_cambios, _descartar_cambios,
+                           revertir_savepoint=_revertir_savepoint)
@@ -0,0 +1,193 @@
+"""
+Backends de caché compartidos por los módulos que guardan resultados calculados.
+
+- `CacheMemoria`: LRU en proceso (por defecto). Cada worker tiene la suya.
+- `CacheRedis`: caché compartida entre workers; requiere el paquete `redis`
+  (dependencia opcional, no incluida en requirements.txt).
+
+El backend se elige con `CACHE_BACKEND` ('memoria', 'redis' o la ruta
+'paquete.modulo:Clase' de una implementación propia con la misma interfaz).
+Los valores deben ser serializables a JSON para que todos los backends se
+comporten igual.
+
+`invalidar_al_confirmar` engancha a la sesión la invalidación de una caché
+cuando se confirma la transacción.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from werkzeug.utils import import_string
+
+
+class CacheMemoria:
+    """Caché LRU en memoria del proceso, segura entre hilos."""
+
+    def __init__(self, max_entradas=1024, ttl=None, **kwargs):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _vigente(self, clave, ahora):
+        item = self._datos.get(clave)
+        if item is None:
+            return None
+        valor, expira = item
+        if expira is not None and expira <= ahora:
+            del self._datos[clave]
+            return None
+        self._datos.move_to_end(clave)
+        return valor
+
+    def get(self, clave):
+        with self._lock:
+            return self._vigente(clave, time.monotonic())
+
+    def get_many(self, claves):
+        ahora = time.monotonic()
+        with self._lock:
+            return [self._vigente(clave, ahora) for clave in claves]
+
+    def set(self, clave, valor, ttl=None):
+        self.set_many({clave: valor}, ttl=ttl)
+
+    def set_many(self, valores, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expira = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            for clave, valor in valores.items():
+                self._datos[clave] = (valor, expira)
+                self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def delete_many(self, claves):
+        with self._lock:
+            for clave in claves:
+                self._datos.pop(clave, None)
+
+    def delete_prefix(self, prefijo):
+        with self._lock:
+            for clave in [c for c in self._datos if c.startswith(prefijo)]:
+                del self._datos[clave]
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+
+class CacheRedis:
+    """Caché compartida en Redis; todas las claves llevan el prefijo `espacio`."""
+
+    def __init__(self, url, espacio='consultorio', ttl=None, **kwargs):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND='redis' requiere instalar el paquete 'redis'")
+        self._redis = redis.Redis.from_url(url)
+        self.espacio = espacio
+        self.ttl = ttl
+
+    def _clave(self, clave):
+        return f'{self.espacio}:{clave}'
+
+    def get(self, clave):
+        return self.get_many([clave])[0]
+
+    def get_many(self, claves):
+        if not claves:
+            return []
+        crudos = self._redis.mget([self._clave(c) for c in claves])
+        return [json.loads(c) if c is not None else None for c in crudos]
+
+    def set(self, clave, valor, ttl=None):
+        self.set_many({clave: valor}, ttl=ttl)
+
+    def set_many(self, valores, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        pipe = self._redis.pipeline()
+        for clave, valor in valores.items():
+            pipe.set(self._clave(clave), json.dumps(valor), ex=ttl or None)
+        pipe.execute()
+
+    def delete_many(self, claves):
+        if claves:
+            self._redis.delete(*[self._clave(c) for c in claves])
+
+    def delete_prefix(self, prefijo):
+        claves = list(self._redis.scan_iter(match=self._clave(prefijo) + '*'))
+        if claves:
+            self._redis.delete(*claves)
+
+    def clear(self):
+        self.delete_prefix('')
+
+
+BACKENDS = {
+    'memoria': CacheMemoria,
+    'redis': CacheRedis,
+}
+
+
+def crear_cache(app, espacio, max_entradas=1024, ttl=None):
+    """
+    Crea el backend configurado en `CACHE_BACKEND` para un espacio de claves.
+
+    Args:
+        app: aplicación Flask
+        espacio: nombre lógico de la caché (prefijo de claves en backends compartidos)
+        max_entradas: tamaño máximo para el backend en memoria
+        ttl: segundos de vida por defecto de cada entrada (None = sin vencimiento)
+    """
+    nombre = app.config.get('CACHE_BACKEND', 'memoria')
+    clase = BACKENDS.get(nombre)
+    if clase is None:
+        clase = import_string(nombre.replace(':', '.'))
+    return clase(
+        url=app.config.get('CACHE_REDIS_URL'),
+        espacio=espacio,
+        max_entradas=max_entradas,
+        ttl=ttl
+    )
+
+
+def invalidar_al_confirmar(session, registrar, aplicar, descartar, revertir_savepoint=None):
+    """
+    Engancha a la sesión el mantenimiento de una caché.
+
+    `registrar(session, flush_context)` anota en `session.info` lo que cambió
+    en cada flush, `aplicar(session)` lo invalida al confirmarse la
+    transacción y `descartar(session)` lo olvida si se revierte.
+
+    `after_commit` y `after_rollback` también se disparan al liberar o
+    revertir un savepoint (`begin_nested`). Esos se ignoran: invalidar antes
+    del commit real dejaría que otra petición vuelva a guardar los datos
+    viejos, y revertir un savepoint no debe perder lo anotado antes. Lo
+    anotado dentro de un savepoint revertido se aplica igual al confirmar
+    (una invalidación de más); si eso no alcanza, `revertir_savepoint(session)`
+    permite reaccionar.
+
+    Args:
+        session: sesión (o scoped_session) a la que engancharse
+        registrar, aplicar, descartar: funciones de la caché
+        revertir_savepoint: opcional, llamada al revertirse un savepoint
+    """
+    if event.contains(session, 'after_flush', registrar):
+        return
+
+    def al_confirmar(session):
+        if not session.in_nested_transaction():
+            aplicar(session)
+
+    def al_revertir(session):
+        if not session.in_nested_transaction():
+            descartar(session)
+        elif revertir_savepoint is not None:
+            revertir_savepoint(session)
+
+    event.listen(session, 'after_flush', registrar)
+    event.listen(session, 'after_commit', al_confirmar)
+    event.listen(session, 'after_rollback', al_revertir)
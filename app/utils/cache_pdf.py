@@ -0,0 +1,137 @@
+"""
+Caché en disco de los PDF clínicos (recetas, órdenes y justificativos).
+
+Cada PDF se guarda en REPORTS_FOLDER/pdf_cache con un nombre que incluye el
+tipo, el ID del documento y un hash de todo lo que se imprime: la fila del
+documento, los datos de la consulta, paciente y médico, y el membrete del
+consultorio (incluido el archivo del logo). Si cambia cualquiera de esos
+datos cambia el nombre, así que nunca se sirve un PDF desactualizado; las
+versiones anteriores del mismo documento se borran al guardar la nueva.
+
+La carpeta se limita a PDF_CACHE_MAX_MB: al superarse se borran los archivos
+usados hace más tiempo (la fecha de modificación se actualiza en cada
+descarga). Los archivos se escriben con un reemplazo atómico, así que varios
+workers pueden compartir la carpeta.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from flask import current_app, send_file
+
+from app import db
+
+
+# Subir al cambiar el diseño de los PDF para no servir los generados con el anterior
+VERSION = 1
+
+SUBCARPETA = 'pdf_cache'
+
+
+def _carpeta():
+    carpeta = os.path.join(current_app.config['REPORTS_FOLDER'], SUBCARPETA)
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+
+def _valores(fila):
+    if fila is None:
+        return None
+    return {atributo.key: getattr(fila, atributo.key) for atributo in db.inspect(fila).mapper.column_attrs}
+
+
+def clave_pdf(tipo, documento, consulta, config, logo_path=None):
+    """
+    Nombre de archivo del PDF según su contenido.
+
+    Args:
+        tipo: tipo de documento ('receta', 'orden', ...)
+        documento: fila impresa (Receta u OrdenEstudio)
+        consulta: Consulta del documento
+        config: ConfiguracionConsultorio (membrete)
+        logo_path: archivo del logo usado, si hay
+    """
+    logo = None
+    if logo_path:
+        try:
+            estado = os.stat(logo_path)
+            logo = [logo_path, estado.st_mtime_ns, estado.st_size]
+        except OSError:
+            pass
+    paciente, medico = consulta.paciente, consulta.medico
+    # Solo los datos del membrete: `fecha_actualizacion` cambia con cada factura emitida
+    fuente = {
+        'version': VERSION,
+        'documento': _valores(documento),
+        'consulta': [consulta.id, consulta.fecha],
+        'paciente': [paciente.nombre_completo, paciente.cedula] if paciente else None,
+        'medico': [medico.nombre_completo, medico.registro_profesional] if medico else None,
+        'especialidad': consulta.especialidad.nombre if consulta.especialidad else None,
+        'membrete': [config.nombre, config.direccion, config.telefono, config.email, config.ruc, logo],
+    }
+    resumen = hashlib.sha256(json.dumps(fuente, sort_keys=True, default=str).encode()).hexdigest()[:32]
+    return f'{tipo}_{documento.id}_{resumen}.pdf'
+
+
+def pdf_cacheado(clave, download_name):
+    """Respuesta con el PDF guardado para `clave`, o None si no está."""
+    ruta = os.path.join(_carpeta(), clave)
+    try:
+        archivo = open(ruta, 'rb')
+    except OSError:
+        return None
+    try:
+        os.utime(ruta)
+    except OSError:
+        pass
+    return send_file(archivo, mimetype='application/pdf', as_attachment=True, download_name=download_name)
+
+
+def guardar_pdf(clave, contenido):
+    """Guarda el PDF generado para `clave`; un error de disco solo se registra."""
+    carpeta = _carpeta()
+    try:
+        descriptor, temporal = tempfile.mkstemp(dir=carpeta, suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, os.path.join(carpeta, clave))
+    except OSError as e:
+        current_app.logger.warning(f"[cache_pdf] No se pudo guardar {clave}: {e}")
+        return
+
+    # Versiones anteriores del mismo documento (tipo_id_*)
+    prefijo = clave.rsplit('_', 1)[0] + '_'
+    with os.scandir(carpeta) as entradas:
+        anteriores = [e.path for e in entradas if e.name.startswith(prefijo) and e.name != clave]
+    for ruta in anteriores:
+        _borrar(ruta)
+    _recortar(carpeta, current_app.config.get('PDF_CACHE_MAX_MB', 200) * 1024 * 1024)
+
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+
+def _recortar(carpeta, maximo):
+    """Borra los PDF usados hace más tiempo hasta dejar la carpeta en el 90% de `maximo`."""
+    archivos = []
+    total = 0
+    with os.scandir(carpeta) as entradas:
+        for entrada in entradas:
+            try:
+                estado = entrada.stat()
+            except OSError:
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, entrada.path))
+            total += estado.st_size
+    if total <= maximo:
+        return
+    for _, tamano, ruta in sorted(archivos):
+        _borrar(ruta)
+        total -= tamano
+        if total <= maximo * 0.9:
+            break
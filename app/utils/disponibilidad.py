@@ -0,0 +1,561 @@
+"""
+Motor de disponibilidad de agenda médica.
+
+Carga en un número fijo de consultas todo lo que determina la agenda de un
+médico en un rango de fechas (horarios, vacaciones, permisos y citas
+activas) y responde las preguntas por slot en memoria, usando índices por
+fecha en lugar de recorrer las listas completas en cada slot.
+
+Las grillas por médico y día se guardan en la caché 'disponibilidad'
+(ver `init_cache_disponibilidad`) y se invalidan al confirmar cualquier
+cambio que las afecte.
+"""
+import heapq
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, select
+
+from app import db
+from app.models import Cita, HorarioAtencion, Medico, MedicoEspecialidad, Vacacion, Permiso
+from app.utils.cache import crear_cache, invalidar_al_confirmar
+
+
+# Estados de cita que bloquean un slot de la agenda
+ESTADOS_CITA_ACTIVA = ('pendiente', 'confirmada')
+
+DIAS_ESPANOL = ['LUN', 'MAR', 'MIÉ', 'JUE', 'VIE', 'SÁB', 'DOM']
+MESES_ESPANOL = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
+                 'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+
+
+class IntervalosFecha:
+    """Conjunto de rangos de fechas [inicio, fin] fusionados y ordenados.
+
+    Las búsquedas se resuelven con bisect en O(log n).
+    """
+
+    def __init__(self, rangos):
+        inicios = []
+        fines = []
+        for inicio, fin in sorted(rangos):
+            if fines and inicio <= fines[-1] + timedelta(days=1):
+                if fin > fines[-1]:
+                    fines[-1] = fin
+                continue
+            inicios.append(inicio)
+            fines.append(fin)
+        self._inicios = inicios
+        self._fines = fines
+
+    def contiene(self, fecha):
+        i = bisect_right(self._inicios, fecha) - 1
+        return i >= 0 and fecha <= self._fines[i]
+
+
+class IntervalosHora:
+    """Rangos horarios [inicio, fin) de un mismo día, fusionados y ordenados.
+
+    `todo_el_dia` indica que existe al menos un rango sin horas definidas.
+    """
+
+    def __init__(self):
+        self.todo_el_dia = False
+        self._rangos = []
+        self._inicios = None
+        self._fines = None
+
+    def agregar(self, hora_inicio, hora_fin):
+        if hora_inicio is None or hora_fin is None:
+            self.todo_el_dia = True
+        else:
+            self._rangos.append((hora_inicio, hora_fin))
+        self._inicios = None
+
+    def _compilar(self):
+        inicios = []
+        fines = []
+        for inicio, fin in sorted(self._rangos):
+            if fines and inicio <= fines[-1]:
+                if fin > fines[-1]:
+                    fines[-1] = fin
+                continue
+            inicios.append(inicio)
+            fines.append(fin)
+        self._inicios = inicios
+        self._fines = fines
+
+    def contiene(self, hora):
+        if self.todo_el_dia:
+            return True
+        if self._inicios is None:
+            self._compilar()
+        i = bisect_right(self._inicios, hora) - 1
+        return i >= 0 and hora < self._fines[i]
+
+
+class AgendaMedico:
+    """Agenda precargada de un médico para un rango de fechas.
+
+    Se construye con `cargar_agenda()`; a partir de ahí todas las consultas
+    de disponibilidad se resuelven en memoria.
+    """
+
+    def __init__(self, medico_id, fecha_desde, fecha_hasta, horarios, vacaciones, permisos, citas):
+        self.medico_id = medico_id
+        self.fecha_desde = fecha_desde
+        self.fecha_hasta = fecha_hasta
+
+        # Rangos de atención por día de semana (0=Lunes), sin duplicados
+        # (mismos hora_inicio y hora_fin); gana el primer horario cargado.
+        self.rangos_por_dia = {}
+        for h in horarios:
+            if h.hora_inicio is None or h.hora_fin is None:
+                continue
+            rangos = self.rangos_por_dia.setdefault(h.dia_semana, [])
+            if any((r[0], r[1]) == (h.hora_inicio, h.hora_fin) for r in rangos):
+                continue
+            rangos.append((h.hora_inicio, h.hora_fin, h.duracion_consulta or 30))
+
+        self.vacaciones = IntervalosFecha((v.fecha_inicio, v.fecha_fin) for v in vacaciones)
+
+        self.permisos_por_fecha = {}
+        for p in permisos:
+            self.permisos_por_fecha.setdefault(p.fecha, IntervalosHora()).agregar(p.hora_inicio, p.hora_fin)
+
+        self.citas = set((c.fecha, c.hora) for c in citas)
+
+    def trabaja(self, fecha):
+        return fecha.weekday() in self.rangos_por_dia
+
+    def en_vacaciones(self, fecha):
+        return self.vacaciones.contiene(fecha)
+
+    def tiene_permiso(self, fecha, hora):
+        intervalos = self.permisos_por_fecha.get(fecha)
+        return intervalos is not None and intervalos.contiene(hora)
+
+    def ocupado(self, fecha, hora):
+        return (fecha, hora) in self.citas
+
+    def slots_dia(self, fecha):
+        """Genera los slots de un día como lista de (hora, estado).
+
+        El estado es 'permiso', 'ocupado' o 'disponible'; no depende del
+        reloj, por lo que el marcado de slots pasados se hace aparte con
+        `marcar_pasados()`.
+        """
+        slots = []
+        vistas = set()
+        for hora_inicio, hora_fin, duracion in self.rangos_por_dia.get(fecha.weekday(), []):
+            actual = datetime.combine(fecha, hora_inicio)
+            fin = datetime.combine(fecha, hora_fin)
+            paso = timedelta(minutes=duracion)
+            while actual < fin:
+                hora = actual.time()
+                if hora not in vistas:
+                    vistas.add(hora)
+                    if self.tiene_permiso(fecha, hora):
+                        estado = 'permiso'
+                    elif self.ocupado(fecha, hora):
+                        estado = 'ocupado'
+                    else:
+                        estado = 'disponible'
+                    slots.append((hora, estado))
+                actual += paso
+        return slots
+
+
+def cargar_agendas(usuarios_por_medico, fecha_desde, fecha_hasta):
+    """
+    Carga las agendas de varios médicos entre dos fechas (inclusive) en 4
+    consultas, sin importar cuántos médicos sean.
+
+    Args:
+        usuarios_por_medico: dict {medico_id: usuario_id}; vacaciones y permisos
+            están ligados al usuario, con usuario_id None no se cargan
+        fecha_desde: date inicial
+        fecha_hasta: date final
+
+    Returns:
+        dict {medico_id: AgendaMedico}
+    """
+    medico_ids = list(usuarios_por_medico)
+    medico_por_usuario = {u: m for m, u in usuarios_por_medico.items() if u is not None}
+
+    horarios = {m: [] for m in medico_ids}
+    for h in HorarioAtencion.query.filter(
+        HorarioAtencion.medico_id.in_(medico_ids),
+        HorarioAtencion.activo == True
+    ).order_by(HorarioAtencion.id):
+        horarios[h.medico_id].append(h)
+
+    vacaciones = {m: [] for m in medico_ids}
+    permisos = {m: [] for m in medico_ids}
+    if medico_por_usuario:
+        for v in db.session.query(Vacacion.usuario_id, Vacacion.fecha_inicio, Vacacion.fecha_fin).filter(
+            Vacacion.usuario_id.in_(list(medico_por_usuario)),
+            Vacacion.estado == 'aprobada',
+            Vacacion.fecha_inicio <= fecha_hasta,
+            Vacacion.fecha_fin >= fecha_desde
+        ):
+            vacaciones[medico_por_usuario[v.usuario_id]].append(v)
+
+        for p in db.session.query(Permiso.usuario_id, Permiso.fecha, Permiso.hora_inicio, Permiso.hora_fin).filter(
+            Permiso.usuario_id.in_(list(medico_por_usuario)),
+            Permiso.estado == 'aprobado',
+            Permiso.fecha >= fecha_desde,
+            Permiso.fecha <= fecha_hasta
+        ):
+            permisos[medico_por_usuario[p.usuario_id]].append(p)
+
+    citas = {m: [] for m in medico_ids}
+    for c in db.session.query(Cita.medico_id, Cita.fecha, Cita.hora).filter(
+        Cita.medico_id.in_(medico_ids),
+        Cita.fecha >= fecha_desde,
+        Cita.fecha <= fecha_hasta,
+        Cita.estado.in_(ESTADOS_CITA_ACTIVA)
+    ):
+        citas[c.medico_id].append(c)
+
+    return {
+        m: AgendaMedico(m, fecha_desde, fecha_hasta, horarios[m], vacaciones[m], permisos[m], citas[m])
+        for m in medico_ids
+    }
+
+
+def cargar_agenda(medico_id, fecha_desde, fecha_hasta, usuario_id=None):
+    """
+    Carga la agenda de un médico entre dos fechas (inclusive).
+
+    Args:
+        medico_id: ID del médico
+        fecha_desde: date inicial
+        fecha_hasta: date final
+        usuario_id: ID del usuario del médico; vacaciones y permisos están
+            ligados al usuario, si se omite no se cargan
+
+    Returns:
+        AgendaMedico
+    """
+    return cargar_agendas({medico_id: usuario_id}, fecha_desde, fecha_hasta)[medico_id]
+
+
+def _turnos_libres(agenda, fecha_desde, fecha_hasta, ahora):
+    """Genera (datetime, medico_id) de los slots disponibles de una agenda, en orden."""
+    fecha = fecha_desde
+    while fecha <= fecha_hasta:
+        if agenda.trabaja(fecha) and not agenda.en_vacaciones(fecha):
+            for hora, estado in sorted(agenda.slots_dia(fecha)):
+                inicio = datetime.combine(fecha, hora)
+                if estado == 'disponible' and inicio >= ahora:
+                    yield inicio, agenda.medico_id
+        fecha += timedelta(days=1)
+
+
+def primeros_turnos_libres(especialidad_id, cantidad, fecha_desde, fecha_hasta, ahora=None):
+    """
+    Busca los primeros `cantidad` turnos libres entre todos los médicos activos
+    de una especialidad.
+
+    Las agendas se cargan juntas (4 consultas) y los slots de cada médico se
+    recorren de forma perezosa y ordenada; heapq.merge los intercala, así que
+    el recorrido se detiene apenas se consiguen los turnos pedidos.
+
+    Args:
+        especialidad_id: ID de la especialidad
+        cantidad: número máximo de turnos a devolver
+        fecha_desde: date inicial
+        fecha_hasta: date final (inclusive)
+        ahora: datetime de referencia; no se ofrecen slots anteriores (default: now)
+
+    Returns:
+        list de tuplas (datetime inicio, Medico), ordenada por inicio
+    """
+    ahora = ahora or datetime.now()
+    medicos = {
+        m.id: m for m in Medico.query.join(
+            MedicoEspecialidad, MedicoEspecialidad.medico_id == Medico.id
+        ).filter(
+            MedicoEspecialidad.especialidad_id == especialidad_id,
+            Medico.activo == True
+        )
+    }
+    if not medicos:
+        return []
+
+    agendas = cargar_agendas({m.id: m.usuario_id for m in medicos.values()}, fecha_desde, fecha_hasta)
+    turnos = heapq.merge(*(_turnos_libres(a, fecha_desde, fecha_hasta, ahora) for a in agendas.values()))
+    return [(inicio, medicos[medico_id]) for inicio, medico_id in islice(turnos, cantidad)]
+
+
+def grilla_dia(agenda, fecha):
+    """Resumen serializable (JSON) de un día de la agenda; es la unidad que se guarda en caché.
+
+    Returns:
+        dict con 'trabaja', 'en_vacaciones', 'slots' ([['HH:MM', estado], ...])
+        y 'ocupadas' (horas con cita activa, aunque el slot figure con permiso)
+    """
+    slots = agenda.slots_dia(fecha)
+    return {
+        'trabaja': agenda.trabaja(fecha),
+        'en_vacaciones': agenda.en_vacaciones(fecha),
+        'slots': [[hora.strftime('%H:%M'), estado] for hora, estado in slots],
+        'ocupadas': [hora.strftime('%H:%M') for hora, _ in slots if agenda.ocupado(fecha, hora)],
+    }
+
+
+def clave_grilla(medico_id, fecha):
+    return f'disp:{medico_id}:{fecha.isoformat()}'
+
+
+def _cache():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('cache_disponibilidad')
+
+
+def grillas_medico(medico_id, fechas, usuario_id=None):
+    """
+    Devuelve {fecha: grilla} para las fechas pedidas, usando la caché de
+    disponibilidad y calculando solo los días que falten (en un único
+    `cargar_agenda()` que cubre el rango de los faltantes).
+
+    Args:
+        medico_id: ID del médico
+        fechas: lista de date
+        usuario_id: usuario del médico; si se omite se consulta solo cuando hay faltantes
+    """
+    cache = _cache()
+    if cache is not None:
+        grillas = dict(zip(fechas, cache.get_many([clave_grilla(medico_id, f) for f in fechas])))
+    else:
+        grillas = dict.fromkeys(fechas)
+
+    faltantes = [f for f, g in grillas.items() if g is None]
+    if faltantes:
+        if usuario_id is None:
+            usuario_id = db.session.query(Medico.usuario_id).filter_by(id=medico_id).scalar()
+        agenda = cargar_agenda(medico_id, min(faltantes), max(faltantes), usuario_id=usuario_id)
+        nuevas = {f: grilla_dia(agenda, f) for f in faltantes}
+        grillas.update(nuevas)
+        if cache is not None:
+            cache.set_many({clave_grilla(medico_id, f): g for f, g in nuevas.items()})
+    return grillas
+
+
+def horas_libres(grilla):
+    """Horas 'HH:MM' sin cita activa de un día, en orden cronológico.
+
+    A diferencia del calendario semanal, no descarta permisos ni vacaciones
+    (eso se valida al confirmar la cita).
+    """
+    ocupadas = set(grilla['ocupadas'])
+    return sorted(hora for hora, _ in grilla['slots'] if hora not in ocupadas)
+
+
+def marcar_pasados(slots, fecha, ahora):
+    """Convierte [hora, estado] en dicts JSON marcando como 'pasado' lo anterior a `ahora`."""
+    hoy = ahora.date()
+    hora_ahora = ahora.time()
+    resultado = []
+    for hora, estado in slots:
+        if fecha < hoy or (fecha == hoy and time.fromisoformat(hora) < hora_ahora):
+            estado = 'pasado'
+        resultado.append({'hora': hora, 'estado': estado})
+    return resultado
+
+
+def calendario_semanal(medico, fecha_base, ahora=None):
+    """
+    Construye el calendario semanal (lunes a domingo) de un médico.
+
+    Args:
+        medico: objeto Medico
+        fecha_base: cualquier date de la semana solicitada
+        ahora: datetime de referencia para marcar slots pasados (default: now)
+
+    Returns:
+        dict con la misma estructura que devuelve la API disponibilidad-semanal
+    """
+    ahora = ahora or datetime.now()
+    hoy = ahora.date()
+
+    lunes = fecha_base - timedelta(days=fecha_base.weekday())
+    dias_semana = [lunes + timedelta(days=i) for i in range(7)]
+
+    grillas = grillas_medico(medico.id, dias_semana, usuario_id=medico.usuario_id)
+
+    calendario = []
+    for fecha in dias_semana:
+        grilla = grillas[fecha]
+        dia = {
+            'fecha': fecha.isoformat(),
+            'dia_semana': f"{DIAS_ESPANOL[fecha.weekday()]} {fecha.day}",
+            'trabaja': grilla['trabaja'],
+        }
+        if not grilla['trabaja']:
+            dia.update({'es_pasado': fecha < hoy, 'slots': []})
+        elif grilla['en_vacaciones']:
+            dia.update({'en_vacaciones': True, 'es_pasado': fecha < hoy, 'slots': []})
+        else:
+            dia.update({
+                'en_vacaciones': False,
+                'es_pasado': fecha < hoy,
+                'slots': marcar_pasados(grilla['slots'], fecha, ahora)
+            })
+        calendario.append(dia)
+
+    mes_inicio = MESES_ESPANOL[lunes.month - 1]
+    mes_fin = MESES_ESPANOL[dias_semana[-1].month - 1]
+    if lunes.month == dias_semana[-1].month:
+        periodo = f"{mes_inicio} {lunes.year}"
+    else:
+        periodo = f"{mes_inicio} - {mes_fin} {lunes.year}"
+
+    return {
+        'medico': {
+            'id': medico.id,
+            'nombre': f"Dr(a). {medico.usuario.username}" if medico.usuario else "Doctor"
+        },
+        'semana_inicio': lunes.isoformat(),
+        'semana_fin': dias_semana[-1].isoformat(),
+        'periodo': periodo,
+        'calendario': calendario
+    }
+
+
+# ---------------------------------------------------------------------------
+# Invalidación de la caché
+#
+# Durante el flush se anotan en session.info las claves afectadas por cambios
+# en Cita, Permiso, Vacacion u HorarioAtencion; se borran de la caché recién
+# al confirmar la transacción (y se descartan si hay rollback). El TTL de las
+# entradas (DISPONIBILIDAD_CACHE_TTL) acota cualquier desfase por escrituras
+# hechas fuera del ORM.
+# ---------------------------------------------------------------------------
+
+_PENDIENTES = 'disponibilidad_invalidar'
+
+# Campos que modifican la agenda; cambios en otros campos (p.ej. observaciones) no invalidan
+_CAMPOS_AGENDA = {
+    Cita: ('medico_id', 'fecha', 'hora', 'estado'),
+    Permiso: ('usuario_id', 'fecha', 'hora_inicio', 'hora_fin', 'estado'),
+    Vacacion: ('usuario_id', 'fecha_inicio', 'fecha_fin', 'estado'),
+    HorarioAtencion: ('medico_id', 'dia_semana', 'hora_inicio', 'hora_fin', 'duracion_consulta', 'activo'),
+}
+
+# Por encima de este rango (vacaciones largas) se invalida el médico completo
+_MAX_DIAS_INVALIDACION = 366
+
+
+def _valores(obj, campo):
+    """Valores actual y anterior (si cambió) de un atributo dentro del flush."""
+    historial = inspect(obj).attrs[campo].history
+    return {v for v in (*historial.added, *historial.unchanged, *historial.deleted) if v is not None}
+
+
+def _conservar_anterior(target, valor, anterior, iniciador):
+    """Escucha 'set' sin efecto.
+
+    Registrada con active_history, hace que el valor anterior se cargue aunque
+    el objeto esté expirado (p.ej. tras un commit), así la fecha o el médico
+    previos también se invalidan.
+    """
+    return valor
+
+
+def _modificado(obj, campos):
+    estado = inspect(obj)
+    return any(estado.attrs[c].history.has_changes() for c in campos)
+
+
+def _medicos_de_usuarios(session, usuario_ids):
+    if not usuario_ids:
+        return {}
+    filas = session.connection().execute(
+        select(Medico.usuario_id, Medico.id).where(Medico.usuario_id.in_(usuario_ids))
+    ).all()
+    medicos = {}
+    for usuario_id, medico_id in filas:
+        medicos.setdefault(usuario_id, []).append(medico_id)
+    return medicos
+
+
+def _registrar_invalidaciones(session, flush_context):
+    if _cache() is None:
+        return
+
+    claves = set()
+    prefijos = set()
+    ausencias = []  # (usuario_ids, fecha_desde, fecha_hasta)
+
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        campos = _CAMPOS_AGENDA.get(type(obj))
+        if campos is None:
+            continue
+        if obj in session.dirty and not _modificado(obj, campos):
+            continue
+
+        if isinstance(obj, Cita):
+            for medico_id in _valores(obj, 'medico_id'):
+                for fecha in _valores(obj, 'fecha'):
+                    claves.add(clave_grilla(medico_id, fecha))
+        elif isinstance(obj, HorarioAtencion):
+            for medico_id in _valores(obj, 'medico_id'):
+                prefijos.add(f'disp:{medico_id}:')
+        elif isinstance(obj, Permiso):
+            usuarios = _valores(obj, 'usuario_id')
+            ausencias.extend((usuarios, fecha, fecha) for fecha in _valores(obj, 'fecha'))
+        elif isinstance(obj, Vacacion):
+            fechas = _valores(obj, 'fecha_inicio') | _valores(obj, 'fecha_fin')
+            if fechas:
+                ausencias.append((_valores(obj, 'usuario_id'), min(fechas), max(fechas)))
+
+    if ausencias:
+        medicos = _medicos_de_usuarios(session, {u for usuarios, _, _ in ausencias for u in usuarios})
+        for usuarios, desde, hasta in ausencias:
+            for usuario_id in usuarios:
+                for medico_id in medicos.get(usuario_id, []):
+                    dias = (hasta - desde).days + 1
+                    if dias > _MAX_DIAS_INVALIDACION:
+                        prefijos.add(f'disp:{medico_id}:')
+                        continue
+                    claves.update(clave_grilla(medico_id, desde + timedelta(days=i)) for i in range(dias))
+
+    if claves or prefijos:
+        pendientes = session.info.setdefault(_PENDIENTES, (set(), set()))
+        pendientes[0].update(claves)
+        pendientes[1].update(prefijos)
+
+
+def _aplicar_invalidaciones(session):
+    pendientes = session.info.pop(_PENDIENTES, None)
+    cache = _cache()
+    if not pendientes or cache is None:
+        return
+    claves, prefijos = pendientes
+    cache.delete_many(list(claves))
+    for prefijo in prefijos:
+        cache.delete_prefix(prefijo)
+
+
+def _descartar_invalidaciones(session):
+    session.info.pop(_PENDIENTES, None)
+
+
+def init_cache_disponibilidad(app):
+    """Crea la caché de grillas de disponibilidad y engancha su invalidación a la sesión."""
+    app.extensions['cache_disponibilidad'] = crear_cache(
+        app, 'disponibilidad',
+        max_entradas=app.config.get('DISPONIBILIDAD_CACHE_MAX', 4096),
+        ttl=app.config.get('DISPONIBILIDAD_CACHE_TTL', 600)
+    )
+    for modelo, campos in _CAMPOS_AGENDA.items():
+        for campo in campos:
+            atributo = getattr(modelo, campo)
+            if not event.contains(atributo, 'set', _conservar_anterior):
+                event.listen(atributo, 'set', _conservar_anterior, active_history=True, retval=True)
+    invalidar_al_confirmar(db.session, _registrar_invalidaciones, _aplicar_invalidaciones, _descartar_invalidaciones)
@@ -0,0 +1,308 @@
+"""
+Estadísticas de citas para los dashboards.
+
+Todos los conteos por estado y por médico de una o varias fechas salen de
+una única consulta agrupada (`GROUP BY fecha, medico_id, estado`), que los
+dashboards de cada rol reparten según lo que muestran.
+
+Los datos de cada dashboard ("tablero": conteos, próximas citas, totales de
+caja) se guardan unos segundos en la caché 'dashboard' con clave
+(rol, medico_id, fecha) y se invalidan al confirmar cambios en citas o
+ventas (ver `init_cache_dashboard`).
+"""
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import case, cast, func, literal, null, select, union_all
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import Cita, Consulta, Medico, Venta
+from app.utils.cache import crear_cache, invalidar_al_confirmar
+
+
+class ResumenCitas:
+    """Conteos de citas por (fecha, medico_id, estado) y de consultas por médico."""
+
+    def __init__(self, conteos, consultas=None):
+        self.conteos = conteos
+        self.consultas = consultas or {}
+
+    def total(self, fecha=None, medico_id=None, estado=None):
+        """Suma de citas que cumplen los filtros dados (None = cualquiera)."""
+        return sum(
+            n for (f, m, e), n in self.conteos.items()
+            if (fecha is None or f == fecha)
+            and (medico_id is None or m == medico_id)
+            and (estado is None or e == estado)
+        )
+
+    def por_medico(self, fecha):
+        """{medico_id: Counter(estado -> cantidad)} de los médicos con citas en la fecha."""
+        resultado = defaultdict(Counter)
+        for (f, m, e), n in self.conteos.items():
+            if f == fecha:
+                resultado[m][e] += n
+        return dict(resultado)
+
+    def total_consultas(self, medico_id=None):
+        """Consultas registradas (solo con `historico=True`)."""
+        return sum(
+            n for m, n in self.consultas.items()
+            if medico_id is None or m == medico_id
+        )
+
+
+def resumen_citas(fechas, medico_id=None, historico=False):
+    """
+    Cuenta las citas de las fechas dadas agrupadas por médico y estado.
+
+    Con `historico=True` la misma consulta cuenta también las citas de
+    cualquier otra fecha (agrupadas con fecha None) y las consultas de cada
+    médico, de modo que `total()` sin fecha da el total histórico.
+
+    Args:
+        fechas: lista de date
+        medico_id: limitar a un médico (opcional)
+        historico: incluir totales de todas las fechas y de consultas
+
+    Returns:
+        ResumenCitas
+    """
+    if historico:
+        fecha = case((Cita.fecha.in_(fechas), Cita.fecha), else_=null())
+    else:
+        fecha = Cita.fecha
+    fecha = fecha.label('fecha_grupo')
+
+    citas = select(
+        literal('cita').label('tipo'), fecha, Cita.medico_id,
+        Cita.estado, func.count(Cita.id)
+    )
+    if not historico:
+        citas = citas.where(Cita.fecha.in_(fechas))
+    if medico_id is not None:
+        citas = citas.where(Cita.medico_id == medico_id)
+    consulta = citas.group_by(fecha, Cita.medico_id, Cita.estado)
+
+    if historico:
+        consultas = select(
+            literal('consulta'), cast(null(), db.Date), Consulta.medico_id,
+            cast(null(), db.String), func.count(Consulta.id)
+        )
+        if medico_id is not None:
+            consultas = consultas.where(Consulta.medico_id == medico_id)
+        consulta = union_all(consulta, consultas.group_by(Consulta.medico_id))
+
+    conteos, total_consultas = {}, {}
+    for tipo, fecha, medico, estado, n in db.session.execute(consulta):
+        if tipo == 'consulta':
+            total_consultas[medico] = n
+        else:
+            conteos[(fecha, medico, estado)] = n
+    return ResumenCitas(conteos, total_consultas)
+
+
+# ---------------------------------------------------------------------------
+# Tableros por rol (valores serializables a JSON para poder cachearlos)
+# ---------------------------------------------------------------------------
+
+def _cita_tablero(cita):
+    """Datos de una cita que muestran las tablas de los dashboards."""
+    return {
+        'id': cita.id,
+        'fecha': cita.fecha.isoformat(),
+        'hora': cita.hora.strftime('%H:%M'),
+        'estado': cita.estado,
+        'motivo': cita.motivo,
+        'paciente': {
+            'nombre_completo': cita.paciente.nombre_completo,
+            'cedula': cita.paciente.cedula,
+            'telefono': cita.paciente.telefono
+        },
+        'medico': {'nombre_completo': cita.medico.nombre_completo},
+        'especialidad': {'nombre': cita.especialidad.nombre if cita.especialidad else None},
+        'consulta': {'id': cita.consulta.id} if cita.consulta else None
+    }
+
+
+def _citas_proximas(fecha, limite=10):
+    citas = Cita.query.options(
+        joinedload(Cita.paciente), joinedload(Cita.medico),
+        joinedload(Cita.especialidad), joinedload(Cita.consulta)
+    ).filter_by(fecha=fecha).order_by(Cita.hora).limit(limite).all()
+    return [_cita_tablero(c) for c in citas]
+
+
+def _tablero_general(fecha, medico_id=None):
+    """Conteos del día y de mañana para administración y recepción."""
+    manana = fecha + timedelta(days=1)
+    resumen = resumen_citas([fecha, manana])
+
+    # Resumen por médico (solo los que tienen citas en la fecha)
+    citas_por_medico = []
+    conteos_por_medico = resumen.por_medico(fecha)
+    if conteos_por_medico:
+        medicos = Medico.query.filter(Medico.id.in_(conteos_por_medico)).order_by(Medico.id).all()
+        for medico in medicos:
+            conteos = conteos_por_medico[medico.id]
+            citas_por_medico.append({
+                'nombre': medico.nombre_completo,
+                'total': sum(conteos.values()),
+                'pendientes': conteos['pendiente'],
+                'confirmadas': conteos['confirmada'],
+                'atendidas': conteos['atendida']
+            })
+
+    return {
+        'citas_hoy': resumen.total(fecha=fecha),
+        'citas_pendientes': resumen.total(fecha=fecha, estado='pendiente'),
+        'citas_confirmadas': resumen.total(fecha=fecha, estado='confirmada'),
+        'citas_por_confirmar': resumen.total(fecha=manana, estado='pendiente'),
+        'citas_proximas': _citas_proximas(fecha),
+        'citas_por_medico': citas_por_medico
+    }
+
+
+def _tablero_medico(fecha, medico_id):
+    """Conteos del día y totales históricos del médico (una consulta)."""
+    resumen = resumen_citas([fecha], medico_id=medico_id, historico=True)
+
+    proxima_cita = Cita.query.options(
+        joinedload(Cita.paciente), joinedload(Cita.medico),
+        joinedload(Cita.especialidad), joinedload(Cita.consulta)
+    ).filter(
+        Cita.medico_id == medico_id,
+        Cita.fecha >= fecha,
+        Cita.estado.in_(['pendiente', 'confirmada'])
+    ).order_by(Cita.fecha, Cita.hora).first()
+
+    citas_hoy = Cita.query.options(
+        joinedload(Cita.paciente), joinedload(Cita.medico),
+        joinedload(Cita.especialidad), joinedload(Cita.consulta)
+    ).filter_by(
+        medico_id=medico_id, fecha=fecha
+    ).filter(Cita.estado.in_(['pendiente', 'confirmada'])).order_by(Cita.hora).all()
+
+    return {
+        'citas_pendientes': resumen.total(fecha=fecha, estado='pendiente'),
+        'citas_confirmadas': resumen.total(fecha=fecha, estado='confirmada'),
+        'pacientes_atendidos': resumen.total(fecha=fecha, estado='atendida'),
+        'proxima_cita': _cita_tablero(proxima_cita) if proxima_cita else None,
+        'citas_hoy': [_cita_tablero(c) for c in citas_hoy],
+        'consultas_completadas': resumen.total_consultas(),
+        'citas_totales': resumen.total()
+    }
+
+
+def _tablero_cajero(fecha, medico_id=None):
+    """Totales de ventas del día por estado (una consulta agrupada)."""
+    filas = db.session.query(
+        Venta.estado, func.count(Venta.id), func.coalesce(func.sum(Venta.total), 0)
+    ).filter(
+        Venta.fecha >= fecha,
+        Venta.fecha < fecha + timedelta(days=1)
+    ).group_by(Venta.estado)
+    por_estado = {estado: (cantidad, total) for estado, cantidad, total in filas}
+    return {
+        'ventas_hoy': sum(cantidad for cantidad, _ in por_estado.values()),
+        'total_vendido_hoy': float(por_estado.get('pagada', (0, 0))[1]),
+        'ventas_pendientes': por_estado.get('pendiente', (0, 0))[0],
+        'ventas_pagadas': por_estado.get('pagada', (0, 0))[0]
+    }
+
+
+_TABLEROS = {
+    'admin': _tablero_general,
+    'recepcionista': _tablero_general,
+    'medico': _tablero_medico,
+    'cajero': _tablero_cajero,
+}
+
+
+def clave_tablero(rol, medico_id, fecha):
+    return f'dash:{rol}:{medico_id or "-"}:{fecha.isoformat()}'
+
+
+def _cache():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('cache_dashboard')
+
+
+def tablero(rol, fecha=None, medico_id=None):
+    """
+    Datos del dashboard de un rol para una fecha, desde la caché si están.
+
+    Args:
+        rol: 'admin', 'recepcionista', 'medico' o 'cajero'
+        fecha: date (default hoy)
+        medico_id: requerido para el rol 'medico'
+
+    Returns:
+        dict serializable a JSON
+    """
+    fecha = fecha or date.today()
+    clave = clave_tablero(rol, medico_id, fecha)
+    cache = _cache()
+    if cache is not None:
+        datos = cache.get(clave)
+        if datos is not None:
+            return datos
+    datos = _TABLEROS[rol](fecha, medico_id)
+    if cache is not None:
+        cache.set(clave, datos)
+    return datos
+
+
+# ---------------------------------------------------------------------------
+# Invalidación: cambios en citas invalidan los tableros de administración,
+# recepción y de los médicos involucrados; cambios en ventas, los de caja.
+# ---------------------------------------------------------------------------
+
+_PENDIENTES = 'dashboard_invalidar'
+
+
+def _registrar_invalidaciones(session, flush_context):
+    if _cache() is None:
+        return
+    prefijos = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, (Cita, Venta)):
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, Venta):
+            prefijos.add('dash:cajero:')
+            continue
+        prefijos.update(('dash:admin:', 'dash:recepcionista:'))
+        historial = db.inspect(obj).attrs.medico_id.history
+        for medico_id in (*historial.added, *historial.unchanged, *historial.deleted):
+            if medico_id is not None:
+                prefijos.add(f'dash:medico:{medico_id}:')
+    if prefijos:
+        session.info.setdefault(_PENDIENTES, set()).update(prefijos)
+
+
+def _aplicar_invalidaciones(session):
+    prefijos = session.info.pop(_PENDIENTES, None)
+    cache = _cache()
+    if not prefijos or cache is None:
+        return
+    for prefijo in prefijos:
+        cache.delete_prefix(prefijo)
+
+
+def _descartar_invalidaciones(session):
+    session.info.pop(_PENDIENTES, None)
+
+
+def init_cache_dashboard(app):
+    """Crea la caché de tableros y engancha su invalidación a la sesión."""
+    app.extensions['cache_dashboard'] = crear_cache(
+        app, 'dashboard',
+        max_entradas=app.config.get('DASHBOARD_CACHE_MAX', 512),
+        ttl=app.config.get('DASHBOARD_CACHE_TTL', 10)
+    )
+    invalidar_al_confirmar(db.session, _registrar_invalidaciones, _aplicar_invalidaciones, _descartar_invalidaciones)
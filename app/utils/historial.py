@@ -0,0 +1,95 @@
+"""
+Historial clínico de un paciente.
+
+La vista de historial se arma con dos lecturas:
+
+- `linea_tiempo`: una proyección compacta de todas las consultas del
+  paciente (fecha, médico, especialidad, motivo, diagnóstico y cantidades de
+  recetas, procedimientos e insumos) en una sola consulta, sin cargar modelos.
+- `pagina_historial`: el detalle de una página de consultas, paginada por
+  cursor (fecha, id), con las relaciones que muestra la plantilla cargadas
+  de antemano (`joinedload` para médico y especialidad, `selectinload` para
+  las colecciones), así que cada página cuesta un número fijo de consultas
+  sin importar cuántas visitas tenga el paciente.
+"""
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from app import db
+from app.models import (Consulta, ConsultaInsumo, ConsultaProcedimiento, Especialidad,
+                        Medico, Receta)
+from app.utils.paginacion import paginar_keyset
+
+
+# Orden del historial: de la consulta más reciente a la más antigua
+ORDEN_HISTORIAL = [(Consulta.fecha, True), (Consulta.id, True)]
+
+
+def opciones_historial():
+    """Estrategias de carga de las relaciones que muestra el historial."""
+    # En una función: `Consulta.medico` es un backref y no existe hasta configurar los mappers
+    return (
+        joinedload(Consulta.medico),
+        joinedload(Consulta.especialidad),
+        selectinload(Consulta.recetas),
+        selectinload(Consulta.procedimientos_realizados).joinedload(ConsultaProcedimiento.procedimiento_rel),
+        selectinload(Consulta.insumos_usados).joinedload(ConsultaInsumo.insumo_rel),
+    )
+
+
+def pagina_historial(paciente_id, por_pagina=10, despues=None, antes=None):
+    """
+    Una página del historial del paciente con el detalle de cada consulta.
+
+    Args:
+        paciente_id: ID del paciente
+        por_pagina: consultas por página
+        despues / antes: cursores de `app.utils.paginacion`
+
+    Returns:
+        PaginaKeyset de Consulta con médico, especialidad, recetas,
+        procedimientos e insumos ya cargados
+    """
+    query = Consulta.query.options(*opciones_historial()).filter(Consulta.paciente_id == paciente_id)
+    return paginar_keyset(query, ORDEN_HISTORIAL, por_pagina=por_pagina, despues=despues, antes=antes)
+
+
+def _conteo(modelo):
+    return select(func.count(modelo.id)).where(modelo.consulta_id == Consulta.id).correlate(Consulta).scalar_subquery()
+
+
+def linea_tiempo(paciente_id):
+    """
+    Resumen de todas las consultas del paciente para la línea de tiempo.
+
+    Returns:
+        list de dicts {id, fecha, medico, especialidad, motivo, diagnostico,
+        recetas, procedimientos, insumos}, de la más reciente a la más antigua
+    """
+    filas = db.session.query(
+        Consulta.id, Consulta.fecha, Consulta.motivo, Consulta.diagnostico,
+        Medico.nombre, Medico.apellido, Especialidad.nombre,
+        _conteo(Receta), _conteo(ConsultaProcedimiento), _conteo(ConsultaInsumo)
+    ).outerjoin(
+        Medico, Medico.id == Consulta.medico_id
+    ).outerjoin(
+        Especialidad, Especialidad.id == Consulta.especialidad_id
+    ).filter(
+        Consulta.paciente_id == paciente_id
+    ).order_by(Consulta.fecha.desc(), Consulta.id.desc())
+
+    return [
+        {
+            'id': consulta_id,
+            'fecha': fecha,
+            'medico': f'Dr. {medico_nombre} {medico_apellido}' if medico_nombre else None,
+            'especialidad': especialidad,
+            'motivo': motivo,
+            'diagnostico': diagnostico,
+            'recetas': recetas,
+            'procedimientos': procedimientos,
+            'insumos': insumos
+        }
+        for (consulta_id, fecha, motivo, diagnostico, medico_nombre, medico_apellido,
+             especialidad, recetas, procedimientos, insumos) in filas
+    ]
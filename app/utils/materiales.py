@@ -0,0 +1,90 @@
+"""
+Materiales de los procedimientos.
+
+Cada procedimiento puede tener una lista fija de insumos que consume
+(`ProcedimientoInsumo`, ej. "Endodoncia": limas, conos de gutapercha,
+hipoclorito). Al registrar una consulta los materiales de todos sus
+procedimientos se expanden con una sola consulta, se suman por insumo y se
+descuentan en un solo movimiento de stock (ver
+`app.utils.stock.descontar_stock`). A diferencia de los insumos cargados a
+mano, un material sin stock no impide guardar la consulta: el stock queda en
+negativo y se avisa de qué procedimiento salió (`materiales_sin_stock`).
+"""
+from collections import Counter
+
+from app import db
+from app.models import Insumo, Procedimiento, ProcedimientoInsumo
+
+
+def materiales_procedimientos(procedimiento_ids):
+    """
+    Insumos que consumen los procedimientos dados, sumados por insumo.
+
+    Args:
+        procedimiento_ids: iterable de IDs de procedimiento; un procedimiento
+            repetido (ej. dos restauraciones) consume sus materiales dos veces
+
+    Returns:
+        list de (insumo_id, cantidad)
+    """
+    veces = Counter(procedimiento_ids)
+    if not veces:
+        return []
+    totales = Counter()
+    for procedimiento_id, insumo_id, cantidad in db.session.query(
+        ProcedimientoInsumo.procedimiento_id, ProcedimientoInsumo.insumo_id, ProcedimientoInsumo.cantidad
+    ).filter(ProcedimientoInsumo.procedimiento_id.in_(list(veces))):
+        totales[insumo_id] += cantidad * veces[procedimiento_id]
+    return [(insumo_id, cantidad) for insumo_id, cantidad in totales.items() if cantidad > 0]
+
+
+def materiales_sin_stock(procedimiento_ids, insumo_ids):
+    """
+    Describe los materiales sin stock y los procedimientos que los usan.
+
+    Args:
+        procedimiento_ids: procedimientos de la consulta
+        insumo_ids: insumos que quedaron sin stock
+
+    Returns:
+        list de str, ej. "Lima K (Endodoncia, Conducto)"
+    """
+    insumo_ids = list(insumo_ids)
+    if not insumo_ids:
+        return []
+    origen = {}
+    for insumo, procedimiento in db.session.query(Insumo.nombre, Procedimiento.nombre).join(
+        ProcedimientoInsumo, ProcedimientoInsumo.insumo_id == Insumo.id
+    ).join(
+        Procedimiento, Procedimiento.id == ProcedimientoInsumo.procedimiento_id
+    ).filter(
+        ProcedimientoInsumo.insumo_id.in_(insumo_ids),
+        ProcedimientoInsumo.procedimiento_id.in_(set(procedimiento_ids))
+    ).order_by(Insumo.nombre, Procedimiento.nombre):
+        origen.setdefault(insumo, []).append(procedimiento)
+    return [f"{insumo} ({', '.join(procedimientos)})" for insumo, procedimientos in origen.items()]
+
+
+def guardar_materiales(procedimiento, cantidades):
+    """
+    Reemplaza los materiales de un procedimiento.
+
+    Args:
+        procedimiento: Procedimiento
+        cantidades: iterable de (insumo_id, cantidad); se suman los insumos
+            repetidos y se descartan las cantidades no positivas
+    """
+    totales = Counter()
+    for insumo_id, cantidad in cantidades:
+        totales[int(insumo_id)] += int(cantidad)
+    actuales = {m.insumo_id: m for m in procedimiento.materiales}
+    for insumo_id, material in actuales.items():
+        if totales.get(insumo_id, 0) <= 0:
+            procedimiento.materiales.remove(material)
+    for insumo_id, cantidad in totales.items():
+        if cantidad <= 0:
+            continue
+        if insumo_id in actuales:
+            actuales[insumo_id].cantidad = cantidad
+        else:
+            procedimiento.materiales.append(ProcedimientoInsumo(insumo_id=insumo_id, cantidad=cantidad))
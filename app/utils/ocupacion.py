@@ -0,0 +1,240 @@
+"""
+Ocupación real de la agenda: capacidad vs. citas reservadas.
+
+La capacidad de un médico en un día son los slots que generan sus horarios
+de atención activos, menos vacaciones aprobadas y slots cubiertos por
+permisos aprobados. La ocupación es la cantidad de esos slots con una cita
+no cancelada.
+
+Todo se calcula por lotes para un rango de fechas con un número fijo de
+consultas. Los slots de cada médico se precalculan una vez por día de la
+semana como arrays ordenados de minutos (`array('H')`); por cada fecha solo
+se restan rangos de permisos con bisect, sin generar objetos por slot.
+"""
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+
+from app import db
+from app.models import Cita, HorarioAtencion, Medico, MedicoEspecialidad, Vacacion, Permiso, Especialidad
+from app.utils.disponibilidad import IntervalosFecha
+
+
+# Citas que ocupan su slot (las canceladas lo liberan)
+ESTADOS_CITA_CANCELADA = ('cancelada', 'cancelada_paciente')
+
+AGRUPACIONES = ('dia', 'semana', 'mes')
+
+
+def _minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def _plantillas_slots(horarios):
+    """
+    Slots por día de la semana como arrays ordenados de minutos desde 00:00.
+
+    Los horarios duplicados (mismo inicio y fin) se cuentan una sola vez y
+    los slots repetidos entre rangos superpuestos también, igual que en la
+    grilla de disponibilidad.
+    """
+    rangos_por_dia = defaultdict(list)
+    for h in horarios:
+        if h.hora_inicio is None or h.hora_fin is None:
+            continue
+        rangos = rangos_por_dia[h.dia_semana]
+        if any((r[0], r[1]) == (h.hora_inicio, h.hora_fin) for r in rangos):
+            continue
+        rangos.append((h.hora_inicio, h.hora_fin, h.duracion_consulta or 30))
+
+    plantillas = {}
+    for dia, rangos in rangos_por_dia.items():
+        minutos = set()
+        for inicio, fin, duracion in rangos:
+            minutos.update(range(_minutos(inicio), _minutos(fin), duracion))
+        plantillas[dia] = array('H', sorted(minutos))
+    return plantillas
+
+
+def _slots_en(plantilla, desde, hasta):
+    """Cantidad de slots de la plantilla en [desde, hasta) minutos."""
+    return bisect_left(plantilla, hasta) - bisect_left(plantilla, desde)
+
+
+def _fusionar(rangos):
+    fusionados = []
+    for inicio, fin in sorted(rangos):
+        if fusionados and inicio <= fusionados[-1][1]:
+            fusionados[-1][1] = max(fusionados[-1][1], fin)
+        else:
+            fusionados.append([inicio, fin])
+    return fusionados
+
+
+def calcular_ocupacion(fecha_desde, fecha_hasta, medico_ids=None):
+    """
+    Capacidad y slots ocupados por médico y día en un rango (inclusive).
+
+    Args:
+        fecha_desde: date inicial
+        fecha_hasta: date final
+        medico_ids: limitar a estos médicos (default: todos los activos)
+
+    Returns:
+        dict {(medico_id, fecha): (capacidad, ocupados)} solo para los días
+        con capacidad
+    """
+    query = db.session.query(Medico.id, Medico.usuario_id).filter(Medico.activo == True)
+    if medico_ids is not None:
+        query = query.filter(Medico.id.in_(list(medico_ids)))
+    usuarios = dict(query.all())
+    if not usuarios:
+        return {}
+    medico_por_usuario = {u: m for m, u in usuarios.items() if u is not None}
+
+    horarios = defaultdict(list)
+    for h in HorarioAtencion.query.filter(
+        HorarioAtencion.medico_id.in_(list(usuarios)),
+        HorarioAtencion.activo == True
+    ).order_by(HorarioAtencion.id):
+        horarios[h.medico_id].append(h)
+    plantillas = {m: _plantillas_slots(hs) for m, hs in horarios.items()}
+    if not plantillas:
+        return {}
+
+    vacaciones = defaultdict(list)
+    permisos = defaultdict(list)   # (medico_id, fecha) -> [(inicio, fin) en minutos]
+    todo_el_dia = set()            # (medico_id, fecha)
+    if medico_por_usuario:
+        for usuario_id, inicio, fin in db.session.query(
+            Vacacion.usuario_id, Vacacion.fecha_inicio, Vacacion.fecha_fin
+        ).filter(
+            Vacacion.usuario_id.in_(list(medico_por_usuario)),
+            Vacacion.estado == 'aprobada',
+            Vacacion.fecha_inicio <= fecha_hasta,
+            Vacacion.fecha_fin >= fecha_desde
+        ):
+            vacaciones[medico_por_usuario[usuario_id]].append((inicio, fin))
+
+        for usuario_id, fecha, inicio, fin in db.session.query(
+            Permiso.usuario_id, Permiso.fecha, Permiso.hora_inicio, Permiso.hora_fin
+        ).filter(
+            Permiso.usuario_id.in_(list(medico_por_usuario)),
+            Permiso.estado == 'aprobado',
+            Permiso.fecha >= fecha_desde,
+            Permiso.fecha <= fecha_hasta
+        ):
+            clave = (medico_por_usuario[usuario_id], fecha)
+            if inicio is None or fin is None:
+                todo_el_dia.add(clave)
+            else:
+                permisos[clave].append((_minutos(inicio), _minutos(fin)))
+    vacaciones = {m: IntervalosFecha(rangos) for m, rangos in vacaciones.items()}
+
+    citas = defaultdict(set)  # (medico_id, fecha) -> minutos reservados
+    for medico_id, fecha, hora in db.session.query(Cita.medico_id, Cita.fecha, Cita.hora).filter(
+        Cita.medico_id.in_(list(plantillas)),
+        Cita.fecha >= fecha_desde,
+        Cita.fecha <= fecha_hasta,
+        Cita.estado.notin_(ESTADOS_CITA_CANCELADA)
+    ):
+        citas[(medico_id, fecha)].add(_minutos(hora))
+
+    resultado = {}
+    dias = (fecha_hasta - fecha_desde).days + 1
+    for medico_id, plantillas_medico in plantillas.items():
+        vacaciones_medico = vacaciones.get(medico_id)
+        for i in range(dias):
+            fecha = fecha_desde + timedelta(days=i)
+            plantilla = plantillas_medico.get(fecha.weekday())
+            clave = (medico_id, fecha)
+            if not plantilla or clave in todo_el_dia:
+                continue
+            if vacaciones_medico is not None and vacaciones_medico.contiene(fecha):
+                continue
+
+            rangos_permiso = _fusionar(permisos.get(clave, ()))
+            capacidad = len(plantilla) - sum(_slots_en(plantilla, a, b) for a, b in rangos_permiso)
+            if capacidad <= 0:
+                continue
+
+            ocupados = 0
+            for minuto in citas.get(clave, ()):
+                j = bisect_left(plantilla, minuto)
+                if j < len(plantilla) and plantilla[j] == minuto and \
+                        not any(a <= minuto < b for a, b in rangos_permiso):
+                    ocupados += 1
+            resultado[clave] = (capacidad, ocupados)
+    return resultado
+
+
+def _inicio_periodo(fecha, agrupar):
+    if agrupar == 'semana':
+        return fecha - timedelta(days=fecha.weekday())
+    if agrupar == 'mes':
+        return fecha.replace(day=1)
+    return fecha
+
+
+def porcentaje(ocupados, capacidad):
+    return int(ocupados / capacidad * 100) if capacidad > 0 else 0
+
+
+def resumen_ocupacion(fecha_desde, fecha_hasta, agrupar='dia', por=None):
+    """
+    Ocupación agregada por período y, opcionalmente, por médico o especialidad.
+
+    Args:
+        fecha_desde: date inicial
+        fecha_hasta: date final
+        agrupar: 'dia', 'semana' (desde el lunes) o 'mes'
+        por: None (todo el consultorio), 'medico' o 'especialidad'; un médico
+            con varias especialidades suma su capacidad en cada una
+
+    Returns:
+        list de dicts {periodo, id, nombre, capacidad, ocupados, porcentaje}
+        ordenada por período y nombre
+    """
+    if agrupar not in AGRUPACIONES:
+        raise ValueError(f'Agrupación inválida: {agrupar}')
+    if por not in (None, 'medico', 'especialidad'):
+        raise ValueError(f'Criterio inválido: {por}')
+
+    dias = calcular_ocupacion(fecha_desde, fecha_hasta)
+    medico_ids = {m for m, _ in dias}
+
+    nombres = {None: 'Consultorio'}
+    grupos_por_medico = {m: [None] for m in medico_ids}
+    if por == 'medico' and medico_ids:
+        medicos = Medico.query.filter(Medico.id.in_(medico_ids)).all()
+        nombres = {m.id: m.nombre_completo for m in medicos}
+        grupos_por_medico = {m: [m] for m in medico_ids}
+    elif por == 'especialidad' and medico_ids:
+        grupos_por_medico = defaultdict(list)
+        for medico_id, especialidad_id, nombre in db.session.query(
+            MedicoEspecialidad.medico_id, Especialidad.id, Especialidad.nombre
+        ).join(Especialidad, Especialidad.id == MedicoEspecialidad.especialidad_id).filter(
+            MedicoEspecialidad.medico_id.in_(medico_ids)
+        ):
+            grupos_por_medico[medico_id].append(especialidad_id)
+            nombres[especialidad_id] = nombre
+
+    totales = defaultdict(lambda: [0, 0])
+    for (medico_id, fecha), (capacidad, ocupados) in dias.items():
+        periodo = _inicio_periodo(fecha, agrupar)
+        for grupo in grupos_por_medico.get(medico_id, ()):
+            total = totales[(periodo, grupo)]
+            total[0] += capacidad
+            total[1] += ocupados
+
+    filas = [{
+        'periodo': periodo.isoformat(),
+        'id': grupo,
+        'nombre': nombres.get(grupo, ''),
+        'capacidad': capacidad,
+        'ocupados': ocupados,
+        'porcentaje': porcentaje(ocupados, capacidad)
+    } for (periodo, grupo), (capacidad, ocupados) in totales.items()]
+    filas.sort(key=lambda f: (f['periodo'], f['nombre']))
+    return filas
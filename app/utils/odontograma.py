@@ -0,0 +1,365 @@
+"""
+Almacenamiento compacto del odontograma.
+
+El formulario de consulta envía el estado de los 52 dientes con sus seis
+superficies, aunque casi todo esté en el valor por defecto. Antes de
+guardarlo se compacta: solo quedan los dientes con estado, descripción o
+superficies con datos, y en cada superficie solo las claves con valor. El
+formato sigue siendo el mismo JSON que entiende el editor del odontograma
+(los valores omitidos son los que el editor asume por defecto).
+
+Además de los snapshots por consulta (`Odontograma`), cada paciente tiene
+una fila `OdontogramaActual` con su último odontograma, de modo que cargar
+el estado de la boca es una lectura por clave primaria.
+
+La historia de cada diente se guarda como eventos (`EventoDiente`): los
+procedimientos trabajados en la consulta y los cambios de estado respecto
+del odontograma anterior. Se generan al guardar la consulta y se pueden
+reconstruir desde los snapshots con `reconstruir_eventos_diente`.
+"""
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Consulta, EventoDiente, Medico, Odontograma, OdontogramaActual, Procedimiento
+
+
+SUPERFICIES = ('completo', 'oclusal', 'vestibular', 'lingual', 'mesial', 'distal')
+
+
+def _compactar_superficie(sup):
+    if not isinstance(sup, dict):
+        return None
+    compacta = {}
+    if sup.get('procedimiento_id') not in (None, ''):
+        compacta['procedimiento_id'] = sup['procedimiento_id']
+    if sup.get('trabajado'):
+        compacta['trabajado'] = True
+    if sup.get('historico'):
+        compacta['historico'] = True
+    return compacta or None
+
+
+def compactar_odontograma(datos):
+    """
+    Quita del odontograma los dientes y superficies en su valor por defecto.
+
+    Args:
+        datos: dict con el formato del editor ({'dientes': {numero: {...}}, ...})
+
+    Returns:
+        dict con el mismo formato, solo con los datos significativos
+    """
+    dientes = {}
+    for numero, diente in ((datos or {}).get('dientes') or {}).items():
+        if not isinstance(diente, dict):
+            continue
+        try:
+            numero = str(int(numero))
+        except (TypeError, ValueError):
+            continue
+
+        compacto = {}
+        estado = diente.get('estado') or 'normal'
+        if estado != 'normal':
+            compacto['estado'] = estado
+        descripcion = (diente.get('descripcion') or '').strip()
+        if descripcion:
+            compacto['descripcion'] = descripcion
+
+        superficies = {}
+        for nombre, sup in (diente.get('superficies') or {}).items():
+            sup = _compactar_superficie(sup)
+            if sup:
+                superficies[nombre] = sup
+        if superficies:
+            compacto['superficies'] = superficies
+
+        # Formato antiguo: procedimientos a nivel de diente
+        if diente.get('trabajado'):
+            compacto['trabajado'] = True
+        if diente.get('procedimientos'):
+            compacto['procedimientos'] = diente['procedimientos']
+
+        if compacto:
+            dientes[numero] = compacto
+
+    resultado = {'dientes': dientes}
+    if (datos or {}).get('actualizado'):
+        resultado['actualizado'] = datos['actualizado']
+    return resultado
+
+
+def registrar_odontograma(consulta, datos, fecha=None):
+    """
+    Guarda el odontograma de una consulta y actualiza el estado actual del paciente.
+
+    Args:
+        consulta: Consulta ya agregada a la sesión (con id)
+        datos: dict del editor del odontograma
+        fecha: datetime del snapshot (default ahora)
+
+    Returns:
+        Odontograma agregado a la sesión, o None si no hay dientes con datos
+    """
+    datos = compactar_odontograma(datos)
+    if not datos['dientes']:
+        return None
+    fecha = fecha or datetime.utcnow()
+
+    odontograma = Odontograma(
+        consulta_id=consulta.id,
+        paciente_id=consulta.paciente_id,
+        fecha=fecha,
+        datos=datos
+    )
+    db.session.add(odontograma)
+    db.session.flush()
+
+    # La fila del estado actual se lee bloqueada: dos consultas simultáneas
+    # del mismo paciente se serializan y la comparación de fechas es segura
+    actual = _bloquear_actual(consulta.paciente_id)
+    if actual is None:
+        # Primer odontograma del paciente. Va en un savepoint porque otra
+        # transacción puede insertar la misma fila a la vez; si gana la otra,
+        # se actualiza la suya como en el caso normal
+        savepoint = db.session.begin_nested()
+        try:
+            db.session.add(OdontogramaActual(
+                paciente_id=consulta.paciente_id,
+                odontograma_id=odontograma.id,
+                fecha=fecha,
+                datos=datos
+            ))
+            db.session.flush()
+            savepoint.commit()
+        except IntegrityError:
+            savepoint.rollback()
+            actual = _bloquear_actual(consulta.paciente_id)
+
+    eventos = _filas_eventos(odontograma, actual.datos if actual else None)
+    db.session.add_all([EventoDiente(**evento) for evento in _con_procedimientos_validos(eventos)])
+    if actual is not None and (actual.fecha is None or actual.fecha <= fecha):
+        actual.odontograma_id = odontograma.id
+        actual.fecha = fecha
+        actual.datos = datos
+    return odontograma
+
+
+def _bloquear_actual(paciente_id):
+    """Fila OdontogramaActual del paciente bloqueada hasta el fin de la transacción, o None."""
+    return db.session.query(OdontogramaActual).filter(
+        OdontogramaActual.paciente_id == paciente_id
+    ).with_for_update().populate_existing().one_or_none()
+
+
+def _proc_id(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def eventos_odontograma(datos, datos_previos=None):
+    """
+    Eventos por diente de un odontograma compacto.
+
+    Args:
+        datos: odontograma de la consulta
+        datos_previos: odontograma anterior del paciente (None si es el primero)
+
+    Returns:
+        list de dicts {diente, superficie, tipo, estado, descripcion, procedimiento_id}:
+        uno por procedimiento trabajado en la consulta y uno por diente cuyo
+        estado o descripción cambió respecto del anterior
+    """
+    dientes = (datos or {}).get('dientes') or {}
+    previos = (datos_previos or {}).get('dientes') or {}
+    eventos = []
+
+    for numero in sorted(set(dientes) | set(previos), key=int):
+        diente = dientes.get(numero) or {}
+        previo = previos.get(numero) or {}
+
+        estado = diente.get('estado') or 'normal'
+        descripcion = (diente.get('descripcion') or '').strip()
+        if (estado, descripcion) != (previo.get('estado') or 'normal', (previo.get('descripcion') or '').strip()):
+            eventos.append({
+                'diente': int(numero), 'superficie': None, 'tipo': 'estado',
+                'estado': estado, 'descripcion': descripcion or None, 'procedimiento_id': None
+            })
+
+        superficies = diente.get('superficies') or {}
+        for nombre, sup in superficies.items():
+            if sup.get('historico') or not sup.get('trabajado'):
+                continue
+            proc_id = _proc_id(sup.get('procedimiento_id'))
+            if proc_id is None:
+                continue
+            eventos.append({
+                'diente': int(numero), 'superficie': nombre, 'tipo': 'procedimiento',
+                'estado': None, 'descripcion': None, 'procedimiento_id': proc_id
+            })
+
+        # Formato antiguo: procedimientos del diente completo
+        if not superficies and diente.get('trabajado'):
+            for proc in diente.get('procedimientos') or []:
+                proc_id = _proc_id(proc.get('id') if isinstance(proc, dict) else proc)
+                if proc_id is None:
+                    continue
+                eventos.append({
+                    'diente': int(numero), 'superficie': None, 'tipo': 'procedimiento',
+                    'estado': None, 'descripcion': None, 'procedimiento_id': proc_id
+                })
+    return eventos
+
+
+def _filas_eventos(odontograma, datos_previos):
+    comunes = {
+        'paciente_id': odontograma.paciente_id,
+        'consulta_id': odontograma.consulta_id,
+        'odontograma_id': odontograma.id,
+        'fecha': odontograma.fecha,
+    }
+    return [dict(evento, **comunes) for evento in eventos_odontograma(odontograma.datos, datos_previos)]
+
+
+def _con_procedimientos_validos(filas):
+    """Descarta los eventos de procedimientos que ya no existen en el catálogo."""
+    ids = {f['procedimiento_id'] for f in filas if f['procedimiento_id'] is not None}
+    if not ids:
+        return filas
+    existentes = {i for (i,) in db.session.query(Procedimiento.id).filter(Procedimiento.id.in_(ids))}
+    return [f for f in filas if f['procedimiento_id'] is None or f['procedimiento_id'] in existentes]
+
+
+def reconstruir_eventos_diente(lote=200):
+    """
+    Regenera los eventos por diente de todos los pacientes desde sus odontogramas.
+
+    Procesa los pacientes en lotes (una transacción por lote): borra sus
+    eventos y los vuelve a generar recorriendo los snapshots en orden, así
+    que se puede ejecutar de nuevo sin duplicar.
+
+    Returns:
+        int: cantidad de eventos generados
+    """
+    total = 0
+    ultimo_paciente = 0
+    while True:
+        paciente_ids = [p for (p,) in db.session.query(Odontograma.paciente_id).filter(
+            Odontograma.paciente_id > ultimo_paciente
+        ).distinct().order_by(Odontograma.paciente_id).limit(lote)]
+        if not paciente_ids:
+            return total
+
+        EventoDiente.query.filter(EventoDiente.paciente_id.in_(paciente_ids)).delete(synchronize_session=False)
+        filas = []
+        previos = {}
+        for odontograma in Odontograma.query.filter(Odontograma.paciente_id.in_(paciente_ids)).order_by(
+            Odontograma.paciente_id, Odontograma.fecha, Odontograma.id
+        ).yield_per(500):
+            if odontograma.fecha is not None:
+                filas.extend(_filas_eventos(odontograma, previos.get(odontograma.paciente_id)))
+            previos[odontograma.paciente_id] = odontograma.datos
+        filas = _con_procedimientos_validos(filas)
+        if filas:
+            db.session.execute(insert(EventoDiente), filas)
+        db.session.commit()
+
+        total += len(filas)
+        ultimo_paciente = paciente_ids[-1]
+
+
+def historial_dientes(paciente_id, diente=None):
+    """
+    Historia por diente de un paciente, en una sola consulta.
+
+    Args:
+        paciente_id: ID del paciente
+        diente: limitar a un número de diente (opcional)
+
+    Returns:
+        dict {numero_diente: [eventos en orden cronológico]} con cada evento
+        serializable a JSON
+    """
+    query = db.session.query(
+        EventoDiente, Procedimiento.nombre, Medico.nombre, Medico.apellido
+    ).outerjoin(
+        Procedimiento, Procedimiento.id == EventoDiente.procedimiento_id
+    ).join(
+        Consulta, Consulta.id == EventoDiente.consulta_id
+    ).outerjoin(
+        Medico, Medico.id == Consulta.medico_id
+    ).filter(EventoDiente.paciente_id == paciente_id)
+    if diente is not None:
+        query = query.filter(EventoDiente.diente == diente)
+
+    historial = {}
+    for evento, procedimiento, medico_nombre, medico_apellido in query.order_by(
+        EventoDiente.diente, EventoDiente.fecha, EventoDiente.id
+    ):
+        historial.setdefault(evento.diente, []).append({
+            'fecha': evento.fecha.isoformat(),
+            'tipo': evento.tipo,
+            'superficie': evento.superficie,
+            'estado': evento.estado,
+            'descripcion': evento.descripcion,
+            'procedimiento_id': evento.procedimiento_id,
+            'procedimiento': procedimiento,
+            'consulta_id': evento.consulta_id,
+            'medico': f'{medico_nombre} {medico_apellido}' if medico_nombre else None
+        })
+    return historial
+
+
+def odontograma_actual(paciente_id):
+    """Datos del último odontograma del paciente ({} si no tiene)."""
+    actual = db.session.get(OdontogramaActual, paciente_id)
+    return actual.datos if actual else {}
+
+
+def resumen_odontograma(odontograma):
+    """
+    Resumen para la vista de la consulta: dientes por estado y superficies
+    trabajadas en esta consulta (actuales) o en consultas anteriores (históricas).
+    """
+    datos = odontograma.datos or {}
+    estados = {'evaluado': [], 'terminado': [], 'normal': []}
+    superficies_actuales = []
+    superficies_historicas = []
+
+    for numero_str, datos_diente in sorted((datos.get('dientes') or {}).items(), key=lambda x: int(x[0])):
+        estado = (datos_diente or {}).get('estado', 'normal')
+        if estado in estados:
+            estados[estado].append(numero_str)
+        for sup_nombre, sup_data in ((datos_diente or {}).get('superficies') or {}).items():
+            if not sup_data or sup_data.get('procedimiento_id') is None:
+                continue
+            es_historico = bool(sup_data.get('historico'))
+            if sup_data.get('trabajado') or es_historico:
+                target = superficies_historicas if es_historico else superficies_actuales
+                target.append({
+                    'diente': numero_str,
+                    'superficie': sup_nombre.capitalize(),
+                    'procedimiento_id': sup_data['procedimiento_id'],
+                    'procedimiento_nombre': None,
+                    'historico': es_historico
+                })
+
+    procedimiento_ids = {s['procedimiento_id'] for s in superficies_actuales + superficies_historicas}
+    if procedimiento_ids:
+        nombres = dict(db.session.query(Procedimiento.id, Procedimiento.nombre).filter(
+            Procedimiento.id.in_(list(procedimiento_ids))
+        ))
+        for sup in superficies_actuales + superficies_historicas:
+            sup['procedimiento_nombre'] = nombres.get(sup['procedimiento_id'], 'Procedimiento desconocido')
+
+    return {
+        'fecha': odontograma.fecha,
+        'estados': estados,
+        'superficies_actuales': superficies_actuales,
+        'superficies_historicas': superficies_historicas
+    }
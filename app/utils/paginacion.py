@@ -0,0 +1,150 @@
+"""
+Paginación por cursor (keyset) para listados grandes.
+
+A diferencia de OFFSET/`paginate()`, cada página se obtiene con un filtro
+sobre las columnas de orden (`WHERE (apellido, id) > (:a, :i)`), por lo que
+el costo y la memoria por request no dependen de la posición ni del tamaño
+de la tabla. El cursor viaja en la URL como texto opaco.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_
+
+
+class PaginaKeyset:
+    """Una página de resultados con los cursores para navegar."""
+
+    def __init__(self, items, siguiente=None, anterior=None):
+        self.items = items
+        self.siguiente = siguiente
+        self.anterior = anterior
+
+    @property
+    def has_next(self):
+        return self.siguiente is not None
+
+    @property
+    def has_prev(self):
+        return self.anterior is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _serializar(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return valor
+
+
+def _deserializar(columna, valor):
+    if valor is None:
+        return None
+    tipo = columna.type.python_type
+    if tipo is datetime:
+        return datetime.fromisoformat(valor)
+    if tipo is date:
+        return date.fromisoformat(valor)
+    return tipo(valor)
+
+
+def codificar_cursor(valores):
+    texto = json.dumps([_serializar(v) for v in valores], separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, orden):
+    """Devuelve los valores del cursor tipados según las columnas, o None si es inválido."""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        if not isinstance(valores, list) or len(valores) != len(orden):
+            return None
+        return [_deserializar(columna, v) for (columna, _), v in zip(orden, valores)]
+    except (ValueError, TypeError):
+        return None
+
+
+def _despues_de(orden, valores, invertir=False):
+    """Condición "fila posterior al cursor" para un orden lexicográfico de varias columnas."""
+    condiciones = []
+    for i, (columna, descendente) in enumerate(orden):
+        mayor = descendente == invertir
+        comparacion = columna > valores[i] if mayor else columna < valores[i]
+        iguales = [c == v for (c, _), v in zip(orden[:i], valores[:i])]
+        condiciones.append(and_(*iguales, comparacion))
+    return or_(*condiciones)
+
+
+def _ordenar(query, orden, invertir=False):
+    return query.order_by(*[
+        columna.desc() if descendente != invertir else columna.asc()
+        for columna, descendente in orden
+    ])
+
+
+def _cursor_de(item, orden):
+    return codificar_cursor([getattr(item, columna.key) for columna, _ in orden])
+
+
+def paginar_keyset(query, orden, por_pagina=50, despues=None, antes=None):
+    """
+    Obtiene una página de `query` ordenada por `orden`.
+
+    Args:
+        query: query de modelos (sin order_by)
+        orden: lista de (columna, descendente); la última debe ser única (ej. id)
+        por_pagina: cantidad de filas por página
+        despues: cursor de la última fila de la página anterior (avanzar)
+        antes: cursor de la primera fila de la página siguiente (retroceder)
+
+    Returns:
+        PaginaKeyset
+    """
+    retrocede = False
+    valores = None
+    if antes:
+        valores = decodificar_cursor(antes, orden)
+        retrocede = valores is not None
+    elif despues:
+        valores = decodificar_cursor(despues, orden)
+
+    if valores is not None:
+        query = query.filter(_despues_de(orden, valores, invertir=retrocede))
+    filas = _ordenar(query, orden, invertir=retrocede).limit(por_pagina + 1).all()
+
+    hay_mas = len(filas) > por_pagina
+    filas = filas[:por_pagina]
+    if retrocede:
+        filas.reverse()
+
+    siguiente = anterior = None
+    if filas:
+        if hay_mas or retrocede:
+            siguiente = _cursor_de(filas[-1], orden)
+        if valores is not None and (hay_mas or not retrocede):
+            anterior = _cursor_de(filas[0], orden)
+    return PaginaKeyset(filas, siguiente=siguiente, anterior=anterior)
+
+
+def iterar_keyset(query, orden, lote=500):
+    """
+    Recorre todos los resultados de `query` en lotes por cursor.
+
+    Cada lote es una consulta independiente, así que la memoria queda acotada
+    a `lote` filas aunque el driver no soporte cursores del lado del servidor.
+    Pensado para exportaciones completas renderizadas con `stream_template`.
+    """
+    valores = None
+    while True:
+        q = query if valores is None else query.filter(_despues_de(orden, valores))
+        filas = _ordenar(q, orden).limit(lote).all()
+        yield from filas
+        if len(filas) < lote:
+            return
+        valores = [getattr(filas[-1], columna.key) for columna, _ in orden]
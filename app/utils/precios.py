@@ -0,0 +1,161 @@
+"""
+Resolución de precios de procedimientos.
+
+Regla de prioridad (ver `ProcedimientoPrecio`):
+    1) precio específico para (procedimiento_id, medico_id)
+    2) precio para (procedimiento_id, especialidad_id) sin médico
+    3) procedimiento.precio (valor por defecto)
+
+Los precios de cada procedimiento se guardan en la caché 'precios' como una
+fila compacta de la matriz (procedimiento, médico, especialidad) -> precio:
+`[base, {medico_id: precio}, {especialidad_id: precio}]`, con los importes
+como texto para no perder precisión. `resolve_many` resuelve un lote de
+combinaciones con una lectura de caché y, para los procedimientos que falten,
+dos consultas. Al confirmar cambios en procedimientos o en sus precios se
+descartan las filas afectadas, que se reconstruyen en la siguiente lectura.
+"""
+from decimal import Decimal
+
+from flask import current_app, has_app_context
+
+from app import db
+from app.models import Procedimiento, ProcedimientoPrecio
+from app.utils.cache import crear_cache, invalidar_al_confirmar
+
+
+def clave_precios(procedimiento_id):
+    return f'proc:{procedimiento_id}'
+
+
+def _cache():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('cache_precios')
+
+
+def _cargar_filas(procedimiento_ids):
+    """Filas de la matriz de los procedimientos dados, en dos consultas."""
+    filas = {
+        proc_id: [str(precio if precio is not None else 0), {}, {}]
+        for proc_id, precio in db.session.query(Procedimiento.id, Procedimiento.precio).filter(
+            Procedimiento.id.in_(procedimiento_ids)
+        )
+    }
+    if not filas:
+        return filas
+
+    # A igualdad de clave gana el registro más antiguo (menor id)
+    for proc_id, medico_id, especialidad_id, precio in db.session.query(
+        ProcedimientoPrecio.procedimiento_id, ProcedimientoPrecio.medico_id,
+        ProcedimientoPrecio.especialidad_id, ProcedimientoPrecio.precio
+    ).filter(
+        ProcedimientoPrecio.procedimiento_id.in_(list(filas))
+    ).order_by(ProcedimientoPrecio.id):
+        if medico_id is not None:
+            filas[proc_id][1].setdefault(str(medico_id), str(precio))
+        elif especialidad_id is not None:
+            filas[proc_id][2].setdefault(str(especialidad_id), str(precio))
+    return filas
+
+
+def _filas(procedimiento_ids):
+    """Filas de la matriz desde la caché, cargando de la base solo las que falten."""
+    ids = list(dict.fromkeys(procedimiento_ids))
+    cache = _cache()
+    filas = {}
+    if cache is not None and ids:
+        for proc_id, fila in zip(ids, cache.get_many([clave_precios(i) for i in ids])):
+            if fila is not None:
+                filas[proc_id] = fila
+
+    faltantes = [i for i in ids if i not in filas]
+    if faltantes:
+        cargadas = _cargar_filas(faltantes)
+        filas.update(cargadas)
+        if cache is not None and cargadas:
+            cache.set_many({clave_precios(i): fila for i, fila in cargadas.items()})
+    return filas
+
+
+def _resolver(fila, medico_id, especialidad_id):
+    if fila is None:
+        return Decimal('0')
+    base, por_medico, por_especialidad = fila
+    if medico_id and str(medico_id) in por_medico:
+        return Decimal(por_medico[str(medico_id)])
+    if especialidad_id and str(especialidad_id) in por_especialidad:
+        return Decimal(por_especialidad[str(especialidad_id)])
+    return Decimal(base)
+
+
+def resolve_many(solicitudes):
+    """
+    Resuelve en lote los precios de varias combinaciones.
+
+    Args:
+        solicitudes: iterable de (procedimiento_id, medico_id, especialidad_id);
+            medico_id y especialidad_id pueden ser None
+
+    Returns:
+        dict {(procedimiento_id, medico_id, especialidad_id): Decimal}; los
+        procedimientos inexistentes resuelven a 0
+    """
+    solicitudes = [tuple(s) for s in solicitudes]
+    filas = _filas(s[0] for s in solicitudes if s[0] is not None)
+    return {
+        (proc_id, medico_id, especialidad_id): _resolver(filas.get(proc_id), medico_id, especialidad_id)
+        for proc_id, medico_id, especialidad_id in solicitudes
+    }
+
+
+def resolve(procedimiento_id, medico_id=None, especialidad_id=None):
+    """Precio de un procedimiento para un médico/especialidad (ver `resolve_many`)."""
+    return resolve_many([(procedimiento_id, medico_id, especialidad_id)])[(procedimiento_id, medico_id, especialidad_id)]
+
+
+# ---------------------------------------------------------------------------
+# Invalidación: cambios en Procedimiento o ProcedimientoPrecio descartan la
+# fila de cada procedimiento afectado (valor anterior y nuevo).
+# ---------------------------------------------------------------------------
+
+_PENDIENTES = 'precios_invalidar'
+
+
+def _registrar_invalidaciones(session, flush_context):
+    if _cache() is None:
+        return
+    ids = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Procedimiento):
+            if obj in session.dirty and not db.inspect(obj).attrs.precio.history.has_changes():
+                continue
+            ids.add(obj.id)
+        elif isinstance(obj, ProcedimientoPrecio):
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            historial = db.inspect(obj).attrs.procedimiento_id.history
+            ids.update(v for v in (*historial.added, *historial.unchanged, *historial.deleted) if v is not None)
+    if ids:
+        session.info.setdefault(_PENDIENTES, set()).update(ids)
+
+
+def _aplicar_invalidaciones(session):
+    ids = session.info.pop(_PENDIENTES, None)
+    cache = _cache()
+    if not ids or cache is None:
+        return
+    cache.delete_many([clave_precios(i) for i in ids])
+
+
+def _descartar_invalidaciones(session):
+    session.info.pop(_PENDIENTES, None)
+
+
+def init_cache_precios(app):
+    """Crea la caché de la matriz de precios y engancha su invalidación a la sesión."""
+    app.extensions['cache_precios'] = crear_cache(
+        app, 'precios',
+        max_entradas=app.config.get('PRECIOS_CACHE_MAX', 4096),
+        ttl=app.config.get('PRECIOS_CACHE_TTL', 3600)
+    )
+    invalidar_al_confirmar(db.session, _registrar_invalidaciones, _aplicar_invalidaciones, _descartar_invalidaciones)
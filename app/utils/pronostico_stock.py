@@ -0,0 +1,152 @@
+"""
+Pronóstico de consumo de insumos.
+
+El consumo de cada insumo sale de su uso clínico:
+
+- las salidas de `MovimientoInsumo` asociadas a una consulta (insumos usados
+  y materiales de procedimientos), y
+- los `ConsultaInsumo` de consultas que no dejaron esa salida en el libro
+  (registros anteriores al libro de movimientos).
+
+No cuentan los ajustes de inventario ni las salidas de facturación, que
+repiten el descuento de los insumos ya usados en la consulta.
+
+`calcular_pronosticos` resuelve todo el catálogo de una vez: una consulta
+agregada por fuente, con las sumas de las dos ventanas (corta y larga) en la
+misma pasada, y guarda el resultado en `PronosticoInsumo`. El consumo diario
+estimado pondera más el promedio de la ventana corta para seguir cambios de
+tendencia. La cantidad sugerida lleva el stock a `stock_minimo` más
+PRONOSTICO_DIAS_COBERTURA días de consumo. Lo ejecuta el script
+`pronosticar_stock.py` (programado, por ejemplo a diario); la página de
+insumos solo lee la tabla.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, case, delete, exists, func, insert
+
+from app import db
+from app.models import ConsultaInsumo, Insumo, MovimientoInsumo, PronosticoInsumo
+
+
+# Peso del promedio de la ventana corta en el consumo diario estimado
+PESO_RECIENTE = 2 / 3
+
+
+def _config(clave, default):
+    if has_app_context():
+        return current_app.config.get(clave, default)
+    return default
+
+
+def _consumo_libro(desde_corta, desde_larga, hasta):
+    """Salidas del libro asociadas a consultas: (insumo_id, ventana corta, ventana larga)."""
+    cantidad = func.abs(MovimientoInsumo.cantidad)
+    return db.session.query(
+        MovimientoInsumo.insumo_id,
+        func.sum(case((MovimientoInsumo.fecha >= desde_corta, cantidad), else_=0)),
+        func.sum(cantidad)
+    ).filter(
+        MovimientoInsumo.tipo == 'salida',
+        MovimientoInsumo.consulta_id.isnot(None),
+        MovimientoInsumo.fecha >= desde_larga,
+        MovimientoInsumo.fecha < hasta
+    ).group_by(MovimientoInsumo.insumo_id)
+
+
+def _consumo_consultas_sin_libro(desde_corta, desde_larga, hasta):
+    """Insumos de consultas sin salida en el libro: (insumo_id, ventana corta, ventana larga)."""
+    en_libro = exists().where(and_(
+        MovimientoInsumo.consulta_id == ConsultaInsumo.consulta_id,
+        MovimientoInsumo.insumo_id == ConsultaInsumo.insumo_id,
+        MovimientoInsumo.tipo == 'salida'
+    ))
+    return db.session.query(
+        ConsultaInsumo.insumo_id,
+        func.sum(case((ConsultaInsumo.fecha_uso >= desde_corta, ConsultaInsumo.cantidad), else_=0)),
+        func.sum(ConsultaInsumo.cantidad)
+    ).filter(
+        ConsultaInsumo.fecha_uso >= desde_larga,
+        ConsultaInsumo.fecha_uso < hasta,
+        ~en_libro
+    ).group_by(ConsultaInsumo.insumo_id)
+
+
+def pronosticar(cantidad_actual, stock_minimo, consumo_corto, consumo_largo, hoy, dias_objetivo):
+    """
+    Pronóstico de un insumo a partir de sus promedios diarios.
+
+    Returns:
+        dict {consumo_diario, dias_cobertura, fecha_agotamiento, cantidad_sugerida}
+        (dias_cobertura y fecha_agotamiento en None si no hay consumo)
+    """
+    consumo = PESO_RECIENTE * consumo_corto + (1 - PESO_RECIENTE) * consumo_largo
+    if consumo > 0:
+        dias = max(cantidad_actual, 0) / consumo
+        fecha_agotamiento = hoy + timedelta(days=math.floor(dias))
+    else:
+        dias = fecha_agotamiento = None
+    objetivo = stock_minimo + math.ceil(consumo * dias_objetivo)
+    return {
+        'consumo_diario': round(consumo, 3),
+        'dias_cobertura': round(dias, 1) if dias is not None else None,
+        'fecha_agotamiento': fecha_agotamiento,
+        'cantidad_sugerida': max(objetivo - cantidad_actual, 0)
+    }
+
+
+def calcular_pronosticos(ahora=None):
+    """
+    Recalcula el pronóstico de todos los insumos activos y reemplaza la tabla.
+
+    Args:
+        ahora: instante de referencia (default: ahora, UTC)
+
+    Returns:
+        int: cantidad de insumos pronosticados
+    """
+    ahora = ahora or datetime.utcnow()
+    ventana_corta = _config('PRONOSTICO_VENTANA_CORTA', 14)
+    ventana_larga = max(_config('PRONOSTICO_VENTANA_LARGA', 60), ventana_corta)
+    dias_objetivo = _config('PRONOSTICO_DIAS_COBERTURA', 30)
+    desde_corta = ahora - timedelta(days=ventana_corta)
+    desde_larga = ahora - timedelta(days=ventana_larga)
+
+    consumos = defaultdict(lambda: [0, 0])
+    for query in (_consumo_libro(desde_corta, desde_larga, ahora),
+                  _consumo_consultas_sin_libro(desde_corta, desde_larga, ahora)):
+        for insumo_id, corta, larga in query:
+            consumos[insumo_id][0] += int(corta or 0)
+            consumos[insumo_id][1] += int(larga or 0)
+
+    hoy = ahora.date()
+    filas = []
+    for insumo_id, cantidad_actual, stock_minimo in db.session.query(
+        Insumo.id, Insumo.cantidad_actual, Insumo.stock_minimo
+    ).filter(Insumo.activo == True):
+        corta, larga = consumos.get(insumo_id, (0, 0))
+        consumo_corto = corta / ventana_corta
+        consumo_largo = larga / ventana_larga
+        filas.append(dict(
+            pronosticar(cantidad_actual or 0, stock_minimo or 0, consumo_corto, consumo_largo, hoy, dias_objetivo),
+            insumo_id=insumo_id,
+            consumo_corto=round(consumo_corto, 3),
+            consumo_largo=round(consumo_largo, 3),
+            calculado=ahora
+        ))
+
+    db.session.execute(delete(PronosticoInsumo))
+    if filas:
+        db.session.execute(insert(PronosticoInsumo), filas)
+    db.session.commit()
+    return len(filas)
+
+
+def pronosticos_de(insumo_ids):
+    """Pronósticos guardados de los insumos dados: dict {insumo_id: PronosticoInsumo}."""
+    ids = list(insumo_ids)
+    if not ids:
+        return {}
+    return {p.insumo_id: p for p in PronosticoInsumo.query.filter(PronosticoInsumo.insumo_id.in_(ids))}
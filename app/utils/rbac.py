@@ -55,6 +55,7 @@ def get_menu_items():
             ]},
             {'name': 'Consultorio', 'icon': 'clipboard-pulse', 'url': 'consultorio.listar_consultas', 'submenu': [
                 {'name': 'Consultas', 'url': 'consultorio.listar_consultas'},
+                {'name': 'Buscar en Consultas', 'url': 'consultorio.buscar_en_consultas'},
                 {'name': 'Insumos', 'url': 'consultorio.listar_insumos'},
             ]},
             {'name': 'RRHH', 'icon': 'people', 'url': 'rrhh.listar_medicos', 'submenu': [
@@ -71,6 +72,7 @@ def get_menu_items():
             {'name': 'Consultorio', 'icon': 'clipboard-pulse', 'url': 'consultorio.mis_consultas', 'submenu': [
                 {'name': 'Mis Citas Hoy', 'url': 'consultorio.mis_citas_hoy'},
                 {'name': 'Mis Consultas', 'url': 'consultorio.mis_consultas'},
+                {'name': 'Buscar en Consultas', 'url': 'consultorio.buscar_en_consultas'},
                 {'name': 'Insumos', 'url': 'consultorio.listar_insumos'},
             ]},
         ]
@@ -0,0 +1,163 @@
+"""
+Insumos a reponer.
+
+Un insumo se repone si está activo y `Insumo.requiere_reposicion`
+(`cantidad_actual <= stock_minimo`). La condición se evalúa en SQL y la
+resuelve el índice parcial `ix_insumos_reposicion`, que solo contiene esos
+insumos.
+
+El resumen por especialidad (según los vínculos `InsumoEspecialidad`; los
+insumos sin vínculo van en "Sin especialidad") se guarda en la caché
+'reposicion' para la página de insumos y los dashboards. Se descarta al
+confirmar cambios que pueden alterarlo: insumos creados, editados o
+borrados, vínculos con especialidades y movimientos de stock que cruzan el
+mínimo (ver `app.utils.stock`). El script `resumen_reposicion.py` lo
+regenera y lo imprime; pensado para ejecutarse programado (cron).
+"""
+from datetime import datetime
+
+from flask import current_app, has_app_context
+
+from app import db
+from app.models import Especialidad, Insumo, InsumoEspecialidad
+from app.utils.cache import crear_cache, invalidar_al_confirmar
+
+
+CLAVE_RESUMEN = 'resumen'
+
+# Atributos de Insumo que cambian la condición de reposición o lo que muestra el resumen
+_CAMPOS_INSUMO = ('cantidad_actual', 'stock_minimo', 'activo', 'nombre', 'codigo', 'unidad_medida')
+
+
+def _cache():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('cache_reposicion')
+
+
+def insumos_a_reponer():
+    """Query de los insumos activos con stock en o por debajo del mínimo."""
+    return Insumo.query.filter(Insumo.activo == True, Insumo.requiere_reposicion)
+
+
+def construir_resumen():
+    """
+    Arma el resumen de insumos a reponer agrupado por especialidad (una consulta).
+
+    Returns:
+        dict serializable a JSON: {generado, total, especialidades: [{id,
+        nombre, insumos: [{id, nombre, codigo, cantidad_actual, stock_minimo,
+        unidad_medida}]}]}
+    """
+    filas = db.session.query(
+        Insumo.id, Insumo.nombre, Insumo.codigo, Insumo.cantidad_actual, Insumo.stock_minimo,
+        Insumo.unidad_medida, Especialidad.id, Especialidad.nombre
+    ).outerjoin(
+        InsumoEspecialidad, InsumoEspecialidad.insumo_id == Insumo.id
+    ).outerjoin(
+        Especialidad, Especialidad.id == InsumoEspecialidad.especialidad_id
+    ).filter(
+        Insumo.activo == True, Insumo.requiere_reposicion
+    ).order_by(Especialidad.nombre, Insumo.nombre, Insumo.id)
+
+    grupos = {}
+    insumo_ids = set()
+    for insumo_id, nombre, codigo, cantidad, minimo, unidad, especialidad_id, especialidad in filas:
+        grupo = grupos.setdefault(especialidad_id, {
+            'id': especialidad_id,
+            'nombre': especialidad or 'Sin especialidad',
+            'insumos': []
+        })
+        grupo['insumos'].append({
+            'id': insumo_id,
+            'nombre': nombre,
+            'codigo': codigo,
+            'cantidad_actual': cantidad,
+            'stock_minimo': minimo,
+            'unidad_medida': unidad
+        })
+        insumo_ids.add(insumo_id)
+
+    # "Sin especialidad" al final
+    especialidades = sorted(grupos.values(), key=lambda g: g['id'] is None)
+    return {
+        'generado': datetime.now().isoformat(timespec='seconds'),
+        'total': len(insumo_ids),
+        'especialidades': especialidades
+    }
+
+
+def resumen_reposicion(regenerar=False):
+    """Resumen de insumos a reponer, desde la caché si está (ver `construir_resumen`)."""
+    cache = _cache()
+    if cache is not None and not regenerar:
+        resumen = cache.get(CLAVE_RESUMEN)
+        if resumen is not None:
+            return resumen
+    resumen = construir_resumen()
+    if cache is not None:
+        cache.set(CLAVE_RESUMEN, resumen)
+    return resumen
+
+
+def filtrar_resumen(resumen, especialidad_ids):
+    """Copia del resumen con solo las especialidades dadas (ej. las de un médico)."""
+    ids = set(especialidad_ids)
+    especialidades = [g for g in resumen['especialidades'] if g['id'] in ids]
+    return {
+        'generado': resumen['generado'],
+        'total': len({i['id'] for g in especialidades for i in g['insumos']}),
+        'especialidades': especialidades
+    }
+
+
+# ---------------------------------------------------------------------------
+# Invalidación: se anota en el flush (o desde el servicio de stock) y se
+# aplica al confirmar la transacción.
+# ---------------------------------------------------------------------------
+
+_PENDIENTES = 'reposicion_invalidar'
+
+
+def marcar_resumen_desactualizado(session):
+    """Anota que el resumen debe descartarse cuando se confirme la transacción."""
+    session.info[_PENDIENTES] = True
+
+
+def _registrar_invalidaciones(session, flush_context):
+    if _cache() is None or session.info.get(_PENDIENTES):
+        return
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, InsumoEspecialidad):
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+        elif isinstance(obj, Insumo):
+            if obj in session.dirty and not any(
+                db.inspect(obj).attrs[campo].history.has_changes() for campo in _CAMPOS_INSUMO
+            ):
+                continue
+        else:
+            continue
+        marcar_resumen_desactualizado(session)
+        return
+
+
+def _aplicar_invalidaciones(session):
+    pendiente = session.info.pop(_PENDIENTES, None)
+    cache = _cache()
+    if pendiente and cache is not None:
+        cache.delete_many([CLAVE_RESUMEN])
+
+
+def _descartar_invalidaciones(session):
+    session.info.pop(_PENDIENTES, None)
+
+
+def init_cache_reposicion(app):
+    """Crea la caché del resumen de reposición y engancha su invalidación a la sesión."""
+    app.extensions['cache_reposicion'] = crear_cache(
+        app, 'reposicion',
+        max_entradas=8,
+        ttl=app.config.get('REPOSICION_CACHE_TTL', 900)
+    )
+    invalidar_al_confirmar(db.session, _registrar_invalidaciones, _aplicar_invalidaciones, _descartar_invalidaciones)
@@ -0,0 +1,203 @@
+"""
+Reserva de turnos segura ante concurrencia.
+
+La unicidad de (medico_id, fecha, hora) entre citas activas la garantiza la
+base de datos con el índice único parcial `ux_citas_medico_horario_activo`;
+la verificación previa en Python solo sirve para dar un mensaje temprano.
+Cada formulario de nueva cita lleva además un token de idempotencia
+(`Cita.token_solicitud`, también único) para que un reenvío o reintento no
+cree una cita duplicada.
+
+Las series de citas (tratamientos recurrentes) se validan completas contra
+la agenda precargada del médico y se insertan en una sola transacción.
+"""
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Cita
+from app.utils.disponibilidad import ESTADOS_CITA_ACTIVA, cargar_agenda
+
+
+# Motivos por los que un turno de una serie no se puede reservar
+MOTIVOS_CONFLICTO = {
+    'pasado': 'Fecha y hora ya pasadas',
+    'duplicado': 'Turno repetido en la serie',
+    'vacaciones': 'El médico está de vacaciones',
+    'fuera_de_horario': 'Fuera del horario de atención del médico',
+    'permiso': 'El médico tiene permiso en ese horario',
+    'ocupado': 'Horario ocupado por otra cita',
+}
+
+
+class ConflictoHorario(Exception):
+    """El horario fue tomado por otra cita activa del mismo médico.
+
+    En series, `conflictos` lista los turnos rechazados como (fecha, hora, motivo).
+    """
+
+    def __init__(self, conflictos=None):
+        super().__init__('Conflicto de horario')
+        self.conflictos = conflictos or []
+
+
+class SolicitudDuplicada(Exception):
+    """El formulario ya fue procesado; `cita` es la cita creada la primera vez."""
+
+    def __init__(self, cita):
+        super().__init__(f'Solicitud ya procesada (cita {cita.id})')
+        self.cita = cita
+
+
+def nuevo_token_solicitud():
+    """Token de idempotencia para incluir en el formulario de nueva cita."""
+    return uuid.uuid4().hex
+
+
+def cita_por_token(token):
+    if not token:
+        return None
+    return Cita.query.filter_by(token_solicitud=token).first()
+
+
+def _horario_ocupado(medico_id, fecha, hora):
+    return db.session.query(
+        Cita.query.filter(
+            Cita.medico_id == medico_id,
+            Cita.fecha == fecha,
+            Cita.hora == hora,
+            Cita.estado.in_(ESTADOS_CITA_ACTIVA)
+        ).exists()
+    ).scalar()
+
+
+def confirmar_reserva(cita, token=None):
+    """
+    Confirma la transacción de una cita nueva o modificada.
+
+    Args:
+        cita: cita agregada o modificada en la sesión
+        token: token de idempotencia del formulario (solo citas nuevas)
+
+    Raises:
+        SolicitudDuplicada: ya existe una cita creada con el mismo `token`
+        ConflictoHorario: el índice único rechazó el horario (reserva simultánea)
+    """
+    horario = (cita.medico_id, cita.fecha, cita.hora)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existente = cita_por_token(token)
+        if existente is not None:
+            raise SolicitudDuplicada(existente)
+        if _horario_ocupado(*horario):
+            raise ConflictoHorario()
+        raise
+
+
+def fechas_recurrentes(fecha_inicio, intervalo_dias, cantidad):
+    """Fechas de una serie: `cantidad` fechas cada `intervalo_dias` desde `fecha_inicio`."""
+    return [fecha_inicio + timedelta(days=intervalo_dias * i) for i in range(cantidad)]
+
+
+def validar_turnos(medico, turnos, ahora=None):
+    """
+    Valida una lista de turnos contra la agenda del médico en una sola carga.
+
+    Args:
+        medico: objeto Medico
+        turnos: lista de (fecha, hora)
+        ahora: datetime de referencia para descartar turnos pasados
+
+    Returns:
+        list de (fecha, hora, motivo); motivo es None si el turno está libre
+        o una clave de MOTIVOS_CONFLICTO
+    """
+    if not turnos:
+        return []
+    ahora = ahora or datetime.now()
+    fechas = [fecha for fecha, _ in turnos]
+    agenda = cargar_agenda(medico.id, min(fechas), max(fechas), usuario_id=medico.usuario_id)
+
+    slots_por_fecha = {}
+    vistos = set()
+    resultado = []
+    for fecha, hora in turnos:
+        if (fecha, hora) in vistos:
+            motivo = 'duplicado'
+        elif datetime.combine(fecha, hora) < ahora:
+            motivo = 'pasado'
+        elif agenda.en_vacaciones(fecha):
+            motivo = 'vacaciones'
+        else:
+            if fecha not in slots_por_fecha:
+                slots_por_fecha[fecha] = dict(agenda.slots_dia(fecha))
+            estado = slots_por_fecha[fecha].get(hora)
+            if estado is None:
+                motivo = 'fuera_de_horario'
+            elif estado == 'disponible':
+                motivo = None
+            else:
+                motivo = estado
+        vistos.add((fecha, hora))
+        resultado.append((fecha, hora, motivo))
+    return resultado
+
+
+def reservar_turnos(medico, datos_cita, turnos, token=None, omitir_conflictos=False, ahora=None):
+    """
+    Crea una cita por turno en una única transacción.
+
+    Args:
+        medico: objeto Medico
+        datos_cita: campos comunes de las citas (paciente_id, especialidad_id,
+            motivo, usuario_registro_id)
+        turnos: lista de (fecha, hora)
+        token: token de idempotencia de la solicitud (se guarda en la primera cita)
+        omitir_conflictos: si es True se reservan los turnos libres y se informan
+            los demás; si es False cualquier conflicto cancela toda la serie
+
+    Returns:
+        tuple: (creadas, conflictos) con creadas como (id, fecha, hora) y
+        conflictos como (fecha, hora, motivo)
+
+    Raises:
+        SolicitudDuplicada: la serie ya fue creada con el mismo `token`
+        ConflictoHorario: hubo conflictos y no se pidió omitirlos, o otra
+            reserva simultánea tomó alguno de los turnos
+    """
+    existente = cita_por_token(token)
+    if existente is not None:
+        raise SolicitudDuplicada(existente)
+
+    validacion = validar_turnos(medico, turnos, ahora)
+    conflictos = [t for t in validacion if t[2] is not None]
+    if conflictos and not omitir_conflictos:
+        raise ConflictoHorario(conflictos)
+
+    citas = [
+        Cita(medico_id=medico.id, fecha=fecha, hora=hora, estado='pendiente', **datos_cita)
+        for fecha, hora, motivo in validacion if motivo is None
+    ]
+    if citas:
+        citas[0].token_solicitud = token
+    db.session.add_all(citas)
+    try:
+        db.session.flush()
+        # Se toman antes del commit para no recargar cada cita al leerlas
+        creadas = [(cita.id, cita.fecha, cita.hora) for cita in citas]
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existente = cita_por_token(token)
+        if existente is not None:
+            raise SolicitudDuplicada(existente)
+        # Otra reserva tomó turnos entre la validación y el commit
+        conflictos = [t for t in validar_turnos(medico, turnos, ahora) if t[2] is not None]
+        if not conflictos:
+            raise
+        raise ConflictoHorario(conflictos)
+    return creadas, conflictos
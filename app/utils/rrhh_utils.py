@@ -2,13 +2,14 @@
 Utilidades para recursos humanos - gestión de disponibilidad médica
 """
 from datetime import date, time
+from app import db
 from app.models import Vacacion, Permiso, Medico
 
 
 def medico_disponible_en_fecha(medico_id, fecha, hora_inicio=None, hora_fin=None):
     """
     Verifica si un médico está disponible en fecha/hora específica
-    Considera vacaciones y permisos aprobados
+    Considera vacaciones y permisos aprobados (ver `disponibilidad_medicos`)
     
     Args:
         medico_id: ID del médico
@@ -31,47 +32,84 @@ def medico_disponible_en_fecha(medico_id, fecha, hora_inicio=None, hora_fin=None
         from datetime import datetime
         fecha = datetime.strptime(fecha, '%Y-%m-%d').date()
     
-    # Obtener el usuario asociado al médico para verificar vacaciones/permiso por usuario
-    medico = Medico.query.get(medico_id)
-    if not medico or not medico.usuario:
-        return True, None
-    usuario_id = medico.usuario.id
+    return disponibilidad_medicos([medico_id], fecha, hora_inicio, hora_fin)[medico_id]
+
+
+def _motivo_permiso(permisos, hora_inicio=None, hora_fin=None):
+    """Motivo de no disponibilidad por permisos aprobados del día, o None."""
+    for permiso in permisos:
+        # Si no tiene horas específicas = permiso todo el día
+        if not permiso.hora_inicio or not permiso.hora_fin:
+            return "Permiso todo el día"
+    for permiso in permisos:
+        # Con horas a verificar solo cuenta si hay solapamiento:
+        # Permiso: 14:00-16:00, Cita: 15:00-16:00 → Solapa
+        # Permiso: 14:00-16:00, Cita: 16:00-17:00 → No solapa
+        # Sin horas a verificar, cualquier permiso del día marca como no disponible
+        if not (hora_inicio and hora_fin) or (permiso.hora_inicio < hora_fin and permiso.hora_fin > hora_inicio):
+            return f"Permiso de {permiso.hora_inicio.strftime('%H:%M')} a {permiso.hora_fin.strftime('%H:%M')}"
+    return None
+
+
+def disponibilidad_medicos(medicos, fecha, hora_inicio=None, hora_fin=None):
+    """
+    Versión por lotes de `medico_disponible_en_fecha` para varios médicos
+    Resuelve vacaciones y permisos de todos con dos consultas en total
     
-    # 1. Verificar vacaciones aprobadas (por usuario)
-    vacacion = Vacacion.query.filter(
-        Vacacion.usuario_id == usuario_id,
+    Args:
+        medicos: lista de objetos Medico o de IDs de médico
+        fecha: date object o string YYYY-MM-DD
+        hora_inicio: time object (opcional, para verificar permisos por hora)
+        hora_fin: time object (opcional, para verificar permisos por hora)
+    
+    Returns:
+        dict: {medico_id: (disponible: bool, motivo_si_no: str o None)}
+    """
+    if isinstance(fecha, str):
+        from datetime import datetime
+        fecha = datetime.strptime(fecha, '%Y-%m-%d').date()
+    
+    # medico_id -> usuario_id (los IDs sueltos se resuelven en una sola consulta)
+    usuarios = {m.id: m.usuario_id for m in medicos if isinstance(m, Medico)}
+    ids_sueltos = [m for m in medicos if not isinstance(m, Medico)]
+    if ids_sueltos:
+        filas = db.session.query(Medico.id, Medico.usuario_id).filter(Medico.id.in_(ids_sueltos))
+        usuarios.update({medico_id: usuario_id for medico_id, usuario_id in filas})
+    
+    resultado = {m.id if isinstance(m, Medico) else m: (True, None) for m in medicos}
+    usuario_ids = {u for u in usuarios.values() if u is not None}
+    if not usuario_ids:
+        return resultado
+    
+    # 1. Vacaciones aprobadas que cubren la fecha (por usuario)
+    vacaciones = {}
+    for vacacion in Vacacion.query.filter(
+        Vacacion.usuario_id.in_(usuario_ids),
         Vacacion.estado == 'aprobada',
         Vacacion.fecha_inicio <= fecha,
         Vacacion.fecha_fin >= fecha
-    ).first()
-    
-    if vacacion:
-        return False, f"De vacaciones del {vacacion.fecha_inicio.strftime('%d/%m')} al {vacacion.fecha_fin.strftime('%d/%m')}"
+    ):
+        vacaciones.setdefault(vacacion.usuario_id, vacacion)
     
-    # 2. Verificar permisos aprobados en esa fecha
-    permiso = Permiso.query.filter(
-        Permiso.usuario_id == usuario_id,
+    # 2. Permisos aprobados en esa fecha
+    permisos = {}
+    for permiso in Permiso.query.filter(
+        Permiso.usuario_id.in_(usuario_ids),
         Permiso.fecha == fecha,
         Permiso.estado == 'aprobado'
-    ).first()
+    ).order_by(Permiso.hora_inicio):
+        permisos.setdefault(permiso.usuario_id, []).append(permiso)
     
-    if permiso:
-        # Si no tiene horas específicas = permiso todo el día
-        if not permiso.hora_inicio or not permiso.hora_fin:
-            return False, "Permiso todo el día"
-        
-        # Si se proporcionaron horas para verificar
-        if hora_inicio and hora_fin:
-            # Verificar si hay solapamiento de horarios
-            # Permiso: 14:00-16:00, Cita: 15:00-16:00 → Solapa
-            # Permiso: 14:00-16:00, Cita: 16:00-17:00 → No solapa
-            if permiso.hora_inicio < hora_fin and permiso.hora_fin > hora_inicio:
-                return False, f"Permiso de {permiso.hora_inicio.strftime('%H:%M')} a {permiso.hora_fin.strftime('%H:%M')}"
-        else:
-            # Sin horas específicas para verificar, pero hay permiso → marcar como no disponible
-            return False, f"Permiso de {permiso.hora_inicio.strftime('%H:%M')} a {permiso.hora_fin.strftime('%H:%M')}"
+    for medico_id, usuario_id in usuarios.items():
+        vacacion = vacaciones.get(usuario_id)
+        if vacacion:
+            resultado[medico_id] = (False, f"De vacaciones del {vacacion.fecha_inicio.strftime('%d/%m')} al {vacacion.fecha_fin.strftime('%d/%m')}")
+            continue
+        motivo = _motivo_permiso(permisos.get(usuario_id, []), hora_inicio, hora_fin)
+        if motivo:
+            resultado[medico_id] = (False, motivo)
     
-    return True, None
+    return resultado
 
 
 def obtener_medicos_disponibles(medicos, fecha, hora_inicio=None, hora_fin=None):
@@ -96,10 +134,10 @@ def obtener_medicos_disponibles(medicos, fecha, hora_inicio=None, hora_fin=None)
     medicos_disponibles = []
     medicos_no_disponibles = []
     
+    disponibilidad = disponibilidad_medicos(medicos, fecha, hora_inicio, hora_fin)
+    
     for medico in medicos:
-        disponible, motivo = medico_disponible_en_fecha(
-            medico.id, fecha, hora_inicio, hora_fin
-        )
+        disponible, motivo = disponibilidad[medico.id]
         
         # Agregar atributos temporales para uso en templates
         medico.disponible = disponible
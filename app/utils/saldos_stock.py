@@ -0,0 +1,275 @@
+"""
+Saldos de stock de insumos en el tiempo.
+
+El libro `MovimientoInsumo` guarda cada variación de stock. Para no
+recorrerlo entero al preguntar "cuánto había de X el 1 de marzo", el
+proceso `compactar_saldos` (script `compactar_saldos_stock.py`, pensado para
+ejecutarse programado) escribe en `SaldoInsumo` el saldo de cada insumo al
+cierre de cada período ('diario' o 'mensual', STOCK_SALDOS_PERIODO) en que
+tuvo movimientos.
+
+`stock_en` combina el saldo más cercano anterior al instante pedido con los
+movimientos posteriores a ese saldo. Los insumos sin saldos se calculan
+hacia atrás desde `Insumo.cantidad_actual`, descontando los movimientos
+posteriores al instante.
+
+Las fechas son UTC, igual que `MovimientoInsumo.fecha`.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, case, func, insert
+
+from app import db
+from app.models import Insumo, MovimientoInsumo, SaldoInsumo
+
+
+PERIODOS = ('diario', 'mensual')
+
+
+def _periodo(periodo=None):
+    if periodo is None and has_app_context():
+        periodo = current_app.config.get('STOCK_SALDOS_PERIODO')
+    periodo = periodo or 'mensual'
+    if periodo not in PERIODOS:
+        raise ValueError(f'Período de saldos inválido: {periodo}')
+    return periodo
+
+
+def inicio_periodo(momento, periodo):
+    """Inicio (00:00) del día o del mes que contiene `momento`."""
+    dia = datetime.combine(momento.date() if isinstance(momento, datetime) else momento, time.min)
+    return dia.replace(day=1) if periodo == 'mensual' else dia
+
+
+def siguiente_periodo(inicio, periodo):
+    """Inicio del período que sigue al que empieza en `inicio`."""
+    if periodo == 'mensual':
+        return (inicio + timedelta(days=32)).replace(day=1)
+    return inicio + timedelta(days=1)
+
+
+def variacion_movimiento():
+    """Variación con signo de un movimiento (expresión SQL)."""
+    # Algunas salidas anteriores al servicio de stock se registraron en positivo
+    return case(
+        (MovimientoInsumo.tipo == 'salida', -func.abs(MovimientoInsumo.cantidad)),
+        (MovimientoInsumo.tipo == 'entrada', func.abs(MovimientoInsumo.cantidad)),
+        else_=MovimientoInsumo.cantidad
+    )
+
+
+def _como_fecha(valor):
+    # func.date() devuelve date en PostgreSQL y texto en SQLite
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def _variaciones_por_dia(insumo_ids, hasta, desde=None):
+    """{insumo_id: [(día, variación)]} de los movimientos con desde <= fecha < hasta."""
+    dia = func.date(MovimientoInsumo.fecha)
+    query = db.session.query(
+        MovimientoInsumo.insumo_id, dia, func.sum(variacion_movimiento())
+    ).filter(
+        MovimientoInsumo.insumo_id.in_(insumo_ids),
+        MovimientoInsumo.fecha < hasta
+    )
+    if desde is not None:
+        query = query.filter(MovimientoInsumo.fecha >= desde)
+    resultado = defaultdict(list)
+    for insumo_id, fecha, variacion in query.group_by(MovimientoInsumo.insumo_id, dia):
+        resultado[insumo_id].append((_como_fecha(fecha), int(variacion or 0)))
+    return resultado
+
+
+def _por_periodo(dias, periodo, desde=None):
+    """Agrupa [(día, variación)] en {inicio_periodo: variación}, desde un día opcional."""
+    resultado = defaultdict(int)
+    for dia, variacion in dias:
+        if desde is None or dia >= desde.date():
+            resultado[inicio_periodo(dia, periodo)] += variacion
+    return resultado
+
+
+def _ultimos_saldos(hasta=None, insumo_ids=None):
+    """Subquery del último saldo de cada insumo (con `hasta` <= al dado)."""
+    ultimos = db.session.query(
+        SaldoInsumo.insumo_id.label('insumo_id'), func.max(SaldoInsumo.hasta).label('hasta')
+    )
+    if hasta is not None:
+        ultimos = ultimos.filter(SaldoInsumo.hasta <= hasta)
+    if insumo_ids is not None:
+        ultimos = ultimos.filter(SaldoInsumo.insumo_id.in_(insumo_ids))
+    ultimos = ultimos.group_by(SaldoInsumo.insumo_id).subquery()
+    return db.session.query(
+        SaldoInsumo.insumo_id.label('insumo_id'), SaldoInsumo.hasta.label('hasta'),
+        SaldoInsumo.cantidad.label('cantidad')
+    ).join(
+        ultimos, and_(ultimos.c.insumo_id == SaldoInsumo.insumo_id, ultimos.c.hasta == SaldoInsumo.hasta)
+    ).subquery()
+
+
+def compactar_saldos(ahora=None, periodo=None, lote=500):
+    """
+    Escribe los saldos de cierre de los períodos ya cerrados que faltan.
+
+    Para cada insumo con saldos previos avanza desde el último sumando los
+    movimientos de cada período. A los que todavía no tienen saldos se les
+    calcula el de cierre del último período hacia atrás desde el stock
+    actual, y desde ahí los de los períodos anteriores con movimientos.
+    Solo escribe saldos al cierre de períodos con movimientos (más el
+    primero de cada insumo), así que se puede ejecutar de nuevo sin duplicar.
+    Procesa los insumos en lotes (una transacción por lote).
+
+    Args:
+        ahora: instante de referencia (default: ahora, UTC)
+        periodo: 'diario' o 'mensual' (default: STOCK_SALDOS_PERIODO)
+        lote: insumos por transacción
+
+    Returns:
+        int: cantidad de saldos escritos
+    """
+    periodo = _periodo(periodo)
+    corte = inicio_periodo(ahora or datetime.utcnow(), periodo)
+    total = 0
+    ultimo_insumo = 0
+    while True:
+        insumos = db.session.query(Insumo.id, Insumo.cantidad_actual).filter(
+            Insumo.id > ultimo_insumo
+        ).order_by(Insumo.id).limit(lote).all()
+        if not insumos:
+            return total
+        ids = [insumo_id for insumo_id, _ in insumos]
+
+        ultimos = {
+            fila.insumo_id: (fila.hasta, fila.cantidad)
+            for fila in db.session.query(_ultimos_saldos(insumo_ids=ids))
+        }
+        con_saldo = [i for i in ids if i in ultimos]
+        sin_saldo = [i for i in ids if i not in ultimos]
+        dias = {}
+        if con_saldo:
+            dias.update(_variaciones_por_dia(con_saldo, corte, desde=min(h for h, _ in ultimos.values())))
+        if sin_saldo:
+            dias.update(_variaciones_por_dia(sin_saldo, corte))
+        # Movimientos desde el corte, para calcular hacia atrás los insumos sin saldos
+        posteriores = dict(db.session.query(
+            MovimientoInsumo.insumo_id, func.sum(variacion_movimiento())
+        ).filter(
+            MovimientoInsumo.insumo_id.in_(sin_saldo),
+            MovimientoInsumo.fecha >= corte
+        ).group_by(MovimientoInsumo.insumo_id).all()) if sin_saldo else {}
+
+        filas = []
+        for insumo_id, cantidad_actual in insumos:
+            if insumo_id in ultimos:
+                desde, saldo = ultimos[insumo_id]
+                por_periodo = _por_periodo(dias.get(insumo_id, ()), periodo, desde)
+                for inicio in sorted(por_periodo):
+                    saldo += por_periodo[inicio]
+                    filas.append({'insumo_id': insumo_id, 'hasta': siguiente_periodo(inicio, periodo), 'cantidad': saldo})
+            else:
+                por_periodo = _por_periodo(dias.get(insumo_id, ()), periodo)
+                saldo = cantidad_actual - int(posteriores.get(insumo_id) or 0)
+                filas.append({'insumo_id': insumo_id, 'hasta': corte, 'cantidad': saldo})
+                for inicio in sorted(por_periodo, reverse=True):
+                    cierre = siguiente_periodo(inicio, periodo)
+                    if cierre < corte:
+                        filas.append({'insumo_id': insumo_id, 'hasta': cierre, 'cantidad': saldo})
+                    saldo -= por_periodo[inicio]
+
+        if filas:
+            fecha = datetime.utcnow()
+            db.session.execute(insert(SaldoInsumo), [dict(fila, fecha_creacion=fecha) for fila in filas])
+        db.session.commit()
+
+        total += len(filas)
+        ultimo_insumo = ids[-1]
+
+
+def stock_en(momento, insumo_ids=None):
+    """
+    Stock de los insumos en un instante (movimientos con fecha < momento).
+
+    Args:
+        momento: datetime UTC
+        insumo_ids: limitar a estos insumos (default: todos los que existían
+            en ese instante)
+
+    Returns:
+        dict {insumo_id: cantidad}
+    """
+    insumos = db.session.query(Insumo.id, Insumo.cantidad_actual)
+    if insumo_ids is not None:
+        insumos = insumos.filter(Insumo.id.in_(list(insumo_ids)))
+    else:
+        insumos = insumos.filter(db.or_(Insumo.fecha_creacion.is_(None), Insumo.fecha_creacion < momento))
+    actuales = dict(insumos.all())
+    if not actuales:
+        return {}
+
+    # Desde el saldo más cercano anterior: saldo + movimientos en [hasta, momento)
+    saldos = _ultimos_saldos(hasta=momento, insumo_ids=list(actuales))
+    resultado = {fila.insumo_id: fila.cantidad for fila in db.session.query(saldos)}
+    for insumo_id, variacion in db.session.query(
+        MovimientoInsumo.insumo_id, func.sum(variacion_movimiento())
+    ).join(
+        saldos, saldos.c.insumo_id == MovimientoInsumo.insumo_id
+    ).filter(
+        MovimientoInsumo.fecha >= saldos.c.hasta,
+        MovimientoInsumo.fecha < momento
+    ).group_by(MovimientoInsumo.insumo_id):
+        resultado[insumo_id] += int(variacion or 0)
+
+    # Sin saldo anterior: hacia atrás desde el stock actual
+    sin_saldo = [insumo_id for insumo_id in actuales if insumo_id not in resultado]
+    if sin_saldo:
+        posteriores = dict(db.session.query(
+            MovimientoInsumo.insumo_id, func.sum(variacion_movimiento())
+        ).filter(
+            MovimientoInsumo.insumo_id.in_(sin_saldo),
+            MovimientoInsumo.fecha >= momento
+        ).group_by(MovimientoInsumo.insumo_id).all())
+        for insumo_id in sin_saldo:
+            resultado[insumo_id] = actuales[insumo_id] - int(posteriores.get(insumo_id) or 0)
+    return resultado
+
+
+def movimientos_con_saldo(insumo, movimientos):
+    """
+    Agrega a una página de movimientos (del más reciente al más antiguo) el
+    saldo del insumo después de cada uno, con una sola consulta.
+
+    Returns:
+        list de (MovimientoInsumo, variación con signo, saldo)
+    """
+    if not movimientos:
+        return []
+    primero = movimientos[0]
+    # Movimientos posteriores al primero de la página, en el orden (fecha, id)
+    posteriores = db.session.query(func.sum(variacion_movimiento())).filter(
+        MovimientoInsumo.insumo_id == insumo.id,
+        db.or_(
+            MovimientoInsumo.fecha > primero.fecha,
+            and_(MovimientoInsumo.fecha == primero.fecha, MovimientoInsumo.id > primero.id)
+        )
+    ).scalar() or 0
+    saldo = insumo.cantidad_actual - int(posteriores)
+    resultado = []
+    for movimiento in movimientos:
+        variacion = _variacion(movimiento)
+        resultado.append((movimiento, variacion, saldo))
+        saldo -= variacion
+    return resultado
+
+
+def _variacion(movimiento):
+    if movimiento.tipo == 'salida':
+        return -abs(movimiento.cantidad)
+    if movimiento.tipo == 'entrada':
+        return abs(movimiento.cantidad)
+    return movimiento.cantidad
@@ -0,0 +1,175 @@
+"""
+Movimientos de stock de insumos.
+
+El stock se modifica siempre en la base de datos, nunca leyendo y
+escribiendo `Insumo.cantidad_actual` desde Python: todos los insumos de un
+movimiento (por ejemplo, los usados en una consulta) se actualizan con un
+único `UPDATE ... SET cantidad_actual = cantidad_actual + CASE id ... END
+... RETURNING`, que solo toca las filas con stock suficiente. Dos consultas
+que consumen el mismo insumo a la vez se serializan en el bloqueo de esa
+fila (no de la tabla) y ninguna pierde la actualización de la otra.
+
+Cada movimiento deja su fila en el libro `MovimientoInsumo` con la cantidad
+con signo (negativa para salidas), insertadas en lote en la misma
+transacción.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import case, insert, update
+
+from app import db
+from app.models import Insumo, MovimientoInsumo
+from app.utils.reposicion import marcar_resumen_desactualizado
+
+
+class StockInsuficiente(Exception):
+    """Algún insumo no tiene stock para el movimiento; no se aplicó ninguno.
+
+    `faltantes` lista dicts {insumo_id, nombre, disponible, requerido}.
+    """
+
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        detalle = ', '.join(
+            f"{f['nombre']} (disponible {f['disponible']}, requerido {f['requerido']})" for f in faltantes
+        )
+        super().__init__(f'Stock insuficiente: {detalle}')
+
+
+def _agrupar(cantidades):
+    """Suma las cantidades por insumo y descarta las nulas."""
+    totales = defaultdict(int)
+    for insumo_id, cantidad in cantidades:
+        totales[int(insumo_id)] += int(cantidad)
+    return {insumo_id: cantidad for insumo_id, cantidad in totales.items() if cantidad}
+
+
+def _faltantes(deltas, aplicados):
+    pendientes = [insumo_id for insumo_id in deltas if insumo_id not in aplicados]
+    existentes = {
+        insumo_id: (nombre, cantidad_actual)
+        for insumo_id, nombre, cantidad_actual in db.session.query(
+            Insumo.id, Insumo.nombre, Insumo.cantidad_actual
+        ).filter(Insumo.id.in_(pendientes))
+    }
+    return [
+        {
+            'insumo_id': insumo_id,
+            'nombre': existentes.get(insumo_id, (f'Insumo #{insumo_id}', 0))[0],
+            'disponible': existentes.get(insumo_id, (None, 0))[1],
+            'requerido': -deltas[insumo_id]
+        }
+        for insumo_id in pendientes
+    ]
+
+
+def aplicar_movimientos(deltas, motivo, tipo=None, consulta_id=None, usuario_id=None, permitir_negativo=False):
+    """
+    Aplica variaciones de stock a varios insumos en una sola sentencia.
+
+    Args:
+        deltas: dict {insumo_id: variación} (negativa para salidas)
+        motivo: texto del movimiento en el libro
+        tipo: 'entrada', 'salida' o 'ajuste' (default según el signo)
+        consulta_id / usuario_id: referencias del movimiento
+        permitir_negativo: no exigir stock suficiente
+
+    Returns:
+        dict {insumo_id: cantidad_actual resultante}
+
+    Raises:
+        StockInsuficiente: si algún insumo no existe o quedaría en negativo;
+            en ese caso no se modifica ninguno
+    """
+    if not deltas:
+        return {}
+
+    variacion = case(deltas, value=Insumo.id)
+    sentencia = update(Insumo).where(Insumo.id.in_(list(deltas))).values(
+        cantidad_actual=Insumo.cantidad_actual + variacion
+    )
+    if not permitir_negativo:
+        sentencia = sentencia.where(Insumo.cantidad_actual + variacion >= 0)
+
+    savepoint = db.session.begin_nested()
+    filas = db.session.execute(
+        sentencia.returning(Insumo.id, Insumo.cantidad_actual, Insumo.stock_minimo),
+        execution_options={'synchronize_session': 'fetch'}
+    ).all()
+    resultado = {insumo_id: cantidad for insumo_id, cantidad, _ in filas}
+    if len(resultado) < len(deltas):
+        savepoint.rollback()
+        raise StockInsuficiente(_faltantes(deltas, resultado))
+
+    # El resumen de reposición cambia si algún insumo cruzó su stock mínimo
+    if any(
+        (cantidad - deltas[insumo_id] <= minimo) != (cantidad <= minimo)
+        for insumo_id, cantidad, minimo in filas
+    ):
+        marcar_resumen_desactualizado(db.session)
+
+    fecha = datetime.utcnow()
+    db.session.execute(insert(MovimientoInsumo), [
+        {
+            'insumo_id': insumo_id,
+            'tipo': tipo or ('entrada' if delta > 0 else 'salida'),
+            'cantidad': delta,
+            'motivo': motivo,
+            'consulta_id': consulta_id,
+            'usuario_id': usuario_id,
+            'fecha': fecha
+        }
+        for insumo_id, delta in deltas.items()
+    ])
+    savepoint.commit()
+    return resultado
+
+
+def descontar_stock(cantidades, motivo, **kwargs):
+    """
+    Descuenta stock de varios insumos (ej. los usados en una consulta).
+
+    Args:
+        cantidades: iterable de (insumo_id, cantidad) con cantidades positivas;
+            un mismo insumo puede repetirse
+        motivo, **kwargs: ver `aplicar_movimientos`
+    """
+    return aplicar_movimientos({i: -c for i, c in _agrupar(cantidades).items()}, motivo, **kwargs)
+
+
+def reponer_stock(cantidades, motivo, **kwargs):
+    """Suma stock a varios insumos (entradas); ver `descontar_stock`."""
+    return aplicar_movimientos(_agrupar(cantidades), motivo, **kwargs)
+
+
+def _stock_bloqueado(insumo_id, requerido):
+    """Stock actual del insumo con su fila bloqueada hasta el fin de la transacción."""
+    actual = db.session.query(Insumo.cantidad_actual).filter(Insumo.id == insumo_id).with_for_update().scalar()
+    if actual is None:
+        raise StockInsuficiente([{'insumo_id': insumo_id, 'nombre': f'Insumo #{insumo_id}', 'disponible': 0, 'requerido': requerido}])
+    return actual
+
+
+def fijar_stock(insumo_id, cantidad, motivo, usuario_id=None):
+    """
+    Establece el stock de un insumo (inventario físico) registrando la diferencia.
+
+    La fila del insumo se bloquea mientras se calcula la diferencia, así que
+    un consumo concurrente no se pierde: queda antes o después del ajuste.
+    """
+    actual = _stock_bloqueado(insumo_id, cantidad)
+    return aplicar_movimientos({insumo_id: cantidad - actual} if cantidad != actual else {},
+                               motivo, tipo='ajuste', usuario_id=usuario_id)
+
+
+def retirar_stock(insumo_id, cantidad, motivo, usuario_id=None):
+    """
+    Resta hasta `cantidad` de un insumo (ajuste manual); si hay menos, el
+    stock queda en 0 en lugar de rechazar el ajuste. Bloquea la fila igual
+    que `fijar_stock`.
+    """
+    actual = _stock_bloqueado(insumo_id, cantidad)
+    retiro = min(cantidad, max(actual, 0))
+    return aplicar_movimientos({insumo_id: -retiro} if retiro > 0 else {},
+                               motivo, tipo='ajuste', usuario_id=usuario_id)
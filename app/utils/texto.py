@@ -0,0 +1,36 @@
+"""Utilidades de normalización de texto para búsquedas"""
+import re
+import unicodedata
+
+_NO_ALFANUMERICO = re.compile(r'[^0-9a-z]+')
+_SEPARADOR_ENTRE_DIGITOS = re.compile(r'(?<=[0-9])[^0-9a-z]+(?=[0-9])')
+_PUNTUACION_ENTRE_DIGITOS = re.compile(r'(?<=[0-9])[.,](?=[0-9])')
+
+
+def _sin_acentos(texto):
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def normalizar_texto(*partes):
+    """
+    Une las partes y las normaliza para búsqueda: minúsculas, sin acentos ni
+    signos y con espacios simples ("José  Benítez" -> "jose benitez").
+    Los separadores entre dígitos se eliminan para que los documentos
+    coincidan con o sin puntos ("4.123.456" -> "4123456").
+    Las partes None se ignoran.
+    """
+    texto = _sin_acentos(' '.join(str(p) for p in partes if p))
+    texto = _SEPARADOR_ENTRE_DIGITOS.sub('', texto)
+    return _NO_ALFANUMERICO.sub(' ', texto).strip()
+
+
+def normalizar_consulta(texto):
+    """
+    Normaliza una consulta de búsqueda conservando su sintaxis: minúsculas y
+    sin acentos, pero con las comillas y los guiones ('"dolor agudo"
+    -caries') que interpreta `websearch_to_tsquery`. Los puntos y comas
+    entre dígitos se eliminan como en `normalizar_texto`.
+    """
+    texto = _PUNTUACION_ENTRE_DIGITOS.sub('', _sin_acentos(texto or ''))
+    return ' '.join(texto.split())
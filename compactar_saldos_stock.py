@@ -0,0 +1,14 @@
+"""
+Script para escribir los saldos de stock por insumo al cierre de cada
+período (STOCK_SALDOS_PERIODO: 'diario' o 'mensual'), usados para consultar
+el stock a una fecha. Pensado para ejecutarse programado (cron), por ejemplo
+a diario; se puede volver a ejecutar sin duplicar saldos.
+"""
+from app import create_app
+from app.utils.saldos_stock import compactar_saldos
+
+app = create_app()
+
+with app.app_context():
+    total = compactar_saldos()
+    print(f"✅ {total} saldos de stock generados ({app.config['STOCK_SALDOS_PERIODO']})")
@@ -31,6 +31,50 @@ class Config:
     
     # Configuración de reportes
     REPORTS_FOLDER = os.path.join(basedir, 'reports')
+    
+    # Caché de resultados calculados: 'memoria' (por proceso) o 'redis' (compartida entre workers)
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memoria')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    
+    # Grillas de disponibilidad por médico y día (segundos / cantidad máxima en memoria)
+    DISPONIBILIDAD_CACHE_TTL = int(os.environ.get('DISPONIBILIDAD_CACHE_TTL', 600))
+    DISPONIBILIDAD_CACHE_MAX = 4096
+    
+    # Tableros de los dashboards: TTL corto (segundos), se invalidan además
+    # al confirmar cambios en citas o ventas
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 10))
+    DASHBOARD_CACHE_MAX = 512
+    
+    # Búsqueda de pacientes: cada cuántos segundos se reconstruye el índice
+    # de trigramas en memoria (solo se usa si PostgreSQL no tiene pg_trgm)
+    PACIENTES_INDICE_TTL = int(os.environ.get('PACIENTES_INDICE_TTL', 300))
+
+    # Matriz de precios de procedimientos: se invalida al confirmar cambios de
+    # precios; el TTL acota el desfase entre workers con el backend en memoria
+    PRECIOS_CACHE_TTL = int(os.environ.get('PRECIOS_CACHE_TTL', 3600))
+    PRECIOS_CACHE_MAX = 4096
+
+    # Búsqueda de texto completo en consultas: configuración de PostgreSQL
+    # usada para el stemming (ver app.utils.busqueda_clinica)
+    BUSQUEDA_CLINICA_CONFIG = os.environ.get('BUSQUEDA_CLINICA_CONFIG', 'spanish')
+
+    # Resumen de insumos a reponer por especialidad: se invalida al confirmar
+    # cambios que lo afectan; el TTL acota el desfase entre workers
+    REPOSICION_CACHE_TTL = int(os.environ.get('REPOSICION_CACHE_TTL', 900))
+
+    # Saldos de stock por insumo: período de los cierres que escribe
+    # compactar_saldos_stock.py ('diario' o 'mensual')
+    STOCK_SALDOS_PERIODO = os.environ.get('STOCK_SALDOS_PERIODO', 'mensual')
+
+    # Pronóstico de consumo de insumos (pronosticar_stock.py): ventanas de los
+    # promedios móviles y días de consumo que debe cubrir la cantidad sugerida
+    PRONOSTICO_VENTANA_CORTA = int(os.environ.get('PRONOSTICO_VENTANA_CORTA', 14))
+    PRONOSTICO_VENTANA_LARGA = int(os.environ.get('PRONOSTICO_VENTANA_LARGA', 60))
+    PRONOSTICO_DIAS_COBERTURA = int(os.environ.get('PRONOSTICO_DIAS_COBERTURA', 30))
+
+    # PDF clínicos ya generados (REPORTS_FOLDER/pdf_cache): tamaño máximo de
+    # la carpeta; al superarlo se borran los menos usados
+    PDF_CACHE_MAX_MB = int(os.environ.get('PDF_CACHE_MAX_MB', 200))
 
 class DevelopmentConfig(Config):
     """Configuración para desarrollo"""
@@ -42,8 +86,16 @@ class ProductionConfig(Config):
     DEBUG = False
     SQLALCHEMY_ECHO = False
 
+class TestingConfig(Config):
+    """Configuración para las pruebas (tests/): SQLite en memoria"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    CACHE_BACKEND = 'memoria'
+
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
+    'testing': TestingConfig,
     'default': DevelopmentConfig
 }
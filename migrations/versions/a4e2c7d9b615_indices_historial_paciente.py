@@ -0,0 +1,43 @@
+"""Indices para el historial del paciente
+
+Revision ID: a4e2c7d9b615
+Revises: f1a6d3b8c502
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'a4e2c7d9b615'
+down_revision = 'f1a6d3b8c502'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('consultas', schema=None) as batch_op:
+        batch_op.create_index('ix_consultas_paciente_fecha_id', ['paciente_id', 'fecha', 'id'], unique=False)
+
+    with op.batch_alter_table('recetas', schema=None) as batch_op:
+        batch_op.create_index('ix_recetas_consulta_id', ['consulta_id'], unique=False)
+
+    with op.batch_alter_table('consulta_insumos', schema=None) as batch_op:
+        batch_op.create_index('ix_consulta_insumos_consulta_id', ['consulta_id'], unique=False)
+
+    with op.batch_alter_table('consulta_procedimientos', schema=None) as batch_op:
+        batch_op.create_index('ix_consulta_procedimientos_consulta_id', ['consulta_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('consulta_procedimientos', schema=None) as batch_op:
+        batch_op.drop_index('ix_consulta_procedimientos_consulta_id')
+
+    with op.batch_alter_table('consulta_insumos', schema=None) as batch_op:
+        batch_op.drop_index('ix_consulta_insumos_consulta_id')
+
+    with op.batch_alter_table('recetas', schema=None) as batch_op:
+        batch_op.drop_index('ix_recetas_consulta_id')
+
+    with op.batch_alter_table('consultas', schema=None) as batch_op:
+        batch_op.drop_index('ix_consultas_paciente_fecha_id')
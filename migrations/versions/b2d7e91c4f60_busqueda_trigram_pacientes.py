@@ -0,0 +1,60 @@
+"""Busqueda por trigramas de pacientes
+
+Revision ID: b2d7e91c4f60
+Revises: a8f3c2d1b7e4
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+import re
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'b2d7e91c4f60'
+down_revision = 'a8f3c2d1b7e4'
+branch_labels = None
+depends_on = None
+
+
+def _normalizar(*partes):
+    # Copia de app.utils.texto.normalizar_texto para no depender del código de la app
+    texto = ' '.join(str(p) for p in partes if p)
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'(?<=[0-9])[^0-9a-z]+(?=[0-9])', '', texto)
+    return re.sub(r'[^0-9a-z]+', ' ', texto).strip()
+
+
+def upgrade():
+    with op.batch_alter_table('pacientes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('busqueda', sa.String(length=300), nullable=True))
+
+    conn = op.get_bind()
+    pacientes = sa.table(
+        'pacientes',
+        sa.column('id', sa.Integer),
+        sa.column('nombre', sa.String),
+        sa.column('apellido', sa.String),
+        sa.column('cedula', sa.String),
+        sa.column('busqueda', sa.String),
+    )
+    filas = conn.execute(sa.select(pacientes.c.id, pacientes.c.nombre, pacientes.c.apellido, pacientes.c.cedula)).fetchall()
+    if filas:
+        conn.execute(
+            pacientes.update().where(pacientes.c.id == sa.bindparam('pid')).values(busqueda=sa.bindparam('texto')),
+            [{'pid': f.id, 'texto': _normalizar(f.nombre, f.apellido, f.cedula)} for f in filas]
+        )
+
+    if conn.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX IF NOT EXISTS ix_pacientes_busqueda_trgm ON pacientes USING gist (busqueda gist_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_pacientes_busqueda_trgm')
+
+    with op.batch_alter_table('pacientes', schema=None) as batch_op:
+        batch_op.drop_column('busqueda')
@@ -0,0 +1,112 @@
+"""Busqueda de texto completo en consultas
+
+Revision ID: b8d3f5a2e741
+Revises: a4e2c7d9b615
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+import re
+import unicodedata
+from collections import defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = 'b8d3f5a2e741'
+down_revision = 'a4e2c7d9b615'
+branch_labels = None
+depends_on = None
+
+LOTE = 500
+CONFIGURACION = 'spanish'
+
+
+def _normalizar(*partes):
+    # Copia de app.utils.texto.normalizar_texto para no depender del código de la app
+    texto = ' '.join(str(p) for p in partes if p)
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'(?<=[0-9])[^0-9a-z]+(?=[0-9])', '', texto)
+    return re.sub(r'[^0-9a-z]+', ' ', texto).strip()
+
+
+def _valor_documento(es_postgres):
+    # Igual que app.utils.busqueda_clinica._valor_documento
+    if not es_postgres:
+        partes = [sa.bindparam(nombre, type_=sa.String) for nombre in ('doc_diag', 'doc_motivo', 'doc_resto')]
+        return sa.func.trim(partes[0] + ' ' + partes[1] + ' ' + partes[2])
+    config = sa.cast(sa.literal(CONFIGURACION), postgresql.REGCONFIG)
+    return (
+        sa.func.setweight(sa.func.to_tsvector(config, sa.bindparam('doc_diag')), sa.literal_column("'A'"))
+        .op('||')(sa.func.setweight(sa.func.to_tsvector(config, sa.bindparam('doc_motivo')), sa.literal_column("'B'")))
+        .op('||')(sa.func.setweight(sa.func.to_tsvector(config, sa.bindparam('doc_resto')), sa.literal_column("'C'")))
+    )
+
+
+def upgrade():
+    conn = op.get_bind()
+    es_postgres = conn.dialect.name == 'postgresql'
+
+    with op.batch_alter_table('consultas', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('busqueda', sa.Text().with_variant(postgresql.TSVECTOR(), 'postgresql'), nullable=True))
+
+    with op.batch_alter_table('ordenes_estudio', schema=None) as batch_op:
+        batch_op.create_index('ix_ordenes_estudio_consulta_id', ['consulta_id'], unique=False)
+
+    # Documento de las consultas existentes, por lotes de id
+    consultas = sa.table(
+        'consultas',
+        sa.column('id', sa.Integer),
+        sa.column('motivo', sa.Text),
+        sa.column('diagnostico', sa.Text),
+        sa.column('observaciones', sa.Text),
+        sa.column('busqueda', sa.Text),
+    )
+    recetas = sa.table('recetas', sa.column('consulta_id', sa.Integer), sa.column('medicamento', sa.String))
+    ordenes = sa.table('ordenes_estudio', sa.column('consulta_id', sa.Integer), sa.column('descripcion', sa.Text))
+    actualizar = consultas.update().where(consultas.c.id == sa.bindparam('cid')).values(
+        busqueda=_valor_documento(es_postgres)
+    )
+
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(
+            sa.select(consultas.c.id, consultas.c.motivo, consultas.c.diagnostico, consultas.c.observaciones)
+            .where(consultas.c.id > ultimo_id)
+            .order_by(consultas.c.id)
+            .limit(LOTE)
+        ).fetchall()
+        if not filas:
+            break
+        ids = [f.id for f in filas]
+        extras = defaultdict(list)
+        for consulta_id, texto in conn.execute(sa.select(recetas.c.consulta_id, recetas.c.medicamento).where(recetas.c.consulta_id.in_(ids))):
+            extras[consulta_id].append(texto)
+        for consulta_id, texto in conn.execute(sa.select(ordenes.c.consulta_id, ordenes.c.descripcion).where(ordenes.c.consulta_id.in_(ids))):
+            extras[consulta_id].append(texto)
+        conn.execute(actualizar, [
+            {
+                'cid': f.id,
+                'doc_diag': _normalizar(f.diagnostico),
+                'doc_motivo': _normalizar(f.motivo),
+                'doc_resto': _normalizar(f.observaciones, *extras.get(f.id, ()))
+            }
+            for f in filas
+        ])
+        ultimo_id = ids[-1]
+
+    if es_postgres:
+        op.execute('CREATE INDEX IF NOT EXISTS ix_consultas_busqueda_gin ON consultas USING gin (busqueda)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_consultas_busqueda_gin')
+
+    with op.batch_alter_table('ordenes_estudio', schema=None) as batch_op:
+        batch_op.drop_index('ix_ordenes_estudio_consulta_id')
+
+    with op.batch_alter_table('consultas', schema=None) as batch_op:
+        batch_op.drop_column('busqueda')
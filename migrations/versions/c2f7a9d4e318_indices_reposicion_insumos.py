@@ -0,0 +1,30 @@
+"""Indices para el catalogo de insumos y la condicion de reposicion
+
+Revision ID: c2f7a9d4e318
+Revises: b8d3f5a2e741
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'c2f7a9d4e318'
+down_revision = 'b8d3f5a2e741'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_insumos_nombre_id', 'insumos', ['nombre', 'id'], unique=False)
+    # Parcial: solo los insumos activos en o por debajo del stock minimo
+    op.create_index(
+        'ix_insumos_reposicion', 'insumos', ['nombre', 'id'], unique=False,
+        postgresql_where=sa.text('activo = true AND cantidad_actual <= stock_minimo'),
+        sqlite_where=sa.text('activo = 1 AND cantidad_actual <= stock_minimo')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_insumos_reposicion', table_name='insumos')
+    op.drop_index('ix_insumos_nombre_id', table_name='insumos')
@@ -0,0 +1,33 @@
+"""Indices para paginacion por cursor de pacientes y consultas
+
+Revision ID: c5a9e3f2d814
+Revises: b2d7e91c4f60
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'c5a9e3f2d814'
+down_revision = 'b2d7e91c4f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('pacientes', schema=None) as batch_op:
+        batch_op.create_index('ix_pacientes_apellido_id', ['apellido', 'id'], unique=False)
+
+    with op.batch_alter_table('consultas', schema=None) as batch_op:
+        batch_op.create_index('ix_consultas_fecha_id', ['fecha', 'id'], unique=False)
+        batch_op.create_index('ix_consultas_medico_fecha_id', ['medico_id', 'fecha', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('consultas', schema=None) as batch_op:
+        batch_op.drop_index('ix_consultas_medico_fecha_id')
+        batch_op.drop_index('ix_consultas_fecha_id')
+
+    with op.batch_alter_table('pacientes', schema=None) as batch_op:
+        batch_op.drop_index('ix_pacientes_apellido_id')
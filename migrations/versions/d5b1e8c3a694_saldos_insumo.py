@@ -0,0 +1,40 @@
+"""Saldos de stock por insumo e indices del libro de movimientos
+
+Revision ID: d5b1e8c3a694
+Revises: c2f7a9d4e318
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'd5b1e8c3a694'
+down_revision = 'c2f7a9d4e318'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('saldos_insumo',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('insumo_id', sa.Integer(), nullable=False),
+        sa.Column('hasta', sa.DateTime(), nullable=False),
+        sa.Column('cantidad', sa.Integer(), nullable=False),
+        sa.Column('fecha_creacion', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['insumo_id'], ['insumos.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('insumo_id', 'hasta', name='uq_saldos_insumo_insumo_hasta')
+    )
+
+    with op.batch_alter_table('movimientos_insumo', schema=None) as batch_op:
+        batch_op.create_index('ix_movimientos_insumo_insumo_fecha_id', ['insumo_id', 'fecha', 'id'], unique=False)
+        batch_op.create_index('ix_movimientos_insumo_fecha', ['fecha'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('movimientos_insumo', schema=None) as batch_op:
+        batch_op.drop_index('ix_movimientos_insumo_fecha')
+        batch_op.drop_index('ix_movimientos_insumo_insumo_fecha_id')
+
+    op.drop_table('saldos_insumo')
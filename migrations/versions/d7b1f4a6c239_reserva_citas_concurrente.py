@@ -0,0 +1,51 @@
+"""Unicidad de horario de citas activas y token de idempotencia
+
+Revision ID: d7b1f4a6c239
+Revises: c5a9e3f2d814
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'd7b1f4a6c239'
+down_revision = 'c5a9e3f2d814'
+branch_labels = None
+depends_on = None
+
+CONDICION_ACTIVA = "estado IN ('pendiente', 'confirmada')"
+
+
+def upgrade():
+    conn = op.get_bind()
+    duplicados = conn.execute(sa.text(
+        "SELECT medico_id, fecha, hora, COUNT(*) FROM citas "
+        f"WHERE {CONDICION_ACTIVA} "
+        "GROUP BY medico_id, fecha, hora HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicados:
+        detalle = ', '.join(f'medico {d[0]} {d[1]} {d[2]} ({d[3]} citas)' for d in duplicados[:20])
+        raise RuntimeError(
+            'Existen citas activas duplicadas para el mismo médico y horario; '
+            f'cancele o reagende las sobrantes antes de migrar: {detalle}'
+        )
+
+    with op.batch_alter_table('citas', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('token_solicitud', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_citas_token_solicitud', ['token_solicitud'])
+
+    op.create_index(
+        'ux_citas_medico_horario_activo', 'citas', ['medico_id', 'fecha', 'hora'],
+        unique=True,
+        postgresql_where=sa.text(CONDICION_ACTIVA),
+        sqlite_where=sa.text(CONDICION_ACTIVA)
+    )
+
+
+def downgrade():
+    op.drop_index('ux_citas_medico_horario_activo', table_name='citas')
+
+    with op.batch_alter_table('citas', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_citas_token_solicitud', type_='unique')
+        batch_op.drop_column('token_solicitud')
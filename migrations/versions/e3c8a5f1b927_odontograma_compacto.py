@@ -0,0 +1,155 @@
+"""Odontograma compacto y estado actual por paciente
+
+Revision ID: e3c8a5f1b927
+Revises: d7b1f4a6c239
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = 'e3c8a5f1b927'
+down_revision = 'd7b1f4a6c239'
+branch_labels = None
+depends_on = None
+
+LOTE = 500
+
+
+def _compactar_superficie(sup):
+    if not isinstance(sup, dict):
+        return None
+    compacta = {}
+    if sup.get('procedimiento_id') not in (None, ''):
+        compacta['procedimiento_id'] = sup['procedimiento_id']
+    if sup.get('trabajado'):
+        compacta['trabajado'] = True
+    if sup.get('historico'):
+        compacta['historico'] = True
+    return compacta or None
+
+
+def _compactar(datos):
+    # Copia de app.utils.odontograma.compactar_odontograma para no depender del código de la app
+    dientes = {}
+    for numero, diente in ((datos or {}).get('dientes') or {}).items():
+        if not isinstance(diente, dict):
+            continue
+        try:
+            numero = str(int(numero))
+        except (TypeError, ValueError):
+            continue
+        compacto = {}
+        estado = diente.get('estado') or 'normal'
+        if estado != 'normal':
+            compacto['estado'] = estado
+        descripcion = (diente.get('descripcion') or '').strip()
+        if descripcion:
+            compacto['descripcion'] = descripcion
+        superficies = {}
+        for nombre, sup in (diente.get('superficies') or {}).items():
+            sup = _compactar_superficie(sup)
+            if sup:
+                superficies[nombre] = sup
+        if superficies:
+            compacto['superficies'] = superficies
+        if diente.get('trabajado'):
+            compacto['trabajado'] = True
+        if diente.get('procedimientos'):
+            compacto['procedimientos'] = diente['procedimientos']
+        if compacto:
+            dientes[numero] = compacto
+    resultado = {'dientes': dientes}
+    if (datos or {}).get('actualizado'):
+        resultado['actualizado'] = datos['actualizado']
+    return resultado
+
+
+def upgrade():
+    conn = op.get_bind()
+    es_postgres = conn.dialect.name == 'postgresql'
+    tipo_datos = sa.JSON().with_variant(postgresql.JSONB(), 'postgresql')
+
+    if es_postgres:
+        op.execute('ALTER TABLE odontogramas ALTER COLUMN datos TYPE jsonb USING datos::jsonb')
+
+    op.create_index('ix_odontogramas_paciente_fecha', 'odontogramas', ['paciente_id', 'fecha'])
+    op.create_index('ix_odontogramas_consulta_id', 'odontogramas', ['consulta_id'])
+
+    op.create_table(
+        'odontogramas_actuales',
+        sa.Column('paciente_id', sa.Integer(), sa.ForeignKey('pacientes.id'), primary_key=True),
+        sa.Column('odontograma_id', sa.Integer(), sa.ForeignKey('odontogramas.id'), nullable=False),
+        sa.Column('fecha', sa.DateTime(), nullable=False),
+        sa.Column('datos', tipo_datos, nullable=False),
+    )
+
+    # Compactar snapshots existentes y tomar el último de cada paciente
+    odontogramas = sa.table(
+        'odontogramas',
+        sa.column('id', sa.Integer),
+        sa.column('paciente_id', sa.Integer),
+        sa.column('fecha', sa.DateTime),
+        sa.column('datos', tipo_datos),
+    )
+    actuales = sa.table(
+        'odontogramas_actuales',
+        sa.column('paciente_id', sa.Integer),
+        sa.column('odontograma_id', sa.Integer),
+        sa.column('fecha', sa.DateTime),
+        sa.column('datos', tipo_datos),
+    )
+    actualizar = odontogramas.update().where(odontogramas.c.id == sa.bindparam('oid')).values(datos=sa.bindparam('compacto'))
+
+    ultimo_por_paciente = {}
+    pendientes = []
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(
+            sa.select(odontogramas.c.id, odontogramas.c.paciente_id, odontogramas.c.fecha, odontogramas.c.datos)
+            .where(odontogramas.c.id > ultimo_id)
+            .order_by(odontogramas.c.id)
+            .limit(LOTE)
+        ).fetchall()
+        if not filas:
+            break
+        for f in filas:
+            compacto = _compactar(f.datos)
+            pendientes.append({'oid': f.id, 'compacto': compacto})
+            # El más reciente por (fecha, id); los snapshots sin fecha quedan primero
+            orden = (f.fecha or datetime.min, f.id)
+            previo = ultimo_por_paciente.get(f.paciente_id)
+            if compacto['dientes'] and (previo is None or orden > previo[0]):
+                ultimo_por_paciente[f.paciente_id] = (orden, f.id, compacto)
+        conn.execute(actualizar, pendientes)
+        pendientes = []
+        ultimo_id = filas[-1].id
+
+    filas_actuales = [
+        {'paciente_id': paciente_id, 'odontograma_id': oid, 'fecha': orden[0], 'datos': compacto}
+        for paciente_id, (orden, oid, compacto) in ultimo_por_paciente.items()
+    ]
+    for i in range(0, len(filas_actuales), LOTE):
+        conn.execute(actuales.insert(), filas_actuales[i:i + LOTE])
+
+    if es_postgres:
+        op.execute(
+            'CREATE INDEX IF NOT EXISTS ix_odontogramas_actuales_datos '
+            'ON odontogramas_actuales USING gin (datos jsonb_path_ops)'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_odontogramas_actuales_datos')
+
+    op.drop_table('odontogramas_actuales')
+    op.drop_index('ix_odontogramas_consulta_id', table_name='odontogramas')
+    op.drop_index('ix_odontogramas_paciente_fecha', table_name='odontogramas')
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE odontogramas ALTER COLUMN datos TYPE json USING datos::json')
@@ -0,0 +1,40 @@
+"""Pronosticos de consumo de insumos
+
+Revision ID: e8a4c6f2b173
+Revises: d5b1e8c3a694
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'e8a4c6f2b173'
+down_revision = 'd5b1e8c3a694'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pronosticos_insumo',
+        sa.Column('insumo_id', sa.Integer(), nullable=False),
+        sa.Column('consumo_corto', sa.Numeric(precision=10, scale=3), nullable=False),
+        sa.Column('consumo_largo', sa.Numeric(precision=10, scale=3), nullable=False),
+        sa.Column('consumo_diario', sa.Numeric(precision=10, scale=3), nullable=False),
+        sa.Column('dias_cobertura', sa.Numeric(precision=10, scale=1), nullable=True),
+        sa.Column('fecha_agotamiento', sa.Date(), nullable=True),
+        sa.Column('cantidad_sugerida', sa.Integer(), nullable=False),
+        sa.Column('calculado', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['insumo_id'], ['insumos.id'], ),
+        sa.PrimaryKeyConstraint('insumo_id')
+    )
+
+    with op.batch_alter_table('movimientos_insumo', schema=None) as batch_op:
+        batch_op.create_index('ix_movimientos_insumo_consulta_id', ['consulta_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('movimientos_insumo', schema=None) as batch_op:
+        batch_op.drop_index('ix_movimientos_insumo_consulta_id')
+
+    op.drop_table('pronosticos_insumo')
@@ -0,0 +1,42 @@
+"""Eventos por diente (historia clinica de cada diente)
+
+Revision ID: f1a6d3b8c502
+Revises: e3c8a5f1b927
+Create Date: 2026-10-17 14:00:00.000000
+
+Los eventos de odontogramas anteriores se generan con el script
+reconstruir_eventos_diente.py.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'f1a6d3b8c502'
+down_revision = 'e3c8a5f1b927'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'eventos_diente',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('paciente_id', sa.Integer(), sa.ForeignKey('pacientes.id'), nullable=False),
+        sa.Column('diente', sa.SmallInteger(), nullable=False),
+        sa.Column('superficie', sa.String(length=20), nullable=True),
+        sa.Column('tipo', sa.String(length=20), nullable=False),
+        sa.Column('estado', sa.String(length=20), nullable=True),
+        sa.Column('descripcion', sa.Text(), nullable=True),
+        sa.Column('procedimiento_id', sa.Integer(), sa.ForeignKey('procedimientos.id'), nullable=True),
+        sa.Column('consulta_id', sa.Integer(), sa.ForeignKey('consultas.id'), nullable=False),
+        sa.Column('odontograma_id', sa.Integer(), sa.ForeignKey('odontogramas.id'), nullable=False),
+        sa.Column('fecha', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_eventos_diente_paciente_diente_fecha', 'eventos_diente', ['paciente_id', 'diente', 'fecha'])
+    op.create_index('ix_eventos_diente_odontograma_id', 'eventos_diente', ['odontograma_id'])
+
+
+def downgrade():
+    op.drop_index('ix_eventos_diente_odontograma_id', table_name='eventos_diente')
+    op.drop_index('ix_eventos_diente_paciente_diente_fecha', table_name='eventos_diente')
+    op.drop_table('eventos_diente')
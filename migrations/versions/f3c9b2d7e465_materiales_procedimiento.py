@@ -0,0 +1,32 @@
+"""Materiales (insumos) de los procedimientos
+
+Revision ID: f3c9b2d7e465
+Revises: e8a4c6f2b173
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'f3c9b2d7e465'
+down_revision = 'e8a4c6f2b173'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('procedimiento_insumos',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('procedimiento_id', sa.Integer(), nullable=False),
+        sa.Column('insumo_id', sa.Integer(), nullable=False),
+        sa.Column('cantidad', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['insumo_id'], ['insumos.id'], ),
+        sa.ForeignKeyConstraint(['procedimiento_id'], ['procedimientos.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('procedimiento_id', 'insumo_id', name='uq_procedimiento_insumos_procedimiento_insumo')
+    )
+
+
+def downgrade():
+    op.drop_table('procedimiento_insumos')
@@ -0,0 +1,14 @@
+"""
+Script para recalcular el pronóstico de consumo de los insumos (promedios
+móviles, días de cobertura y cantidad sugerida a reponer) que muestra la
+página de insumos. Pensado para ejecutarse programado (cron), por ejemplo
+a diario.
+"""
+from app import create_app
+from app.utils.pronostico_stock import calcular_pronosticos
+
+app = create_app()
+
+with app.app_context():
+    total = calcular_pronosticos()
+    print(f"✅ {total} insumos pronosticados")
@@ -0,0 +1,12 @@
+"""
+Script para generar la historia por diente (eventos_diente) desde los
+odontogramas ya guardados. Se puede volver a ejecutar sin duplicar eventos.
+"""
+from app import create_app
+from app.utils.odontograma import reconstruir_eventos_diente
+
+app = create_app()
+
+with app.app_context():
+    total = reconstruir_eventos_diente()
+    print(f"✅ {total} eventos por diente generados")
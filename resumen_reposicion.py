@@ -0,0 +1,17 @@
+"""
+Script para regenerar el resumen de insumos a reponer por especialidad
+(el que muestran la página de insumos y los dashboards) e imprimirlo.
+Pensado para ejecutarse programado, por ejemplo cada hora con cron.
+"""
+from app import create_app
+from app.utils.reposicion import resumen_reposicion
+
+app = create_app()
+
+with app.app_context():
+    resumen = resumen_reposicion(regenerar=True)
+    print(f"✅ {resumen['total']} insumos a reponer ({resumen['generado']})")
+    for grupo in resumen['especialidades']:
+        print(f"\n{grupo['nombre']}:")
+        for insumo in grupo['insumos']:
+            print(f"  - {insumo['nombre']}: {insumo['cantidad_actual']}/{insumo['stock_minimo']} {insumo['unidad_medida']}")
@@ -0,0 +1,78 @@
+"""Fixtures de las pruebas: aplicación con SQLite en memoria."""
+import os
+import sys
+from datetime import date, time
+
+import pytest
+from flask import g
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from app.models import Especialidad, HorarioAtencion, Medico, MedicoEspecialidad, Paciente, Usuario
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def datos(app):
+    """
+    Datos básicos: admin, un médico con turno partido de lunes a sábado
+    (08:00-12:00 cada 30 min y 14:00-18:00 cada 20 min), las especialidades
+    Ortodoncia y Tratamiento y un paciente.
+    """
+    admin = Usuario(username='admin', email='admin@example.com', rol='admin')
+    usuario_medico = Usuario(username='medico', email='medico@example.com', rol='medico')
+    for usuario in (admin, usuario_medico):
+        usuario.set_password('x')
+    ortodoncia = Especialidad(nombre='Ortodoncia', precio_consulta=100000)
+    tratamiento = Especialidad(nombre='Tratamiento', precio_consulta=0)
+    paciente = Paciente(nombre='José', apellido='Benítez', cedula='111',
+                        fecha_nacimiento=date(1990, 1, 1), sexo='M')
+    db.session.add_all([admin, usuario_medico, ortodoncia, tratamiento, paciente])
+    db.session.flush()
+
+    medico = Medico(usuario_id=usuario_medico.id, nombre='Ana', apellido='Gómez', cedula='1',
+                    registro_profesional='R1', fecha_ingreso=date(2020, 1, 1))
+    db.session.add(medico)
+    db.session.flush()
+    db.session.add_all([
+        MedicoEspecialidad(medico_id=medico.id, especialidad_id=ortodoncia.id),
+        MedicoEspecialidad(medico_id=medico.id, especialidad_id=tratamiento.id),
+    ])
+    for dia in range(6):
+        db.session.add_all([
+            HorarioAtencion(medico_id=medico.id, dia_semana=dia, hora_inicio=time(8),
+                            hora_fin=time(12), duracion_consulta=30),
+            HorarioAtencion(medico_id=medico.id, dia_semana=dia, hora_inicio=time(14),
+                            hora_fin=time(18), duracion_consulta=20),
+        ])
+    db.session.commit()
+    return {
+        'admin': admin, 'usuario_medico': usuario_medico, 'medico': medico,
+        'ortodoncia': ortodoncia, 'tratamiento': tratamiento, 'paciente': paciente,
+    }
+
+
+@pytest.fixture
+def cliente(app):
+    """Cliente de pruebas; `cliente.login(usuario)` inicia sesión como ese usuario."""
+    cliente = app.test_client()
+
+    def login(usuario):
+        # El contexto de la aplicación se comparte con las peticiones del cliente
+        g.pop('_login_user', None)
+        with cliente.session_transaction() as sesion:
+            sesion['_user_id'] = str(usuario.id)
+            sesion['_fresh'] = True
+
+    cliente.login = login
+    return cliente
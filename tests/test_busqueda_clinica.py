@@ -0,0 +1,48 @@
+"""Búsqueda de texto completo en consultas (motor sin tsquery)."""
+from datetime import date
+
+import pytest
+
+from app import db
+from app.models import Consulta, Especialidad, Medico, Paciente, Usuario
+from app.utils.busqueda_clinica import buscar_consultas
+from app.utils.texto import normalizar_consulta
+
+
+@pytest.fixture
+def consultas(app):
+    usuario = Usuario(username='medico', email='medico@example.com', rol='medico')
+    usuario.set_password('x')
+    especialidad = Especialidad(nombre='Odontología', precio_consulta=0)
+    paciente = Paciente(nombre='José', apellido='Benítez', cedula='111', fecha_nacimiento=date(1990, 1, 1), sexo='M')
+    db.session.add_all([usuario, especialidad, paciente])
+    db.session.flush()
+    medico = Medico(usuario_id=usuario.id, nombre='Ana', apellido='Gómez', cedula='1',
+                    registro_profesional='R1', fecha_ingreso=date(2020, 1, 1))
+    db.session.add(medico)
+    db.session.flush()
+    for diagnostico in ('Dolor agudo en molar', 'Caries profunda, dolor agudo',
+                        'Pulpitis irreversible', 'Dolor leve agudo'):
+        db.session.add(Consulta(paciente_id=paciente.id, medico_id=medico.id,
+                                especialidad_id=especialidad.id, diagnostico=diagnostico))
+    db.session.commit()
+
+
+def _diagnosticos(texto):
+    resultados, _ = buscar_consultas(Consulta.query, texto)
+    return sorted(c.diagnostico for c in resultados)
+
+
+def test_normalizar_consulta_conserva_sintaxis():
+    assert normalizar_consulta('"Dolor Agudo"  -Caríes OR pulpitis') == '"dolor agudo" -caries or pulpitis'
+
+
+@pytest.mark.parametrize('texto, esperados', [
+    ('dolor agudo', ['Caries profunda, dolor agudo', 'Dolor agudo en molar', 'Dolor leve agudo']),
+    ('"dolor agudo"', ['Caries profunda, dolor agudo', 'Dolor agudo en molar']),
+    ('-caries dolor', ['Dolor agudo en molar', 'Dolor leve agudo']),
+    ('caries or pulpitis', ['Caries profunda, dolor agudo', 'Pulpitis irreversible']),
+    ('"dolor agudo" -caries or pulpitis', ['Dolor agudo en molar']),
+])
+def test_sintaxis_websearch(consultas, texto, esperados):
+    assert _diagnosticos(texto) == esperados
@@ -0,0 +1,77 @@
+"""Registro de consultas (nueva_consulta)."""
+import json
+from datetime import date, time, timedelta
+
+from app import db
+from app.models import Cita, Consulta, Insumo, Procedimiento, Tratamiento, Venta
+
+
+def _cita(datos, especialidad, fecha=None, hora=time(9)):
+    cita = Cita(paciente_id=datos['paciente'].id, medico_id=datos['medico'].id,
+                especialidad_id=especialidad.id, fecha=fecha or date.today(), hora=hora,
+                estado='confirmada', motivo='Control')
+    db.session.add(cita)
+    db.session.commit()
+    return cita
+
+
+def _flashes(cliente):
+    with cliente.session_transaction() as sesion:
+        return sesion.get('_flashes', [])
+
+
+def test_plan_con_sesion_en_horario_ocupado_no_pierde_la_consulta(datos, cliente):
+    cita = _cita(datos, datos['tratamiento'])
+    fecha_sesion = date.today() + timedelta(days=7)
+    _cita(datos, datos['ortodoncia'], fecha=fecha_sesion, hora=time(10))
+    procedimiento = Procedimiento(nombre='Limpieza', especialidad_id=datos['tratamiento'].id, precio=1000)
+    db.session.add(procedimiento)
+    db.session.commit()
+
+    plan = {
+        'diagnostico_completo': 'Brackets',
+        'sesiones': [{
+            'numero_sesion': 1,
+            'fecha_programada': fecha_sesion.isoformat(),
+            'hora_programada': '10:00',
+            'procedimientos': [{'procedimiento_id': procedimiento.id, 'precio_planificado': '1000'}],
+        }],
+    }
+    cliente.login(datos['usuario_medico'])
+    respuesta = cliente.post(f'/consultorio/consultas/nueva/{cita.id}', data={
+        'motivo': 'Dolor', 'plan_tratamiento_json': json.dumps(plan),
+    })
+
+    assert respuesta.status_code == 302
+    consulta = Consulta.query.filter_by(cita_id=cita.id).one()
+    assert respuesta.headers['Location'].endswith(f'/consultorio/consultas/{consulta.id}')
+    assert Tratamiento.query.count() == 0
+    assert db.session.get(Cita, cita.id).estado == 'atendida'
+    assert any(categoria == 'warning' and 'plan de tratamiento' in mensaje
+               for categoria, mensaje in _flashes(cliente))
+
+
+def test_error_al_crear_la_venta_no_pierde_la_consulta(datos, cliente, monkeypatch):
+    from app.routes import facturacion
+
+    cita = _cita(datos, datos['ortodoncia'])
+    insumo = Insumo(nombre='Guantes', precio_venta=1000, cantidad_actual=5)
+    db.session.add(insumo)
+    db.session.commit()
+
+    def venta_con_error_de_flush(consulta, *args, **kwargs):
+        # Cita sin paciente: el flush falla con IntegrityError (NOT NULL)
+        db.session.add(Cita(medico_id=cita.medico_id, especialidad_id=cita.especialidad_id,
+                            fecha=cita.fecha, hora=time(11), estado='confirmada'))
+        db.session.flush()
+
+    monkeypatch.setattr(facturacion, '_crear_venta_pendiente_desde_consulta', venta_con_error_de_flush)
+    cliente.login(datos['usuario_medico'])
+    respuesta = cliente.post(f'/consultorio/consultas/nueva/{cita.id}', data={
+        'motivo': 'Dolor', 'insumo_id[]': [insumo.id], 'insumo_cantidad[]': ['2'],
+    })
+
+    assert respuesta.status_code == 302
+    assert Consulta.query.filter_by(cita_id=cita.id).count() == 1
+    assert Venta.query.count() == 0
+    assert db.session.get(Insumo, insumo.id).cantidad_actual == 3
@@ -0,0 +1,303 @@
+"""Motor de disponibilidad de agenda (app.utils.disponibilidad)."""
+from datetime import date, datetime, time, timedelta
+
+from flask import current_app
+
+from app import db
+from app.models import Cita, HorarioAtencion, Medico, MedicoEspecialidad, Permiso, Usuario, Vacacion
+from app.utils.disponibilidad import (
+    calendario_semanal, clave_grilla, grillas_medico, horas_libres, primeros_turnos_libres
+)
+
+LUNES = date(2030, 3, 4)
+AHORA = datetime(2030, 3, 5, 10, 0)
+
+
+def _cita(datos, fecha, hora, estado='confirmada'):
+    cita = Cita(paciente_id=datos['paciente'].id, medico_id=datos['medico'].id,
+                especialidad_id=datos['ortodoncia'].id, fecha=fecha, hora=hora, estado=estado)
+    db.session.add(cita)
+    db.session.commit()
+    return cita
+
+
+def _permiso(datos, fecha, hora_inicio=None, hora_fin=None):
+    permiso = Permiso(usuario_id=datos['usuario_medico'].id, fecha=fecha, hora_inicio=hora_inicio,
+                      hora_fin=hora_fin, tipo='personal', motivo='Trámite', estado='aprobado')
+    db.session.add(permiso)
+    db.session.commit()
+    return permiso
+
+
+def _vacacion(datos, fecha_inicio, fecha_fin):
+    vacacion = Vacacion(usuario_id=datos['usuario_medico'].id, fecha_inicio=fecha_inicio,
+                        fecha_fin=fecha_fin, estado='aprobada')
+    db.session.add(vacacion)
+    db.session.commit()
+    return vacacion
+
+
+def _slots(dia, estado=None):
+    return [s['hora'] for s in dia['slots'] if estado is None or s['estado'] == estado]
+
+
+def _calendario_referencia(medico, fecha_base, ahora):
+    """Calendario como lo armaba la API antes del motor: slot por slot, consultando listas."""
+    lunes = fecha_base - timedelta(days=fecha_base.weekday())
+    dias = [lunes + timedelta(days=i) for i in range(7)]
+    horarios = HorarioAtencion.query.filter_by(medico_id=medico.id, activo=True).order_by(HorarioAtencion.id).all()
+    vacaciones = Vacacion.query.filter_by(usuario_id=medico.usuario_id, estado='aprobada').all()
+    permisos = Permiso.query.filter_by(usuario_id=medico.usuario_id, estado='aprobado').all()
+    citas = Cita.query.filter(Cita.medico_id == medico.id, Cita.estado.in_(['pendiente', 'confirmada'])).all()
+
+    calendario = []
+    for fecha in dias:
+        del_dia = [h for h in horarios if h.dia_semana == fecha.weekday()]
+        if not del_dia:
+            calendario.append({'trabaja': False, 'slots': []})
+            continue
+        if any(v.fecha_inicio <= fecha <= v.fecha_fin for v in vacaciones):
+            calendario.append({'trabaja': True, 'en_vacaciones': True, 'slots': []})
+            continue
+        slots, vistas, rangos = [], set(), set()
+        for h in del_dia:
+            if (h.hora_inicio, h.hora_fin) in rangos:
+                continue
+            rangos.add((h.hora_inicio, h.hora_fin))
+            actual = datetime.combine(fecha, h.hora_inicio)
+            while actual < datetime.combine(fecha, h.hora_fin):
+                hora = actual.time()
+                if actual < ahora:
+                    estado = 'pasado'
+                elif any(p.fecha == fecha and (p.hora_inicio is None or p.hora_inicio <= hora < p.hora_fin)
+                         for p in permisos):
+                    estado = 'permiso'
+                elif any(c.fecha == fecha and c.hora == hora for c in citas):
+                    estado = 'ocupado'
+                else:
+                    estado = 'disponible'
+                if hora not in vistas:
+                    vistas.add(hora)
+                    slots.append({'hora': hora.strftime('%H:%M'), 'estado': estado})
+                actual += timedelta(minutes=h.duracion_consulta)
+        calendario.append({'trabaja': True, 'en_vacaciones': False, 'slots': slots})
+    return calendario
+
+
+def test_calendario_turno_partido(datos):
+    calendario = calendario_semanal(datos['medico'], LUNES + timedelta(days=2), ahora=AHORA)
+
+    assert calendario['semana_inicio'] == LUNES.isoformat()
+    assert calendario['periodo'] == 'Marzo 2030'
+    miercoles = calendario['calendario'][2]
+    assert miercoles['dia_semana'] == 'MIÉ 6'
+    # 08:00-12:00 cada 30 min y 14:00-18:00 cada 20 min
+    assert _slots(miercoles)[:2] == ['08:00', '08:30']
+    assert _slots(miercoles)[8:10] == ['14:00', '14:20']
+    assert len(_slots(miercoles)) == 8 + 12
+    assert calendario['calendario'][6] == {
+        'fecha': (LUNES + timedelta(days=6)).isoformat(), 'dia_semana': 'DOM 10',
+        'trabaja': False, 'es_pasado': False, 'slots': []
+    }
+
+
+def test_calendario_marca_pasados_permisos_y_citas(datos):
+    _permiso(datos, LUNES + timedelta(days=2), time(14), time(15))
+    _cita(datos, LUNES + timedelta(days=2), time(8, 30))
+    _cita(datos, LUNES + timedelta(days=2), time(9), estado='cancelada')
+
+    dias = calendario_semanal(datos['medico'], LUNES, ahora=AHORA)['calendario']
+
+    assert set(s['estado'] for s in dias[0]['slots']) == {'pasado'}
+    assert _slots(dias[1], 'pasado') == ['08:00', '08:30', '09:00', '09:30']
+    assert _slots(dias[2], 'permiso') == ['14:00', '14:20', '14:40']
+    assert _slots(dias[2], 'ocupado') == ['08:30']
+    assert '09:00' in _slots(dias[2], 'disponible')
+
+
+def test_calendario_vacaciones_y_permiso_de_dia_completo(datos):
+    _vacacion(datos, LUNES + timedelta(days=3), LUNES + timedelta(days=4))
+    _permiso(datos, LUNES + timedelta(days=5))
+
+    dias = calendario_semanal(datos['medico'], LUNES, ahora=AHORA)['calendario']
+
+    assert dias[3]['en_vacaciones'] and dias[4]['en_vacaciones']
+    assert dias[3]['slots'] == [] and dias[4]['slots'] == []
+    assert dias[5]['en_vacaciones'] is False
+    assert set(s['estado'] for s in dias[5]['slots']) == {'permiso'}
+
+
+def test_calendario_coincide_con_el_calculo_slot_por_slot(datos):
+    medico = datos['medico']
+    # Horario duplicado (se ignora) y uno que se solapa con el de la mañana
+    db.session.add_all([
+        HorarioAtencion(medico_id=medico.id, dia_semana=1, hora_inicio=time(8), hora_fin=time(12),
+                        duracion_consulta=15),
+        HorarioAtencion(medico_id=medico.id, dia_semana=1, hora_inicio=time(11), hora_fin=time(13),
+                        duracion_consulta=45),
+    ])
+    db.session.commit()
+    _vacacion(datos, LUNES - timedelta(days=3), LUNES)
+    _permiso(datos, LUNES + timedelta(days=1), time(10, 15), time(11, 30))
+    _permiso(datos, LUNES + timedelta(days=4))
+    for dia, hora in ((1, time(11, 45)), (2, time(16, 40)), (3, time(8))):
+        _cita(datos, LUNES + timedelta(days=dia), hora)
+
+    for ahora in (AHORA, datetime(2030, 3, 1, 9, 0), datetime(2030, 3, 7, 16, 30)):
+        calendario = calendario_semanal(medico, LUNES, ahora=ahora)['calendario']
+        referencia = _calendario_referencia(medico, LUNES, ahora)
+        assert [{k: d[k] for k in r} for d, r in zip(calendario, referencia)] == referencia
+
+
+def test_horas_libres_turno_partido(datos):
+    martes = LUNES + timedelta(days=1)
+    _cita(datos, martes, time(8, 30))
+    _cita(datos, martes, time(14, 20), estado='pendiente')
+    _cita(datos, martes, time(9), estado='cancelada')
+    # Los permisos no se descartan aquí: se validan al confirmar la cita
+    _permiso(datos, martes, time(10), time(11))
+
+    horas = horas_libres(grillas_medico(datos['medico'].id, [martes])[martes])
+
+    assert horas[:3] == ['08:00', '09:00', '09:30']
+    assert '10:00' in horas
+    assert horas[7:10] == ['14:00', '14:40', '15:00']
+    assert len(horas) == 8 + 12 - 2
+    domingo = LUNES + timedelta(days=6)
+    assert horas_libres(grillas_medico(datos['medico'].id, [domingo])[domingo]) == []
+
+
+def test_api_horarios_disponibles_por_dia_y_por_rango(datos, cliente):
+    medico_id = datos['medico'].id
+    _cita(datos, LUNES, time(8))
+    cliente.login(datos['admin'])
+
+    dia = cliente.get(f'/agendamiento/api/horarios-disponibles/{medico_id}?fecha={LUNES.isoformat()}').get_json()
+    assert dia[0] == '08:30' and len(dia) == 19
+
+    hasta = LUNES + timedelta(days=30)
+    rango = cliente.get(f'/agendamiento/api/horarios-disponibles/{medico_id}'
+                        f'?fecha={LUNES.isoformat()}&hasta={hasta.isoformat()}').get_json()
+    assert len(rango) == 31
+    assert rango[LUNES.isoformat()] == dia
+    assert rango[(LUNES + timedelta(days=6)).isoformat()] == []
+
+    respuesta = cliente.get(f'/agendamiento/api/horarios-disponibles/{medico_id}'
+                            f'?fecha={LUNES.isoformat()}&hasta={(hasta + timedelta(days=1)).isoformat()}')
+    assert respuesta.status_code == 400
+
+
+def _en_cache(medico_id, fecha):
+    return current_app.extensions['cache_disponibilidad'].get(clave_grilla(medico_id, fecha)) is not None
+
+
+def test_grillas_se_invalidan_al_confirmar_una_cita(datos):
+    medico_id = datos['medico'].id
+    martes, miercoles = LUNES + timedelta(days=1), LUNES + timedelta(days=2)
+    grillas_medico(medico_id, [martes, miercoles])
+    assert _en_cache(medico_id, martes) and _en_cache(medico_id, miercoles)
+
+    cita = Cita(paciente_id=datos['paciente'].id, medico_id=medico_id,
+                especialidad_id=datos['ortodoncia'].id, fecha=martes, hora=time(8), estado='pendiente')
+    db.session.add(cita)
+    db.session.flush()
+    # Hasta el commit la grilla cacheada sigue vigente
+    assert _en_cache(medico_id, martes)
+    db.session.commit()
+
+    assert not _en_cache(medico_id, martes)
+    assert _en_cache(medico_id, miercoles)
+    assert '08:00' not in horas_libres(grillas_medico(medico_id, [martes])[martes])
+
+    # Cancelar la cita libera el slot; cambiar solo el motivo no invalida
+    cita.motivo = 'Control'
+    db.session.commit()
+    assert _en_cache(medico_id, martes)
+    cita.estado = 'cancelada'
+    db.session.commit()
+    assert '08:00' in horas_libres(grillas_medico(medico_id, [martes])[martes])
+
+
+def test_grillas_no_se_invalidan_si_se_revierte(datos):
+    medico_id = datos['medico'].id
+    martes = LUNES + timedelta(days=1)
+    grillas_medico(medico_id, [martes])
+
+    db.session.add(Cita(paciente_id=datos['paciente'].id, medico_id=medico_id,
+                        especialidad_id=datos['ortodoncia'].id, fecha=martes, hora=time(8)))
+    db.session.flush()
+    db.session.rollback()
+
+    assert _en_cache(medico_id, martes)
+
+
+def test_grillas_se_invalidan_por_permisos_y_vacaciones(datos):
+    medico_id = datos['medico'].id
+    dias = [LUNES + timedelta(days=i) for i in range(6)]
+    grillas_medico(medico_id, dias)
+
+    permiso = _permiso(datos, dias[1], time(8), time(9))
+    assert [_en_cache(medico_id, d) for d in dias] == [True, False, True, True, True, True]
+    assert grillas_medico(medico_id, [dias[1]])[dias[1]]['slots'][:3] == [
+        ['08:00', 'permiso'], ['08:30', 'permiso'], ['09:00', 'disponible']]
+
+    _vacacion(datos, dias[3], dias[4])
+    assert [_en_cache(medico_id, d) for d in dias] == [True, True, True, False, False, True]
+    assert grillas_medico(medico_id, [dias[3]])[dias[3]]['en_vacaciones']
+
+    # Mover el permiso invalida el día anterior y el nuevo
+    grillas_medico(medico_id, dias)
+    permiso.fecha = dias[5]
+    db.session.commit()
+    assert [_en_cache(medico_id, d) for d in dias] == [True, False, True, True, True, False]
+
+
+def _otro_medico(datos, cedula, hora_inicio, hora_fin, duracion, activo=True):
+    usuario = Usuario(username=f'medico{cedula}', email=f'medico{cedula}@example.com', rol='medico')
+    usuario.set_password('x')
+    db.session.add(usuario)
+    db.session.flush()
+    medico = Medico(usuario_id=usuario.id, nombre='Luis', apellido='Pérez', cedula=cedula,
+                    registro_profesional=f'R{cedula}', fecha_ingreso=date(2020, 1, 1), activo=activo)
+    db.session.add(medico)
+    db.session.flush()
+    db.session.add(MedicoEspecialidad(medico_id=medico.id, especialidad_id=datos['ortodoncia'].id))
+    for dia in range(5):
+        db.session.add(HorarioAtencion(medico_id=medico.id, dia_semana=dia, hora_inicio=hora_inicio,
+                                       hora_fin=hora_fin, duracion_consulta=duracion))
+    db.session.commit()
+    return medico
+
+
+def test_primeros_turnos_intercala_medicos_en_orden(datos):
+    ana = datos['medico']
+    luis = _otro_medico(datos, '2', time(9), time(10), 15)
+    _otro_medico(datos, '3', time(7), time(8), 30, activo=False)
+    _cita(datos, LUNES + timedelta(days=1), time(10, 30))
+
+    turnos = primeros_turnos_libres(datos['ortodoncia'].id, 6, LUNES, LUNES + timedelta(days=6), ahora=AHORA)
+
+    assert [(inicio.strftime('%a %H:%M'), medico.id) for inicio, medico in turnos] == [
+        ('Tue 10:00', ana.id), ('Tue 11:00', ana.id), ('Tue 11:30', ana.id),
+        ('Tue 14:00', ana.id), ('Tue 14:20', ana.id), ('Tue 14:40', ana.id),
+    ]
+
+    turnos = primeros_turnos_libres(datos['ortodoncia'].id, 5, LUNES + timedelta(days=2),
+                                    LUNES + timedelta(days=2), ahora=AHORA)
+    assert [(inicio.strftime('%H:%M'), medico.id) for inicio, medico in turnos] == [
+        ('08:00', ana.id), ('08:30', ana.id), ('09:00', ana.id), ('09:00', luis.id), ('09:15', luis.id),
+    ]
+
+
+def test_primeros_turnos_salta_vacaciones_y_permisos(datos):
+    _vacacion(datos, LUNES + timedelta(days=2), LUNES + timedelta(days=3))
+    _permiso(datos, LUNES + timedelta(days=4), time(8), time(11))
+
+    turnos = primeros_turnos_libres(datos['ortodoncia'].id, 2, LUNES + timedelta(days=2),
+                                    LUNES + timedelta(days=6), ahora=AHORA)
+
+    assert [inicio for inicio, _ in turnos] == [
+        datetime.combine(LUNES + timedelta(days=4), time(11)),
+        datetime.combine(LUNES + timedelta(days=4), time(11, 30)),
+    ]
+    assert primeros_turnos_libres(datos['tratamiento'].id + 100, 5, LUNES, LUNES, ahora=AHORA) == []
@@ -0,0 +1,48 @@
+"""Conteos de los dashboards (app.utils.estadisticas)."""
+from datetime import date, time, timedelta
+
+from app import db
+from app.models import Cita, Consulta
+from app.utils.estadisticas import resumen_citas, tablero
+
+
+def _citas(datos, *filas):
+    for fecha, hora, estado in filas:
+        db.session.add(Cita(paciente_id=datos['paciente'].id, medico_id=datos['medico'].id,
+                            especialidad_id=datos['ortodoncia'].id, fecha=fecha, hora=hora,
+                            estado=estado))
+    db.session.commit()
+
+
+def test_resumen_por_fecha_y_estado(datos):
+    hoy = date.today()
+    manana = hoy + timedelta(days=1)
+    _citas(datos, (hoy, time(8), 'pendiente'), (hoy, time(9), 'confirmada'),
+           (manana, time(8), 'pendiente'), (hoy + timedelta(days=5), time(8), 'pendiente'))
+
+    resumen = resumen_citas([hoy, manana])
+
+    assert resumen.total() == 3
+    assert resumen.total(fecha=hoy) == 2
+    assert resumen.total(fecha=manana, estado='pendiente') == 1
+    assert resumen.por_medico(hoy) == {datos['medico'].id: {'pendiente': 1, 'confirmada': 1}}
+
+
+def test_tablero_medico_incluye_totales_historicos(datos):
+    hoy = date.today()
+    medico = datos['medico']
+    _citas(datos, (hoy, time(8), 'pendiente'), (hoy, time(9), 'atendida'),
+           (hoy - timedelta(days=3), time(8), 'atendida'), (hoy + timedelta(days=2), time(8), 'confirmada'))
+    # Una consulta sin cita (cobro adelantado de tratamiento) también cuenta
+    db.session.add(Consulta(paciente_id=datos['paciente'].id, medico_id=medico.id,
+                            especialidad_id=datos['ortodoncia'].id))
+    db.session.commit()
+
+    datos_tablero = tablero('medico', hoy, medico_id=medico.id)
+
+    assert datos_tablero['citas_pendientes'] == 1
+    assert datos_tablero['citas_confirmadas'] == 0
+    assert datos_tablero['pacientes_atendidos'] == 1
+    assert datos_tablero['citas_totales'] == 4
+    assert datos_tablero['consultas_completadas'] == 1
+
@@ -0,0 +1,112 @@
+"""Odontograma compacto, estado actual y eventos por diente (app.utils.odontograma)."""
+from datetime import datetime
+
+from app import db
+from app.models import Consulta, EventoDiente, Odontograma, OdontogramaActual, Procedimiento
+from app.utils.odontograma import (compactar_odontograma, historial_dientes, odontograma_actual,
+                                   reconstruir_eventos_diente, registrar_odontograma)
+
+
+def _consulta(datos):
+    consulta = Consulta(paciente_id=datos['paciente'].id, medico_id=datos['medico'].id,
+                        especialidad_id=datos['ortodoncia'].id)
+    db.session.add(consulta)
+    db.session.flush()
+    return consulta
+
+
+def _registrar(datos, dientes, fecha):
+    odontograma = registrar_odontograma(_consulta(datos), {'dientes': dientes}, fecha=fecha)
+    db.session.commit()
+    return odontograma
+
+
+def test_compactar_quita_valores_por_defecto():
+    vacia = {'procedimiento_id': None, 'trabajado': False, 'historico': False}
+    datos = {
+        'dientes': {
+            '11': {'estado': 'normal', 'descripcion': '  ', 'superficies': {'oclusal': dict(vacia)}},
+            '12': {'estado': 'evaluado', 'descripcion': ' Caries ',
+                   'superficies': {'oclusal': {'procedimiento_id': '3', 'trabajado': True, 'historico': False},
+                                   'distal': dict(vacia)}},
+            'x': {'estado': 'evaluado'},
+        },
+        'actualizado': '2030-03-04',
+    }
+
+    assert compactar_odontograma(datos) == {
+        'dientes': {'12': {'estado': 'evaluado', 'descripcion': 'Caries',
+                           'superficies': {'oclusal': {'procedimiento_id': '3', 'trabajado': True}}}},
+        'actualizado': '2030-03-04',
+    }
+
+
+def test_odontograma_sin_datos_no_se_guarda(datos):
+    consulta = _consulta(datos)
+
+    assert registrar_odontograma(consulta, {'dientes': {'11': {'estado': 'normal'}}}) is None
+    assert Odontograma.query.count() == 0
+    assert odontograma_actual(datos['paciente'].id) == {}
+
+
+def test_estado_actual_sigue_al_ultimo_odontograma(datos):
+    paciente_id = datos['paciente'].id
+
+    primero = _registrar(datos, {'11': {'estado': 'evaluado'}}, datetime(2030, 3, 4, 9))
+    actual = db.session.get(OdontogramaActual, paciente_id)
+    assert actual.odontograma_id == primero.id
+    assert odontograma_actual(paciente_id) == {'dientes': {'11': {'estado': 'evaluado'}}}
+
+    segundo = _registrar(datos, {'11': {'estado': 'terminado'}}, datetime(2030, 3, 11, 9))
+    assert db.session.get(OdontogramaActual, paciente_id).odontograma_id == segundo.id
+    assert odontograma_actual(paciente_id) == {'dientes': {'11': {'estado': 'terminado'}}}
+
+    # Un snapshot con fecha anterior (carga tardía) no pisa el estado actual
+    _registrar(datos, {'11': {'estado': 'evaluado'}}, datetime(2030, 3, 8, 9))
+    assert db.session.get(OdontogramaActual, paciente_id).odontograma_id == segundo.id
+    assert OdontogramaActual.query.count() == 1
+    assert Odontograma.query.count() == 3
+
+
+def _eventos():
+    return [
+        (e.diente, e.superficie, e.tipo, e.estado, e.procedimiento_id)
+        for e in EventoDiente.query.order_by(EventoDiente.fecha, EventoDiente.diente, EventoDiente.id)
+    ]
+
+
+def test_eventos_por_diente(datos):
+    limpieza = Procedimiento(nombre='Limpieza', especialidad_id=datos['ortodoncia'].id, precio=1000)
+    db.session.add(limpieza)
+    db.session.commit()
+    trabajada = {'procedimiento_id': limpieza.id, 'trabajado': True}
+    # Procedimiento borrado del catálogo: su evento se descarta
+    inexistente = {'procedimiento_id': limpieza.id + 100, 'trabajado': True}
+
+    _registrar(datos, {
+        '11': {'estado': 'evaluado', 'superficies': {'oclusal': trabajada, 'distal': inexistente}},
+        '12': {'superficies': {'mesial': dict(trabajada, historico=True)}},
+        # Formato antiguo: procedimientos a nivel de diente
+        '21': {'trabajado': True, 'procedimientos': [{'id': limpieza.id}]},
+    }, datetime(2030, 3, 4, 9))
+    # Solo cambia el estado del diente 11; los trabajos anteriores no se repiten
+    _registrar(datos, {'11': {'estado': 'terminado'}}, datetime(2030, 3, 11, 9))
+
+    primera = [
+        (11, None, 'estado', 'evaluado', None),
+        (11, 'oclusal', 'procedimiento', None, limpieza.id),
+        (21, None, 'procedimiento', None, limpieza.id),
+    ]
+    segunda = [(11, None, 'estado', 'terminado', None)]
+    assert _eventos() == primera + segunda
+
+    historial = historial_dientes(datos['paciente'].id)
+    assert sorted(historial) == [11, 21]
+    assert [(e['tipo'], e['estado'], e['procedimiento']) for e in historial[11]] == [
+        ('estado', 'evaluado', None), ('procedimiento', None, 'Limpieza'), ('estado', 'terminado', None)]
+    assert historial[11][0]['medico'] == 'Ana Gómez'
+    assert list(historial_dientes(datos['paciente'].id, diente=21)) == [21]
+
+    # La reconstrucción desde los snapshots produce los mismos eventos, sin duplicar
+    assert reconstruir_eventos_diente() == 4
+    assert _eventos() == primera + segunda
@@ -0,0 +1,89 @@
+"""Paginación por cursor (app.utils.paginacion)."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import Consulta, Paciente
+from app.routes.agendamiento import ORDEN_PACIENTES
+from app.routes.consultorio import ORDEN_CONSULTAS
+from app.utils.paginacion import iterar_keyset, paginar_keyset
+
+
+@pytest.fixture
+def pacientes(app):
+    # Apellidos repetidos: el desempate por id tiene que cruzar los cortes de página
+    apellidos = ['Benítez', 'Acosta', 'Benítez', 'Benítez', 'Cabrera', 'Acosta', 'Benítez']
+    db.session.add_all([
+        Paciente(nombre=f'P{i}', apellido=apellido, cedula=str(100 + i),
+                 fecha_nacimiento=date(1990, 1, 1), sexo='F')
+        for i, apellido in enumerate(apellidos)
+    ])
+    db.session.commit()
+    return Paciente.query.order_by(Paciente.apellido, Paciente.id).all()
+
+
+def _ids(pagina):
+    return [p.id for p in pagina]
+
+
+def test_avanzar_y_retroceder_con_empates(pacientes):
+    esperado = [p.id for p in pacientes]
+    query = Paciente.query
+
+    paginas = [paginar_keyset(query, ORDEN_PACIENTES, por_pagina=3)]
+    while paginas[-1].has_next:
+        paginas.append(paginar_keyset(query, ORDEN_PACIENTES, por_pagina=3, despues=paginas[-1].siguiente))
+
+    assert [_ids(p) for p in paginas] == [esperado[0:3], esperado[3:6], esperado[6:]]
+    assert not paginas[0].has_prev
+    assert paginas[1].has_prev and paginas[2].has_prev
+
+    # Volviendo hacia atrás se obtienen exactamente las mismas páginas
+    actual = paginas[-1]
+    for pagina in reversed(paginas[:-1]):
+        actual = paginar_keyset(query, ORDEN_PACIENTES, por_pagina=3, antes=actual.anterior)
+        assert _ids(actual) == _ids(pagina)
+        assert actual.has_next
+    # De vuelta en la primera página ya no hay anterior
+    assert not actual.has_prev
+
+
+def test_retroceder_a_una_primera_pagina_incompleta(pacientes):
+    query = Paciente.query
+    segunda = paginar_keyset(query, ORDEN_PACIENTES, por_pagina=3,
+                             despues=paginar_keyset(query, ORDEN_PACIENTES, por_pagina=2).siguiente)
+
+    primera = paginar_keyset(query, ORDEN_PACIENTES, por_pagina=3, antes=segunda.anterior)
+
+    assert _ids(primera) == [p.id for p in pacientes[:2]]
+    assert not primera.has_prev and primera.has_next
+
+
+def test_orden_descendente_con_fechas_repetidas(datos):
+    base = datetime(2030, 3, 4, 9, 0)
+    fechas = [base, base, base + timedelta(hours=1), base, base + timedelta(hours=1)]
+    db.session.add_all([
+        Consulta(paciente_id=datos['paciente'].id, medico_id=datos['medico'].id,
+                 especialidad_id=datos['ortodoncia'].id, fecha=fecha)
+        for fecha in fechas
+    ])
+    db.session.commit()
+    esperado = [c.id for c in Consulta.query.order_by(Consulta.fecha.desc(), Consulta.id.desc())]
+
+    primera = paginar_keyset(Consulta.query, ORDEN_CONSULTAS, por_pagina=2)
+    segunda = paginar_keyset(Consulta.query, ORDEN_CONSULTAS, por_pagina=2, despues=primera.siguiente)
+    tercera = paginar_keyset(Consulta.query, ORDEN_CONSULTAS, por_pagina=2, despues=segunda.siguiente)
+
+    assert _ids(primera) + _ids(segunda) + _ids(tercera) == esperado
+    assert not tercera.has_next
+    atras = paginar_keyset(Consulta.query, ORDEN_CONSULTAS, por_pagina=2, antes=tercera.anterior)
+    assert _ids(atras) == _ids(segunda)
+    assert [c.id for c in iterar_keyset(Consulta.query, ORDEN_CONSULTAS, lote=2)] == esperado
+
+
+def test_cursor_invalido_vuelve_a_la_primera_pagina(pacientes):
+    pagina = paginar_keyset(Paciente.query, ORDEN_PACIENTES, por_pagina=3, despues='no-es-un-cursor')
+
+    assert _ids(pagina) == [p.id for p in pacientes[:3]]
+    assert not pagina.has_prev
@@ -0,0 +1,93 @@
+"""Resolución de precios de procedimientos (app.utils.precios)."""
+from decimal import Decimal
+
+import pytest
+from flask import current_app
+
+from app import db
+from app.models import Procedimiento, ProcedimientoPrecio
+from app.utils.precios import clave_precios, resolve, resolve_many
+
+
+@pytest.fixture
+def procedimiento(datos):
+    procedimiento = Procedimiento(nombre='Limpieza', especialidad_id=datos['ortodoncia'].id, precio=1000)
+    db.session.add(procedimiento)
+    db.session.commit()
+    return procedimiento
+
+
+def _precio(procedimiento, precio, medico=None, especialidad=None):
+    fila = ProcedimientoPrecio(procedimiento_id=procedimiento.id, precio=precio,
+                               medico_id=medico.id if medico else None,
+                               especialidad_id=especialidad.id if especialidad else None)
+    db.session.add(fila)
+    db.session.commit()
+    return fila
+
+
+def _en_cache(procedimiento):
+    return current_app.extensions['cache_precios'].get(clave_precios(procedimiento.id)) is not None
+
+
+def test_prioridad_medico_especialidad_base(datos, procedimiento):
+    medico, ortodoncia, tratamiento = datos['medico'], datos['ortodoncia'], datos['tratamiento']
+    _precio(procedimiento, 1500, especialidad=ortodoncia)
+    _precio(procedimiento, 2000, medico=medico)
+    # A igualdad de clave gana el registro más antiguo
+    _precio(procedimiento, 9999, medico=medico)
+
+    precios = resolve_many([
+        (procedimiento.id, medico.id, ortodoncia.id),
+        (procedimiento.id, medico.id + 1, ortodoncia.id),
+        (procedimiento.id, medico.id + 1, tratamiento.id),
+        (procedimiento.id, None, None),
+        (procedimiento.id + 100, medico.id, ortodoncia.id),
+    ])
+
+    assert precios == {
+        (procedimiento.id, medico.id, ortodoncia.id): Decimal('2000.00'),
+        (procedimiento.id, medico.id + 1, ortodoncia.id): Decimal('1500.00'),
+        (procedimiento.id, medico.id + 1, tratamiento.id): Decimal('1000.00'),
+        (procedimiento.id, None, None): Decimal('1000.00'),
+        (procedimiento.id + 100, medico.id, ortodoncia.id): Decimal('0'),
+    }
+
+
+def test_cambios_de_precio_invalidan_al_confirmar(datos, procedimiento):
+    medico, ortodoncia = datos['medico'], datos['ortodoncia']
+    assert resolve(procedimiento.id, medico.id, ortodoncia.id) == Decimal('1000.00')
+    assert _en_cache(procedimiento)
+
+    fila = ProcedimientoPrecio(procedimiento_id=procedimiento.id, especialidad_id=ortodoncia.id, precio=1200)
+    db.session.add(fila)
+    db.session.flush()
+    # Hasta el commit se sigue leyendo la fila cacheada
+    assert _en_cache(procedimiento)
+    db.session.commit()
+    assert not _en_cache(procedimiento)
+    assert resolve(procedimiento.id, medico.id, ortodoncia.id) == Decimal('1200.00')
+
+    fila.precio = 1300
+    db.session.commit()
+    assert resolve(procedimiento.id, medico.id, ortodoncia.id) == Decimal('1300.00')
+
+    db.session.delete(fila)
+    db.session.commit()
+    procedimiento.precio = 800
+    db.session.commit()
+    assert resolve(procedimiento.id, medico.id, ortodoncia.id) == Decimal('800.00')
+
+
+def test_rollback_y_cambios_ajenos_no_invalidan(datos, procedimiento):
+    resolve(procedimiento.id)
+
+    procedimiento.precio = 5000
+    db.session.flush()
+    db.session.rollback()
+    assert _en_cache(procedimiento)
+
+    procedimiento.descripcion = 'Profilaxis'
+    db.session.commit()
+    assert _en_cache(procedimiento)
+    assert resolve(procedimiento.id) == Decimal('1000.00')
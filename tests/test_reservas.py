@@ -0,0 +1,119 @@
+"""Reserva de turnos (app.utils.reservas)."""
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from app import db
+from app.models import Cita, Vacacion
+from app.utils import reservas
+from app.utils.reservas import (ConflictoHorario, SolicitudDuplicada, confirmar_reserva,
+                                fechas_recurrentes, reservar_turnos)
+
+LUNES = date(2030, 3, 4)
+AHORA = datetime(2030, 3, 1, 9, 0)
+
+
+def _datos_cita(datos):
+    return {'paciente_id': datos['paciente'].id, 'especialidad_id': datos['ortodoncia'].id, 'motivo': 'Control'}
+
+
+def _cita(datos, fecha, hora, token=None):
+    cita = Cita(medico_id=datos['medico'].id, fecha=fecha, hora=hora, estado='confirmada',
+                token_solicitud=token, **_datos_cita(datos))
+    db.session.add(cita)
+    db.session.commit()
+    return cita
+
+
+def test_serie_semanal_se_reserva_completa(datos):
+    turnos = [(fecha, time(9)) for fecha in fechas_recurrentes(LUNES, 7, 4)]
+
+    creadas, conflictos = reservar_turnos(datos['medico'], _datos_cita(datos), turnos, token='t1', ahora=AHORA)
+
+    assert conflictos == []
+    assert [(fecha, hora) for _, fecha, hora in creadas] == turnos
+    assert Cita.query.count() == 4
+    assert Cita.query.filter_by(token_solicitud='t1').one().fecha == LUNES
+
+
+def test_conflicto_cancela_toda_la_serie(datos):
+    _cita(datos, LUNES + timedelta(days=7), time(9))
+    db.session.add(Vacacion(usuario_id=datos['usuario_medico'].id, fecha_inicio=LUNES + timedelta(days=14),
+                            fecha_fin=LUNES + timedelta(days=14), estado='aprobada'))
+    db.session.commit()
+    turnos = [(fecha, time(9)) for fecha in fechas_recurrentes(LUNES, 7, 4)] + [(LUNES, time(12, 30))]
+
+    with pytest.raises(ConflictoHorario) as error:
+        reservar_turnos(datos['medico'], _datos_cita(datos), turnos, ahora=AHORA)
+
+    assert error.value.conflictos == [
+        (LUNES + timedelta(days=7), time(9), 'ocupado'),
+        (LUNES + timedelta(days=14), time(9), 'vacaciones'),
+        (LUNES, time(12, 30), 'fuera_de_horario'),
+    ]
+    assert Cita.query.count() == 1
+
+
+def test_omitir_conflictos_reserva_los_turnos_libres(datos):
+    _cita(datos, LUNES, time(9))
+    turnos = [(LUNES, time(9)), (LUNES, time(9, 30)), (LUNES, time(9, 30)), (LUNES - timedelta(days=7), time(9))]
+
+    creadas, conflictos = reservar_turnos(datos['medico'], _datos_cita(datos), turnos,
+                                          omitir_conflictos=True, ahora=AHORA)
+
+    assert [(fecha, hora) for _, fecha, hora in creadas] == [(LUNES, time(9, 30))]
+    assert [motivo for _, _, motivo in conflictos] == ['ocupado', 'duplicado', 'pasado']
+
+
+def test_turno_tomado_entre_la_validacion_y_el_commit(datos, monkeypatch):
+    validar = reservas.validar_turnos
+    llamadas = []
+
+    def validar_y_reservar_antes(medico, turnos, ahora=None):
+        resultado = validar(medico, turnos, ahora)
+        if not llamadas:
+            # Otra reserva confirma el mismo turno después de la validación
+            _cita(datos, LUNES, time(9))
+        llamadas.append(turnos)
+        return resultado
+
+    monkeypatch.setattr(reservas, 'validar_turnos', validar_y_reservar_antes)
+
+    with pytest.raises(ConflictoHorario) as error:
+        reservar_turnos(datos['medico'], _datos_cita(datos), [(LUNES, time(9)), (LUNES, time(10))],
+                        ahora=AHORA)
+
+    assert error.value.conflictos == [(LUNES, time(9), 'ocupado')]
+    assert len(llamadas) == 2
+    assert Cita.query.count() == 1
+
+
+def test_token_repetido_es_solicitud_duplicada(datos):
+    turnos = [(LUNES, time(9)), (LUNES + timedelta(days=7), time(9))]
+    reservar_turnos(datos['medico'], _datos_cita(datos), turnos, token='t1', ahora=AHORA)
+    original = Cita.query.filter_by(token_solicitud='t1').one()
+
+    with pytest.raises(SolicitudDuplicada) as error:
+        reservar_turnos(datos['medico'], _datos_cita(datos), turnos, token='t1', ahora=AHORA)
+
+    assert error.value.cita.id == original.id
+    assert Cita.query.count() == 2
+
+
+def test_confirmar_reserva_distingue_duplicado_y_conflicto(datos):
+    original = _cita(datos, LUNES, time(9), token='t1')
+
+    # Reenvío del mismo formulario: mismo token, aunque el horario esté libre
+    reenvio = Cita(medico_id=datos['medico'].id, fecha=LUNES, hora=time(10), token_solicitud='t1',
+                   **_datos_cita(datos))
+    db.session.add(reenvio)
+    with pytest.raises(SolicitudDuplicada) as error:
+        confirmar_reserva(reenvio, token='t1')
+    assert error.value.cita.id == original.id
+
+    cita = Cita(medico_id=datos['medico'].id, fecha=LUNES, hora=time(9), token_solicitud='t2',
+                **_datos_cita(datos))
+    db.session.add(cita)
+    with pytest.raises(ConflictoHorario):
+        confirmar_reserva(cita, token='t2')
+    assert Cita.query.count() == 1
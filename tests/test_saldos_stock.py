@@ -0,0 +1,90 @@
+"""Saldos de stock en el tiempo (app.utils.saldos_stock)."""
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models import Insumo, MovimientoInsumo, SaldoInsumo
+from app.utils.saldos_stock import compactar_saldos, stock_en
+
+# Stock cargado al crear el insumo, sin movimiento que lo registre
+STOCK_INICIAL = 7
+
+MOVIMIENTOS = [
+    (datetime(2030, 1, 10, 12), 'entrada', 20),
+    # Salida anterior al servicio de stock, registrada en positivo
+    (datetime(2030, 1, 20, 12), 'salida', 5),
+    (datetime(2030, 2, 5, 12), 'salida', -3),
+    (datetime(2030, 2, 15, 12), 'ajuste', -2),
+    (datetime(2030, 3, 3, 12), 'entrada', 10),
+    (datetime(2030, 4, 2, 12), 'salida', -4),
+]
+
+INSTANTES = [datetime(2030, 1, 1), datetime(2030, 1, 15), datetime(2030, 2, 1), datetime(2030, 2, 10),
+             datetime(2030, 3, 1), datetime(2030, 3, 31), datetime(2030, 4, 1), datetime(2030, 4, 5)]
+
+
+def _variacion(tipo, cantidad):
+    return {'salida': -abs(cantidad), 'entrada': abs(cantidad)}.get(tipo, cantidad)
+
+
+def _esperado(momento, movimientos=MOVIMIENTOS):
+    return STOCK_INICIAL + sum(_variacion(t, c) for fecha, t, c in movimientos if fecha < momento)
+
+
+def _mover(insumo, fecha, tipo, cantidad):
+    db.session.add(MovimientoInsumo(insumo_id=insumo.id, tipo=tipo, cantidad=cantidad, fecha=fecha))
+    insumo.cantidad_actual += _variacion(tipo, cantidad)
+
+
+@pytest.fixture
+def insumo(app):
+    insumo = Insumo(nombre='Guantes', precio_venta=1000, cantidad_actual=STOCK_INICIAL,
+                    fecha_creacion=datetime(2029, 12, 1))
+    db.session.add(insumo)
+    db.session.flush()
+    for movimiento in MOVIMIENTOS:
+        _mover(insumo, *movimiento)
+    db.session.commit()
+    return insumo
+
+
+def test_stock_en_sin_saldos_se_calcula_hacia_atras(insumo):
+    assert insumo.cantidad_actual == _esperado(datetime.max)
+    for momento in INSTANTES:
+        assert stock_en(momento, [insumo.id]) == {insumo.id: _esperado(momento)}
+    assert stock_en(datetime(2030, 1, 1)) == {insumo.id: STOCK_INICIAL}
+    assert stock_en(datetime(2029, 11, 1)) == {}
+
+
+def test_compactar_saldos_mensuales(insumo):
+    assert compactar_saldos(ahora=datetime(2030, 4, 10), periodo='mensual') == 3
+
+    saldos = [(s.hasta, s.cantidad) for s in SaldoInsumo.query.order_by(SaldoInsumo.hasta)]
+    assert saldos == [(datetime(2030, m, 1), _esperado(datetime(2030, m, 1))) for m in (2, 3, 4)]
+    for momento in INSTANTES:
+        assert stock_en(momento, [insumo.id]) == {insumo.id: _esperado(momento)}
+
+    # Volver a ejecutarlo no duplica; más adelante avanza desde el último saldo
+    assert compactar_saldos(ahora=datetime(2030, 4, 20), periodo='mensual') == 0
+    _mover(insumo, datetime(2030, 5, 8), 'salida', 6)
+    db.session.commit()
+    movimientos = MOVIMIENTOS + [(datetime(2030, 5, 8), 'salida', 6)]
+    assert compactar_saldos(ahora=datetime(2030, 6, 2), periodo='mensual') == 2
+    assert [(s.hasta, s.cantidad) for s in SaldoInsumo.query.order_by(SaldoInsumo.hasta)][-2:] == [
+        (datetime(2030, 5, 1), _esperado(datetime(2030, 5, 1), movimientos)),
+        (datetime(2030, 6, 1), _esperado(datetime(2030, 6, 1), movimientos)),
+    ]
+    for momento in INSTANTES + [datetime(2030, 5, 8), datetime(2030, 5, 9), datetime(2030, 7, 1)]:
+        assert stock_en(momento, [insumo.id]) == {insumo.id: _esperado(momento, movimientos)}
+
+
+def test_compactar_saldos_diarios(insumo):
+    assert compactar_saldos(ahora=datetime(2030, 3, 4, 8), periodo='diario') == 5
+
+    assert [s.hasta for s in SaldoInsumo.query.order_by(SaldoInsumo.hasta)] == [
+        datetime(2030, 1, 11), datetime(2030, 1, 21), datetime(2030, 2, 6), datetime(2030, 2, 16),
+        datetime(2030, 3, 4),
+    ]
+    for momento in INSTANTES:
+        assert stock_en(momento, [insumo.id]) == {insumo.id: _esperado(momento)}
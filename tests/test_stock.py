@@ -0,0 +1,54 @@
+"""Movimientos de stock y su efecto en el resumen de reposición."""
+from app import db
+from app.models import Insumo, MovimientoInsumo
+from app.utils.reposicion import resumen_reposicion
+from app.utils.stock import descontar_stock
+
+
+def _insumo(cantidad=10, minimo=5):
+    insumo = Insumo(nombre='Guantes', precio_venta=1000, cantidad_actual=cantidad, stock_minimo=minimo)
+    db.session.add(insumo)
+    db.session.commit()
+    return insumo
+
+
+def test_resumen_cambia_al_confirmar_descuento(app):
+    insumo = _insumo()
+    assert resumen_reposicion()['total'] == 0
+
+    descontar_stock([(insumo.id, 6)], 'Uso en consulta')
+    # El savepoint del movimiento no invalida el resumen antes del commit
+    assert resumen_reposicion()['total'] == 0
+
+    db.session.commit()
+    assert resumen_reposicion()['total'] == 1
+
+
+def test_resumen_se_mantiene_si_se_revierte(app):
+    insumo = _insumo()
+    assert resumen_reposicion()['total'] == 0
+
+    descontar_stock([(insumo.id, 6)], 'Uso en consulta')
+    db.session.rollback()
+    assert resumen_reposicion()['total'] == 0
+
+
+def test_ajuste_restar_mas_que_el_stock_lo_deja_en_cero(datos, cliente):
+    insumo = _insumo(cantidad=5)
+    cliente.login(datos['admin'])
+
+    respuesta = cliente.post(f'/consultorio/insumos/{insumo.id}/ajustar', data={'accion': 'restar', 'cantidad': '100'})
+
+    assert respuesta.status_code == 302
+    assert db.session.get(Insumo, insumo.id).cantidad_actual == 0
+    movimiento = MovimientoInsumo.query.filter_by(insumo_id=insumo.id).one()
+    assert (movimiento.tipo, movimiento.cantidad) == ('ajuste', -5)
+
+
+def test_ajuste_restar_dentro_del_stock(datos, cliente):
+    insumo = _insumo(cantidad=5)
+    cliente.login(datos['admin'])
+
+    cliente.post(f'/consultorio/insumos/{insumo.id}/ajustar', data={'accion': 'restar', 'cantidad': '2'})
+
+    assert db.session.get(Insumo, insumo.id).cantidad_actual == 3